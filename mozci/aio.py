@@ -0,0 +1,129 @@
+"""
+This module lets us query and trigger without blocking the caller.
+
+Every function in here has the same arguments as the function of the same name in
+mozci.mozci or in mozci.sources and it returns a multiprocessing AsyncResult instead of
+the value. Every service has a pool of LIMITS[service] threads so the calls waiting for
+a busy service never hold up the calls to the others. The sources share the connections
+of mozci.utils.transfer.get_session().
+
+.. code-block:: python
+
+    from mozci import aio
+
+    tip = aio.query_repo_tip("https://hg.mozilla.org/integration/mozilla-inbound")
+    jobs = aio.query_jobs_schedule("mozilla-inbound", "146071751b1e")
+    tip, jobs = aio.gather([tip, jobs])
+
+Services with an event loop can poll AsyncResult.ready() or block on a thread of
+their own with wait() or gather().
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from mozci import mozci
+from mozci.sources import allthethings, buildapi, pushlog, tc
+from mozci.utils.concurrency import MAX_WORKERS
+
+LOG = logging.getLogger('mozci')
+# Maximum number of calls running at the same time for every service.
+# The mozci functions share module state (e.g. the query source) so they run one at a time.
+LIMITS = {
+    "allthethings": 1,
+    "buildapi": MAX_WORKERS,
+    # Queries through a QueryApi (buildapi or treeherder)
+    "jobs": MAX_WORKERS,
+    "mozci": 1,
+    "pushlog": MAX_WORKERS,
+    "taskcluster": MAX_WORKERS,
+}
+# Pool of threads of every service
+POOLS = {}
+# AsyncResult.get() without a timeout cannot be interrupted with Ctrl+C
+WAIT_TIMEOUT = 365 * 24 * 60 * 60
+_LOCK = threading.Lock()
+
+
+def _pool(service):
+    """Return the pool of threads running the calls to 'service'."""
+    with _LOCK:
+        if service not in POOLS:
+            POOLS[service] = ThreadPool(LIMITS[service])
+        return POOLS[service]
+
+
+def submit(service, function, *args, **kwargs):
+    """Call 'function' on the pool of 'service' once it has a free thread; return an AsyncResult."""
+    return _pool(service).apply_async(function, args, kwargs)
+
+
+def wait(async_result, timeout=WAIT_TIMEOUT):
+    """Block until 'async_result' is ready and return its value (or raise its exception)."""
+    return async_result.get(timeout)
+
+
+def gather(async_results, timeout=WAIT_TIMEOUT):
+    """Block until all 'async_results' are ready and return their values in order."""
+    return [wait(async_result, timeout) for async_result in async_results]
+
+
+def shutdown():
+    """Wait for the pending calls and stop the pools."""
+    with _LOCK:
+        pools = POOLS.values()
+        POOLS.clear()
+    for pool in pools:
+        pool.close()
+        pool.join()
+
+
+def _make_async(service, function):
+    """Return a version of 'function' which runs through submit()."""
+    def _async(*args, **kwargs):
+        return submit(service, function, *args, **kwargs)
+
+    _async.__name__ = function.__name__
+    _async.__doc__ = "Asynchronous version of %s.%s." % (function.__module__, function.__name__)
+    return _async
+
+
+# pushlog
+query_revisions_range = _make_async("pushlog", pushlog.query_revisions_range)
+query_pushid_range = _make_async("pushlog", pushlog.query_pushid_range)
+query_revision_info = _make_async("pushlog", pushlog.query_revision_info)
+query_repo_tip = _make_async("pushlog", pushlog.query_repo_tip)
+valid_revision = _make_async("pushlog", pushlog.valid_revision)
+
+# buildapi
+query_jobs_schedule = _make_async("buildapi", buildapi.query_jobs_schedule)
+query_repositories = _make_async("buildapi", buildapi.query_repositories)
+trigger_arbitrary_job = _make_async("buildapi", buildapi.trigger_arbitrary_job)
+make_retrigger_request = _make_async("buildapi", buildapi.make_retrigger_request)
+make_cancel_request = _make_async("buildapi", buildapi.make_cancel_request)
+
+# allthethings
+fetch_allthethings_data = _make_async("allthethings", allthethings.fetch_allthethings_data)
+
+# taskcluster
+retrigger_task = _make_async("taskcluster", tc.retrigger_task)
+
+# mozci
+trigger = _make_async("mozci", mozci.trigger)
+trigger_job = _make_async("mozci", mozci.trigger_job)
+trigger_range = _make_async("mozci", mozci.trigger_range)
+trigger_range_for_builders = _make_async("mozci", mozci.trigger_range_for_builders)
+find_backfill_revlist = _make_async("mozci", mozci.find_backfill_revlist)
+
+
+def query_matching_jobs(query_api, repo_name, revision, buildername):
+    """Asynchronous version of query_api.get_matching_jobs."""
+    return submit("jobs", query_api.get_matching_jobs, repo_name, revision, buildername)
+
+
+def query_job_status(query_api, job):
+    """Asynchronous version of query_api.get_job_status."""
+    return submit("jobs", query_api.get_job_status, job)
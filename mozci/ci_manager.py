@@ -9,14 +9,20 @@ Defined in here:
 """
 from __future__ import absolute_import
 
+import fnmatch
+import logging
+
 from abc import ABCMeta, abstractmethod
 
+from mozci.query_jobs import BuildApi, UNKNOWN, expire_jobs
 from mozci.sources import (
     buildapi,
     buildbot_bridge,
     tc
 )
 
+LOG = logging.getLogger('mozci')
+
 
 class BaseCIManager:
     """ Base class for common interactions with our continuos integration systems. """
@@ -69,8 +75,80 @@ class BuildAPIManager(BaseCIManager):
             *args,
             **kwargs)
 
-    def cancel_all(self, repo_name, revision, *args, **kwargs):
-        pass
+    def cancel_all(self, repo_name, revision, filters=None, dry_run=True, **kwargs):
+        """ Cancel the pending and running jobs of a revision.
+
+        :param repo_name: e.g. mozilla-inbound
+        :type repo_name: str
+        :param revision: 12-chars representing a push
+        :type revision: str
+        :param filters: Only the jobs whose buildername matches one of these
+                        shell-style patterns (e.g. "*talos*") are cancelled.
+        :type filters: list
+        :returns: A report with a dictionary for every job with its "buildername",
+                  "status" (PENDING, RUNNING or UNKNOWN), "request_id", "outcome"
+                  ("cancelled", "dry run", "failed" or "skipped") and "error".
+                  Jobs with an UNKNOWN status are skipped.
+        :rtype: list
+
+        """
+        query_api = BuildApi()
+        jobs, statuses, unknown = [], [], []
+        # We want the latest state of the jobs rather than the cached one
+        for job in buildapi.query_jobs_schedule(repo_name, revision):
+            # Only jobs without a result can be pending or running; we do not
+            # need get_job_status to tell us if the finished ones were coalesced
+            if job.get("status") is not None:
+                continue
+            if filters and \
+                    not any(fnmatch.fnmatch(job["buildername"], pattern) for pattern in filters):
+                continue
+            status = query_api.get_job_status(job)
+            if status == UNKNOWN:
+                LOG.warning("We do not know if '%s' (request %s) is still running; "
+                            "we will not cancel it." %
+                            (job["buildername"], job["requests"][0]["request_id"]))
+                unknown.append(job)
+                continue
+            jobs.append(job)
+            statuses.append(status)
+
+        results = buildapi.cancel_jobs(repo_name, jobs, dry_run=dry_run, **kwargs)
+        if not dry_run and jobs:
+            # The cached jobs of the revision still have them as pending or running
+            expire_jobs(repo_name, revision)
+
+        report = []
+        for job, status, result in zip(jobs, statuses, results):
+            outcome, error = "cancelled", None
+            if dry_run:
+                outcome = "dry run"
+            elif isinstance(result, Exception):
+                outcome, error = "failed", str(result)
+            elif result.status_code not in (200, 202):
+                outcome, error = "failed", "HTTP %d" % result.status_code
+            report.append({
+                "buildername": job["buildername"],
+                "status": status,
+                "request_id": job["requests"][0]["request_id"],
+                "outcome": outcome,
+                "error": error,
+            })
+        for job in unknown:
+            report.append({
+                "buildername": job["buildername"],
+                "status": UNKNOWN,
+                "request_id": job["requests"][0]["request_id"],
+                "outcome": "skipped",
+                "error": "Unknown status",
+            })
+
+        cancelled = len([entry for entry in report
+                         if entry["outcome"] in ("cancelled", "dry run")])
+        LOG.info("%s %d out of %d job(s) of %s on %s." %
+                 ("We would cancel" if dry_run else "We cancelled",
+                  cancelled, len(report), revision, repo_name))
+        return report
 
 # End of BuildAPIManager
 
@@ -0,0 +1,11 @@
+"""
+Local stand-ins for the services mozci talks to.
+
+They let us exercise mozci end-to-end (e.g. to load-test it) without network access.
+"""
+from __future__ import absolute_import
+
+from mozci.fake_services.data import FakeData
+from mozci.fake_services.server import FakeServices
+
+__all__ = ["FakeData", "FakeServices"]
@@ -0,0 +1,256 @@
+"""
+This module holds the data served by the fake services.
+
+A FakeData object describes repositories, their pushes, the builders in allthethings.json
+and the jobs scheduled on every push. The same jobs are served through buildapi, buildjson
+and Treeherder so the three sources agree with each other.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import random
+
+from mozci.query_jobs import SUCCESS, WARNING, FAILURE, SKIPPED, EXCEPTION, RETRY, CANCELLED
+
+TREEHERDER_RESULTS = {
+    SUCCESS: "success",
+    WARNING: "testfailed",
+    FAILURE: "busted",
+    SKIPPED: "skipped",
+    EXCEPTION: "exception",
+    RETRY: "retry",
+    CANCELLED: "usercancel",
+}
+# The date of the first synthetic push (2015-06-01 12:00 UTC)
+START_DATE = 1433160000
+
+
+def _slug(text):
+    return text.lower().replace(" ", "-")
+
+
+class FakeData(object):
+    """Repositories, pushes, builders and jobs served by FakeServices."""
+
+    def __init__(self):
+        # Repository name to its path on hg, e.g. "mozilla-inbound": "integration/mozilla-inbound"
+        self.repositories = {}
+        # Repository name to its pushes (oldest first); every push looks like
+        # {"id": 1, "date": 1433160000, "user": "...", "changesets": [{"node": ..., ...}]}
+        self.pushes = {}
+        # The "builders" and "schedulers" of allthethings.json
+        self.builders = {}
+        self.schedulers = {}
+        # Repository name to a dictionary mapping 12 char revisions to buildapi jobs
+        self.jobs = {}
+        self.last_id = 0
+
+    def _next_id(self):
+        self.last_id += 1
+        return self.last_id
+
+    def add_repository(self, repo_name, repo_path=None):
+        """Add a repository; its pushes are served under /<repo_path>/json-pushes."""
+        self.repositories[repo_name] = repo_path or "integration/%s" % repo_name
+        self.pushes.setdefault(repo_name, [])
+        self.jobs.setdefault(repo_name, {})
+
+    def add_push(self, repo_name, changesets=1, user="nobody@mozilla.com", date=None,
+                 files=("README",)):
+        """Add a push with 'changesets' changesets to a repository and return it."""
+        pushes = self.pushes[repo_name]
+        push_id = len(pushes) + 1
+        if date is None:
+            date = pushes[-1]["date"] + 600 if pushes else START_DATE
+
+        parent = pushes[-1]["changesets"][-1]["node"] if pushes else "0" * 40
+        push = {"id": push_id, "date": date, "user": user, "changesets": []}
+        for i in range(changesets):
+            node = hashlib.sha1("%s-%d-%d" % (repo_name, push_id, i)).hexdigest()
+            push["changesets"].append({
+                "node": node,
+                "author": user,
+                "branch": "default",
+                "desc": "Changeset %d of push %d" % (i + 1, push_id),
+                "files": list(files),
+                "parents": [parent],
+                "tags": [],
+            })
+            parent = node
+        pushes.append(push)
+        return push
+
+    def add_platform(self, repo_name, platform, tests):
+        """
+        Add to allthethings the build builder of a platform and its test builders.
+
+        Returns the list of buildernames added, the build first.
+        """
+        repo_path = self.repositories[repo_name]
+        shortname = "%s-%s" % (repo_name, _slug(platform))
+        build = "%s %s build" % (platform, repo_name)
+        properties = {
+            "branch": repo_name,
+            "platform": _slug(platform),
+            "product": "firefox",
+            "repo_path": repo_path,
+            "stage_platform": _slug(platform),
+        }
+        self.builders[build] = {
+            "properties": dict(properties, slavebuilddir="build"),
+            "shortname": shortname,
+            "slavebuilddir": "build",
+        }
+
+        buildernames = [build]
+        for test in tests:
+            buildername = "%s %s opt test %s" % (platform, repo_name, test)
+            self.builders[buildername] = {
+                "properties": dict(properties, slavebuilddir="test"),
+                "shortname": "%s-opt-test-%s" % (shortname, test),
+                "slavebuilddir": "test",
+            }
+            buildernames.append(buildername)
+
+        self.schedulers["tests-%s-opt-unittest" % shortname] = {
+            "downstream": buildernames[1:],
+            "triggered_by": ["%s-opt-unittest" % shortname],
+        }
+        return buildernames
+
+    def add_job(self, repo_name, revision, buildername, status=SUCCESS, starttime=None,
+                endtime=None, coalesced_to=None):
+        """
+        Add a buildapi job to a revision and return it.
+
+        A status of None means the job is running; use add_pending_job for pending jobs.
+        If 'coalesced_to' is a revision, the job reports success but buildjson says it
+        ran on that revision.
+        """
+        push = self.find_push(repo_name, revision)
+        revision = push["changesets"][-1]["node"]
+        if starttime is None:
+            starttime = push["date"] + 300
+        if endtime is None and status is not None:
+            endtime = starttime + 1800
+
+        request_id = self._next_id()
+        request = {
+            "branch": repo_name,
+            "buildername": buildername,
+            "claimed_at": starttime,
+            "complete": 0 if status is None else 1,
+            "complete_at": endtime,
+            "priority": 0,
+            "reason": "scheduler",
+            "request_id": request_id,
+            "revision": revision,
+            "submittime": push["date"],
+        }
+        job = {
+            "branch": repo_name,
+            "build_id": self._next_id(),
+            "buildername": buildername,
+            "buildnumber": request_id,
+            "endtime": endtime,
+            "requests": [request],
+            "revision": revision,
+            "starttime": starttime,
+            "status": status,
+            # Only used to generate the buildjson entry
+            "ran_on": coalesced_to or revision,
+        }
+        self.jobs[repo_name].setdefault(revision[:12], []).append(job)
+        return job
+
+    def add_pending_job(self, repo_name, revision, buildername):
+        """Add a buildapi job which has not started yet and return it."""
+        push = self.find_push(repo_name, revision)
+        revision = push["changesets"][-1]["node"]
+        job = {
+            "buildername": buildername,
+            "requests": [{"buildername": buildername,
+                          "request_id": self._next_id(),
+                          "revision": revision}],
+            "revision": revision,
+        }
+        self.jobs[repo_name].setdefault(revision[:12], []).append(job)
+        return job
+
+    def find_push(self, repo_name, revision):
+        """Return the push of a repository containing 'revision' or None."""
+        for push in self.pushes.get(repo_name, []):
+            for changeset in push["changesets"]:
+                if changeset["node"].startswith(revision):
+                    return push
+        return None
+
+    def find_job(self, repo_name, request_id):
+        """Return the buildapi job of a repository with a given request_id or None."""
+        for jobs in self.jobs.get(repo_name, {}).itervalues():
+            for job in jobs:
+                if job["requests"][0]["request_id"] == request_id:
+                    return job
+        return None
+
+    def find_build(self, repo_name, build_id):
+        """Return the buildapi job of a repository with a given build_id or None."""
+        for jobs in self.jobs.get(repo_name, {}).itervalues():
+            for job in jobs:
+                if job.get("build_id") == build_id:
+                    return job
+        return None
+
+    def iter_jobs(self):
+        """Yield (repo_name, job) for every job."""
+        for repo_name, jobs_by_revision in sorted(self.jobs.iteritems()):
+            for revision, jobs in sorted(jobs_by_revision.iteritems()):
+                for job in jobs:
+                    yield repo_name, job
+
+    def save(self, filepath):
+        """Store the data as json (e.g. to replay it later with FakeData.load)."""
+        with open(filepath, "w") as fd:
+            json.dump(self.__dict__, fd, sort_keys=True)
+
+    @classmethod
+    def load(cls, filepath):
+        """Return the data stored by save()."""
+        data = cls()
+        with open(filepath) as fd:
+            data.__dict__.update(json.load(fd))
+        return data
+
+    @classmethod
+    def synthetic(cls, repo_names=("mozilla-inbound",), pushes=10,
+                  platforms=("Linux x86-64", "Windows 8 64-bit"),
+                  tests=("mochitest-1", "mochitest-2", "xpcshell"),
+                  failure_rate=0.1, seed=0):
+        """
+        Return data for 'pushes' pushes on every repository with every job on every push.
+
+        Some jobs fail (following 'failure_rate'), the jobs of the last push are still running
+        and the same seed always generates the same data.
+        """
+        rand = random.Random(seed)
+        data = cls()
+        for repo_name in repo_names:
+            data.add_repository(repo_name)
+            buildernames = []
+            for platform in platforms:
+                buildernames += data.add_platform(repo_name, platform, tests)
+
+            for i in range(pushes):
+                push = data.add_push(repo_name, changesets=rand.randint(1, 3))
+                revision = push["changesets"][-1]["node"]
+                for buildername in buildernames:
+                    if i == pushes - 1:
+                        status = None
+                    elif rand.random() < failure_rate:
+                        status = rand.choice((WARNING, FAILURE, EXCEPTION))
+                    else:
+                        status = SUCCESS
+                    data.add_job(repo_name, revision, buildername, status=status)
+
+        return data
@@ -0,0 +1,444 @@
+"""
+This module serves FakeData over http the way the real services do.
+
+.. code-block:: python
+
+    from mozci.fake_services import FakeData, FakeServices
+
+    with FakeServices(FakeData.synthetic(), latency=0.05, failure_rate=0.01) as services:
+        # mozci talks to services.url instead of the real services in here
+        ...
+
+The following endpoints are served:
+
+* buildapi self-serve: /buildapi/self-serve (branches, jobs of a revision,
+  new jobs, retriggers and cancellations)
+* json-pushes: /<repo_path>/json-pushes
+* allthethings.json: /builddata/reports/allthethings.json
+* buildjson: /builddata/buildjson/builds-4hr.js.gz and builds-<date>.js.gz
+* Treeherder: /api/project/<repo_name>/(resultset|push|jobs|artifact)/
+"""
+from __future__ import absolute_import
+
+import BaseHTTPServer
+import gzip
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import SocketServer
+import StringIO
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+
+from email.utils import formatdate
+
+from mozci import platforms, query_jobs
+from mozci.fake_services.data import TREEHERDER_RESULTS, FakeData
+from mozci.sources import allthethings, buildapi, buildjson, pushlog, pushlog_mirror
+from mozci.utils import authentication, journal
+from mozci.utils.tzone import utc_day
+
+LOG = logging.getLogger('mozci')
+
+SELF_SERVE_RE = re.compile(r"^/buildapi/self-serve(?:/(?P<repo_name>[^/]+)(?P<rest>/.*)?)?$")
+TREEHERDER_RE = re.compile(r"^/api/project/(?P<repo_name>[^/]+)/(?P<endpoint>[^/]+)/$")
+BUILDJSON_RE = re.compile(r"^/builddata/buildjson/(?P<filename>[^/]+)\.gz$")
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def _respond(self, method):
+        body = None
+        length = int(self.headers.get("content-length") or 0)
+        if length:
+            body = self.rfile.read(length)
+
+        status, headers, content = self.server.fake.handle(method, self.path, body)
+        self.send_response(status)
+        for name, value in sorted(headers.iteritems()):
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(content)
+
+    def do_GET(self):
+        self._respond("GET")
+
+    def do_HEAD(self):
+        self._respond("HEAD")
+
+    def do_POST(self):
+        self._respond("POST")
+
+    def do_DELETE(self):
+        self._respond("DELETE")
+
+    def log_message(self, format, *args):
+        LOG.debug("fake services: " + format % args)
+
+
+def _json(data, status=200):
+    return status, {"Content-Type": "application/json"}, json.dumps(data, sort_keys=True)
+
+
+class FakeServices(object):
+    """
+    Local http server standing in for buildapi, pushlog, allthethings, buildjson and Treeherder.
+
+    latency      - seconds to wait before answering every request or a (min, max) range
+    failure_rate - probability of answering a request with a 500
+    failures     - dictionary mapping path prefixes to the status every request to them gets
+    """
+
+    def __init__(self, data=None, latency=0, failure_rate=0.0, failures=None, seed=0):
+        self.data = data or FakeData.synthetic()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failures = failures or {}
+        # (method, path) of every request received
+        self.requests = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._swapped = []
+        self._tmpdir = None
+        self.url = None
+
+    def start(self):
+        """Start serving on a free local port."""
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self.url = "http://127.0.0.1:%d" % self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        """Start serving and point mozci's sources (and empty its caches) at us."""
+        self.start()
+        self._tmpdir = tempfile.mkdtemp()
+        host = self.url[len("http://"):]
+
+        client_class = query_jobs.TreeherderClient
+
+        def _treeherder_client():
+            try:
+                return client_class(protocol="http", host=host)
+            except TypeError:
+                # Newer clients take the whole url
+                return client_class(server_url=self.url)
+
+        swaps = [
+            (authentication, "AUTH", ("fake", "fake")),
+            (buildapi, "HOST_ROOT", self.url + "/buildapi/self-serve"),
+            (buildapi, "REPOSITORIES", {}),
+            (buildapi, "REPOSITORIES_FILE", self._tmpdir + "/repositories.txt"),
+            (buildapi, "JOBS_SCHEDULES_DIR", self._tmpdir + "/jobs_schedules"),
+            (allthethings, "ALLTHETHINGS", self.url + "/builddata/reports/allthethings.json"),
+            (allthethings, "FILENAME", self._tmpdir + "/allthethings.json"),
+            (allthethings, "DATA", None),
+            (buildjson, "BUILDJSON_DATA", self.url + "/builddata/buildjson"),
+            (buildjson, "path_to_file", lambda filename: os.path.join(self._tmpdir, filename)),
+            (buildjson, "BUILDS_CACHE", {}),
+            (buildjson, "BUILDS_INDEX", {}),
+            (pushlog, "VALID_CACHE", {}),
+            (pushlog, "PUSH_INFO", None),
+            (pushlog, "PUSH_INFO_FILE", self._tmpdir + "/push_info.json"),
+            (pushlog_mirror, "MIRROR_FILE", self._tmpdir + "/pushlog_mirror.sqlite"),
+            (journal, "JOURNAL_FILE", self._tmpdir + "/scheduling_journal.sqlite"),
+            (query_jobs, "TreeherderClient", _treeherder_client),
+            (query_jobs, "TREEHERDER_REQUEST_IDS", None),
+            (query_jobs, "TREEHERDER_REQUEST_IDS_FILE", self._tmpdir + "/request_ids.json"),
+            (query_jobs, "TREEHERDER_RESULTSET_IDS", None),
+            (query_jobs, "TREEHERDER_RESULTSET_IDS_FILE", self._tmpdir + "/resultset_ids.json"),
+            (query_jobs, "UNKNOWN_RESULTSETS", {}),
+            (platforms, "SHORTNAME_TO_NAME", {}),
+            (platforms, "BUILDERNAME_TO_TRIGGER", {}),
+            (platforms, "BUILD_JOBS", {}),
+            (platforms, "UPSTREAM_TO_DOWNSTREAM", None),
+        ]
+        for module, name, value in swaps:
+            self._swap(module, name, value)
+        for name in ("JOBS_CACHE", "JOBS_CACHE_METADATA", "TREEHERDER_JOBS_CACHE",
+                     "TREEHERDER_JOBS_CACHE_METADATA", "JOBS_INDEX", "TREEHERDER_JOBS_INDEX",
+                     "COALESCED_CACHE"):
+            self._swap(query_jobs, name, {})
+        return self
+
+    def __exit__(self, *args):
+        while self._swapped:
+            module, name, value = self._swapped.pop()
+            setattr(module, name, value)
+        shutil.rmtree(self._tmpdir)
+        self.stop()
+
+    def _swap(self, module, name, value):
+        self._swapped.append((module, name, getattr(module, name, None)))
+        setattr(module, name, value)
+
+    def handle(self, method, path, body):
+        """Return the (status, headers, content) of the response to a request."""
+        with self._lock:
+            self.requests.append((method, path))
+            if isinstance(self.latency, tuple):
+                latency = self._random.uniform(*self.latency)
+            else:
+                latency = self.latency
+            fail = self._random.random() < self.failure_rate
+
+        if latency:
+            time.sleep(latency)
+
+        parsed = urlparse.urlparse(path)
+        for prefix, status in self.failures.iteritems():
+            if parsed.path.startswith(prefix):
+                return _json("Injected failure", status)
+        if fail:
+            return _json("Injected failure", 500)
+
+        params = dict((key, values[0]) for key, values in
+                      urlparse.parse_qs(parsed.query).iteritems())
+        if body:
+            params.update((key, values[0]) for key, values in
+                          urlparse.parse_qs(body).iteritems())
+
+        # The data is shared with the threads answering other requests
+        with self._lock:
+            return self._route(method, parsed.path, params)
+
+    def _route(self, method, path, params):
+        match = SELF_SERVE_RE.match(path)
+        if match:
+            return self._self_serve(method, match.group("repo_name"), match.group("rest"),
+                                    params)
+
+        match = TREEHERDER_RE.match(path)
+        if match:
+            return self._treeherder(match.group("repo_name"), match.group("endpoint"), params)
+
+        match = BUILDJSON_RE.match(path)
+        if match:
+            return self._buildjson(match.group("filename"))
+
+        if path == "/builddata/reports/allthethings.json":
+            return _json({"builders": self.data.builders, "schedulers": self.data.schedulers})
+
+        if path.endswith("/json-pushes"):
+            repo_path = path[1:-len("/json-pushes")]
+            for repo_name, path in self.data.repositories.iteritems():
+                if path == repo_path:
+                    return self._json_pushes(repo_name, params)
+
+        return _json("Not found", 404)
+
+    def _self_serve(self, method, repo_name, rest, params):
+        if repo_name is None:
+            return _json("Welcome to self-serve")
+
+        if repo_name == "branches":
+            return _json(dict((name, {
+                "repo": "%s/%s" % (self.url, path),
+                "graph_branches": [name.title()],
+                "repo_type": "hg",
+            }) for name, path in self.data.repositories.iteritems()))
+
+        if repo_name not in self.data.repositories:
+            return _json("Branch %s not found" % repo_name, 404)
+
+        parts = [urllib.unquote(part) for part in (rest or "").strip("/").split("/")]
+        if method == "GET" and len(parts) == 2 and parts[0] == "rev":
+            if self.data.find_push(repo_name, parts[1]) is None:
+                return _json({"msg": "Revision %s not found on branch %s" %
+                              (parts[1], repo_name), "status": "FAILED"}, 404)
+            jobs = self.data.jobs[repo_name].get(parts[1][:12], [])
+            return _json([dict((key, value) for key, value in job.iteritems()
+                               if key != "ran_on") for job in jobs])
+
+        if method == "POST" and len(parts) == 3 and parts[0] == "builders":
+            if parts[1] not in self.data.builders:
+                return _json("Builder %s not found" % parts[1], 404)
+            if self.data.find_push(repo_name, parts[2]) is None:
+                return _json("Revision %s not found" % parts[2], 404)
+            job = self.data.add_pending_job(repo_name, parts[2], parts[1])
+            return _json({"body": {"msg": "Ok", "errors": False},
+                          "request_id": job["requests"][0]["request_id"]}, 202)
+
+        if method == "POST" and parts == ["request"]:
+            job = self.data.find_job(repo_name, int(params["request_id"]))
+            if job is None:
+                return _json("Request %s not found" % params["request_id"], 404)
+            for i in range(int(params.get("count", 1))):
+                self.data.add_pending_job(repo_name, job["revision"], job["buildername"])
+            return _json({"body": {"msg": "Ok", "errors": False},
+                          "request_id": job["requests"][0]["request_id"]}, 202)
+
+        if method == "DELETE" and len(parts) == 2 and parts[0] == "request":
+            job = self.data.find_job(repo_name, int(parts[1]))
+            if job is None:
+                return _json("Request %s not found" % parts[1], 404)
+            job.update({"status": query_jobs.CANCELLED, "endtime": int(time.time())})
+            return _json({"body": {"msg": "Ok", "errors": False}})
+
+        if method == "DELETE" and len(parts) == 2 and parts[0] == "build":
+            job = self.data.find_build(repo_name, int(parts[1]))
+            if job is None:
+                return _json("Build %s not found" % parts[1], 404)
+            job.update({"status": query_jobs.CANCELLED, "endtime": int(time.time())})
+            return _json({"body": {"msg": "Ok", "errors": False}})
+
+        return _json("Not found", 404)
+
+    def _json_pushes(self, repo_name, params):
+        pushes = self.data.pushes[repo_name]
+
+        def _push_id(revision):
+            push = self.data.find_push(repo_name, revision)
+            return push["id"] if push else None
+
+        if "changeset" in params:
+            push = self.data.find_push(repo_name, params["changeset"])
+            if push is None:
+                return _json("unknown revision '%s'" % params["changeset"], 404)
+            selected = [push]
+        elif "fromchange" in params or "tochange" in params:
+            from_id = _push_id(params["fromchange"]) if "fromchange" in params else 0
+            to_id = _push_id(params["tochange"]) if "tochange" in params else len(pushes)
+            if from_id is None or to_id is None:
+                return _json("unknown revision", 404)
+            selected = [push for push in pushes if from_id < push["id"] <= to_id]
+        elif "startID" in params or "endID" in params:
+            start_id = int(params.get("startID", 0))
+            end_id = int(params.get("endID", len(pushes)))
+            selected = [push for push in pushes if start_id < push["id"] <= end_id]
+        else:
+            selected = pushes[-10:]
+
+        def _format(push):
+            changesets = push["changesets"]
+            if params.get("tipsonly") == "1":
+                changesets = changesets[-1:]
+            if params.get("full") != "1":
+                changesets = [changeset["node"] for changeset in changesets]
+            return {"changesets": changesets, "date": push["date"], "user": push["user"]}
+
+        result = dict((str(push["id"]), _format(push)) for push in selected)
+        if params.get("version") == "2":
+            return _json({"lastpushid": len(pushes), "pushes": result})
+        return _json(result)
+
+    def _buildjson(self, filename):
+        now = time.time()
+        builds = []
+        for repo_name, job in self.data.iter_jobs():
+            if not job.get("endtime"):
+                continue
+            if filename == "builds-4hr.js":
+                if now - job["endtime"] > 4 * 60 * 60:
+                    continue
+            elif filename != "builds-%s.js" % utc_day(job["endtime"]):
+                continue
+
+            request_id = job["requests"][0]["request_id"]
+            builds.append({
+                "builder_id": job["build_id"],
+                "endtime": job["endtime"],
+                "properties": {
+                    "buildername": job["buildername"],
+                    "packageUrl": "%s/%s/%s.tar.bz2" % (self.url, repo_name, job["ran_on"]),
+                    "request_ids": [request_id],
+                    "revision": job["ran_on"],
+                    "testsUrl": "%s/%s/%s.tests.zip" % (self.url, repo_name, job["ran_on"]),
+                },
+                "request_ids": [request_id],
+                "result": job["status"],
+                "starttime": job["starttime"],
+            })
+
+        content = StringIO.StringIO()
+        gzipper = gzip.GzipFile(fileobj=content, mode="wb")
+        gzipper.write(json.dumps({"builds": builds}))
+        gzipper.close()
+        return 200, {"Content-Type": "application/x-gzip",
+                     "Last-Modified": formatdate(now, usegmt=True)}, content.getvalue()
+
+    def _treeherder(self, repo_name, endpoint, params):
+        if repo_name not in self.data.repositories:
+            return _json({"detail": "No project with name %s" % repo_name}, 404)
+
+        if endpoint in ("resultset", "push"):
+            revisions = params.get("revision__in", params.get("revision", "")).split(",")
+            results = []
+            for push in self.data.pushes[repo_name]:
+                tip = push["changesets"][-1]["node"]
+                if any(revision and tip.startswith(revision) for revision in revisions):
+                    results.append({
+                        "id": push["id"],
+                        "push_timestamp": push["date"],
+                        "revision": tip,
+                        "revisions": [{"revision": changeset["node"]}
+                                      for changeset in push["changesets"]],
+                    })
+            return _json({"results": results[:int(params.get("count", 10))]})
+
+        jobs = []
+        for job in sorted(self._treeherder_jobs(repo_name), key=lambda job: job["id"]):
+            if "result_set_id" in params and \
+                    job["result_set_id"] != int(params["result_set_id"]):
+                continue
+            if "push_id" in params and job["result_set_id"] != int(params["push_id"]):
+                continue
+            jobs.append(job)
+
+        if endpoint == "jobs":
+            if params.get("visibility") == "excluded":
+                jobs = []
+            offset = int(params.get("offset", 0))
+            return _json({"results": jobs[offset:offset + int(params.get("count", 2000))]})
+
+        if endpoint == "artifact":
+            job_ids = params.get("job_id__in", params.get("job_id", "")).split(",")
+            return _json([{"job_id": job["id"], "name": "buildapi",
+                           "blob": {"buildername": job["ref_data_name"],
+                                    "request_id": job["request_id"]}}
+                          for job in jobs if str(job["id"]) in job_ids])
+
+        return _json("Not found", 404)
+
+    def _treeherder_jobs(self, repo_name):
+        """Return the buildapi jobs of a repository as Treeherder jobs."""
+        for revision, jobs in self.data.jobs[repo_name].iteritems():
+            push = self.data.find_push(repo_name, revision)
+            for job in jobs:
+                if "status" not in job:
+                    state, result = "pending", "unknown"
+                elif job["status"] is None:
+                    state, result = "running", "unknown"
+                else:
+                    state, result = "completed", TREEHERDER_RESULTS[job["status"]]
+                coalesced = job.get("ran_on", job["revision"]) != job["revision"]
+                yield {
+                    "id": job["requests"][0]["request_id"],
+                    "job_coalesced_to_guid": "coalesced" if coalesced else None,
+                    "ref_data_name": job["buildername"],
+                    "request_id": job["requests"][0]["request_id"],
+                    "result": result,
+                    "result_set_id": push["id"],
+                    "state": state,
+                }
@@ -13,9 +13,12 @@ interactions with distinct modules to meet your needs.
 from __future__ import absolute_import
 
 import logging
+import re
+import threading
 
 from mozci.platforms import determine_upstream_builder, is_downstream, \
-    filter_buildernames, build_talos_buildernames_for_repo
+    filter_buildernames, build_talos_buildernames_for_repo, canonical_buildername, \
+    suggest_buildernames, plan_build_jobs
 from mozci.sources import allthethings, buildapi, buildjson, pushlog
 from mozci.query_jobs import (
     PENDING,
@@ -28,13 +31,34 @@ from mozci.query_jobs import (
     EXCEPTION,
     RETRY,
     BuildApi,
-    TreeherderApi
+    TreeherderApi,
+    expire_jobs
 )
+from mozci.utils import journal
+from mozci.utils.concurrency import parallel_map_with_logs
 from mozci.utils.misc import _all_urls_reachable
-from mozci.utils.transfer import path_to_file, clean_directory
+from mozci.utils.transfer import clean_directory
 
 LOG = logging.getLogger('mozci')
+# The builders we have scheduled on every revision during this session, e.g.
+# {"146071751b1e": set(["Linux x86-64 mozilla-inbound build"])}
 SCHEDULING_MANAGER = {}
+# Build jobs found by _find_build_job() while we trigger a plan of builders.
+# See trigger_range_for_builders()
+BUILD_JOBS_FOUND = None
+# Jobs waiting to be requested all at once, as arguments of buildapi.trigger_arbitrary_jobs.
+# See trigger_range_for_builders()
+TRIGGER_BATCH = None
+# The repositories snapshot and the regex compiled from it; see _repo_name_matcher()
+REPO_MATCHER = None
+# Buildername to repository name for the current REPO_MATCHER
+REPO_NAMES = {}
+
+# Number of (builder, revision) pairs trigger_range and trigger_range_for_builders
+# handle at the same time
+PARALLEL_WIDTH = 1
+# Makes the check and the record of _record_scheduling(unique=True) atomic
+_SCHEDULING_LOCK = threading.Lock()
 
 # Default value of QUERY_SOURCE
 QUERY_SOURCE = BuildApi()
@@ -53,7 +77,7 @@ def set_query_source(query_source="buildapi"):
 def _unique_build_request(buildername, revision):
     """
     We want to prevent requesting a build job too many times
-    in the same session.
+    in the same session or from other mozci processes (see mozci.utils.journal).
     """
     global SCHEDULING_MANAGER
     sch_mgr = SCHEDULING_MANAGER
@@ -66,26 +90,35 @@ def _unique_build_request(buildername, revision):
                       "revision %s during this session. We don't allow "
                       "multiple requests." % (buildername, revision))
             return False
+        if journal.scheduled(revision, [buildername]):
+            LOG.debug("Another mozci process has recently scheduled the build '%s' for "
+                      "revision %s. We don't allow multiple requests." % (buildername, revision))
+            return False
         return True
 
+
 def _status_summary(jobs):
-    """Return the number of successful, pending and running jobs."""
+    """Return the number of successful, pending, running, coalesced and failed jobs."""
     assert type(jobs) == list
-    status_summary = {'successful': 0, 'pending': 0, 'running': 0, 'coalesced': 0, 'failed': 0}
+    successful = 0
+    pending = 0
+    running = 0
+    coalesced = 0
+    failed = 0
 
     for job in jobs:
         status = QUERY_SOURCE.get_job_status(job)
         if status == PENDING:
-            status_summary['pending'] += 1
+            pending += 1
         if status in (RUNNING, UNKNOWN):
-            status_summary['running'] += 1
+            running += 1
         if status == SUCCESS:
-            status_summary['successful'] += 1
+            successful += 1
         if status == COALESCED:
-            status_summary['coalesced'] += 1
+            coalesced += 1
         if status in (FAILURE, WARNING, EXCEPTION, RETRY):
-            status_summary['failed'] += 1
-    return (status_summary)
+            failed += 1
+    return (successful, pending, running, coalesced, failed)
 
 
 def _determine_trigger_objective(revision, buildername, trigger_build_if_missing=True):
@@ -111,45 +144,8 @@ def _determine_trigger_objective(revision, buildername, trigger_build_if_missing
         # trigger it and it's the build job we want to trigger
         return build_buildername, None
 
-    # Let's figure out which jobs are associated to such revision
-    query_api = BuildApi()
-    # Let's only look at jobs that match such build_buildername
-    build_jobs = query_api.get_matching_jobs(repo_name, revision, build_buildername)
-
-    # We need to determine if we need to trigger a build job
-    # or the test job
-    working_job = None
-    running_job = None
-    failed_job = None
-
-    LOG.debug("List of matching jobs:")
-    for job in build_jobs:
-        try:
-            status = query_api.get_job_status(job)
-        except buildjson.BuildjsonException:
-            LOG.debug("We have hit bug 1159279 and have to work around it. We will pretend that "
-                      "we could not reach the files for it.")
-            continue
-        # Sometimes running jobs have status unknown in buildapi
-        if status == RUNNING or status == PENDING or status == UNKNOWN:
-            LOG.debug("We found a running/pending build job. We don't search anymore.")
-            running_job = job
-            # We cannot call _find_files for a running job
-            continue
-
-        # Successful or failed jobs may have the files we need
-        files = _find_files(job)
-        if files != [] and _all_urls_reachable(files):
-            working_job = job
-            break
-        else:
-            LOG.debug("We can't determine the files for this build or "
-                      "can't reach them.")
-            files = None
-
-        LOG.info("We found a job that finished but it did not "
-                 "produced files. status: %d" % status)
-        failed_job = job
+    working_job, running_job, failed_job, files = _find_build_job(
+        repo_name, revision, build_buildername)
 
     if working_job:
         # We found a build job with the necessary files. It could be a
@@ -196,6 +192,65 @@ def _determine_trigger_objective(revision, buildername, trigger_build_if_missing
     return builder_to_trigger, files
 
 
+def _find_build_job(repo_name, revision, build_buildername):
+    """
+    Look for a job of 'build_buildername' on 'revision' that we can use to trigger test jobs.
+
+    Returns a tuple with the working, running and failed build jobs found (None if
+    there is none) and the files produced by the working job.
+    """
+    key = (revision, build_buildername)
+    if BUILD_JOBS_FOUND is not None and key in BUILD_JOBS_FOUND:
+        LOG.debug("We have already looked for '%s' on %s." % (build_buildername, revision))
+        return BUILD_JOBS_FOUND[key]
+
+    files = None
+    # Let's figure out which jobs are associated to such revision
+    query_api = BuildApi()
+    # Let's only look at jobs that match such build_buildername
+    build_jobs = query_api.get_matching_jobs(repo_name, revision, build_buildername)
+
+    # We need to determine if we need to trigger a build job
+    # or the test job
+    working_job = None
+    running_job = None
+    failed_job = None
+
+    LOG.debug("List of matching jobs:")
+    for job in build_jobs:
+        try:
+            status = query_api.get_job_status(job)
+        except buildjson.BuildjsonException:
+            LOG.debug("We have hit bug 1159279 and have to work around it. We will pretend that "
+                      "we could not reach the files for it.")
+            continue
+        # Sometimes running jobs have status unknown in buildapi
+        if status == RUNNING or status == PENDING or status == UNKNOWN:
+            LOG.debug("We found a running/pending build job. We don't search anymore.")
+            running_job = job
+            # We cannot call _find_files for a running job
+            continue
+
+        # Successful or failed jobs may have the files we need
+        files = _find_files(job)
+        if files != [] and _all_urls_reachable(files):
+            working_job = job
+            break
+        else:
+            LOG.debug("We can't determine the files for this build or "
+                      "can't reach them.")
+            files = None
+
+        LOG.info("We found a job that finished but it did not "
+                 "produced files. status: %d" % status)
+        failed_job = job
+
+    found = (working_job, running_job, failed_job, files)
+    if BUILD_JOBS_FOUND is not None:
+        BUILD_JOBS_FOUND[key] = found
+    return found
+
+
 def _status_info(job_schedule_info):
     # Let's grab the last job
     complete_at = job_schedule_info["requests"][0]["complete_at"]
@@ -244,26 +299,41 @@ def query_builders():
     return allthethings.list_builders()
 
 
+def _repo_name_matcher(repositories):
+    """Return a regex finding any repository name of 'repositories' in a buildername."""
+    global REPO_MATCHER
+
+    if REPO_MATCHER is None or REPO_MATCHER[0] is not repositories:
+        # The names are delimited by the same character on both sides (' %s ', '_%s_'
+        # or '-%s-'); longer names go first so 'mozilla-b2g37_v2_2' wins over 'b2g37'
+        names = sorted(repositories, key=lambda name: (-len(name), name))
+        pattern = '|'.join(map(re.escape, names)) or '(?!)'
+        regex = re.compile(r'([ _-])(%s)\1' % pattern)
+        REPO_MATCHER = (repositories, regex)
+        REPO_NAMES.clear()
+
+    return REPO_MATCHER[1]
+
+
 def query_repo_name_from_buildername(buildername, clobber=False):
     """Return the repository name from a given buildername."""
     repositories = buildapi.query_repositories(clobber)
-    ret_val = None
-    for repo_name in repositories:
-        if any(True for iterable in [' %s ', '_%s_', '-%s-']
-               if iterable % repo_name in buildername):
-            ret_val = repo_name
-            break
+    matcher = _repo_name_matcher(repositories)
+    if buildername in REPO_NAMES:
+        return REPO_NAMES[buildername]
 
-    if ret_val is None and not clobber:
+    match = matcher.search(buildername)
+    if match:
+        REPO_NAMES[buildername] = match.group(2)
+        return match.group(2)
+
+    if not clobber:
         # Since repositories file is cached, it can be that something has changed.
         # Adding clobber=True will make it overwrite the cached version with latest one.
-        query_repo_name_from_buildername(buildername, clobber=True)
-
-    if ret_val is None:
-        raise Exception("Repository name not found in buildername. "
-                        "Please provide a correct buildername.")
+        return query_repo_name_from_buildername(buildername, clobber=True)
 
-    return ret_val
+    raise Exception("Repository name not found in buildername. "
+                    "Please provide a correct buildername.")
 
 
 def query_repo_url_from_buildername(buildername):
@@ -286,17 +356,20 @@ def query_revisions_range(repo_name, from_revision, to_revision):
 #
 def valid_builder(buildername):
     """Determine if the builder you're trying to trigger is valid."""
-    builders = query_builders()
-    if buildername in builders:
+    if buildername is None:
+        LOG.warning("We do not have a buildername to validate.")
+        return False
+
+    if canonical_buildername(buildername) == buildername:
         LOG.debug("Buildername %s is valid." % buildername)
         return True
     else:
         LOG.warning("Buildername %s is *NOT* valid." % buildername)
-        LOG.info("Check the file we just created builders.txt for "
-                 "a list of valid builders.")
-        with open(path_to_file('builders.txt'), "wb") as fd:
-            for b in sorted(builders):
-                fd.write(b + "\n")
+        suggestions = suggest_buildernames(buildername)
+        if suggestions:
+            LOG.info("These are the closest valid buildernames:")
+            for suggestion in suggestions:
+                LOG.info("    %s" % suggestion)
 
         return False
 
@@ -359,11 +432,18 @@ def trigger_job(revision, buildername, times=1, files=None, dry_run=False,
                      (builder_to_trigger, times))
             # Running with dry_run being True will only output information
             trigger(builder_to_trigger, revision, files, dry_run, extra_properties)
+        elif not _record_scheduling(builder_to_trigger, revision, times,
+                                    unique=builder_to_trigger != buildername,
+                                    downstream=bool(files)):
+            LOG.info("We (or another mozci process) have just requested '%s' on %s. "
+                     "We will not request it again." % (builder_to_trigger, revision))
         else:
-            for _ in range(times):
-                req = trigger(builder_to_trigger, revision, files, dry_run, extra_properties)
-                if req is not None:
-                    list_of_requests.append(req)
+            job_requests = [(repo_name, builder_to_trigger, revision, files,
+                             extra_properties)] * times
+            if TRIGGER_BATCH is not None:
+                TRIGGER_BATCH.extend(job_requests)
+            else:
+                list_of_requests = _submit_triggers(job_requests)
     else:
         LOG.debug("Nothing needs to be triggered")
 
@@ -373,73 +453,196 @@ def trigger_job(revision, buildername, times=1, files=None, dry_run=False,
     return list_of_requests
 
 
-def trigger_range(buildername, revisions, times=1, dry_run=False,
-                  files=None, extra_properties=None, trigger_build_if_missing=True):
-    """Schedule the job named "buildername" ("times" times) in every revision on 'revisions'."""
+def _trigger_revision(buildername, rev, times=1, dry_run=False, files=None,
+                      extra_properties=None, trigger_build_if_missing=True):
+    """
+    Trigger what is needed to have "times" jobs of "buildername" on 'rev' (see trigger_range).
+
+    If we can retrigger an existing job we return (rev, job, count) instead of doing it
+    so the caller can look up the request_ids of all jobs to retrigger at once.
+    """
     repo_name = query_repo_name_from_buildername(buildername)
     repo_url = buildapi.query_repo_url(repo_name)
 
+    LOG.info("")
+    LOG.info("=== %s ===" % rev)
+    if not pushlog.valid_revision(repo_url, rev):
+        LOG.info("We can't trigger anything on pushes without a valid revision.")
+        return None
+
+    LOG.info("We want to have %s job(s) of %s on revision %s" %
+             (times, buildername, rev))
+
+    # 1) How many potentially completed jobs can we get for this buildername?
+    matching_jobs = QUERY_SOURCE.get_matching_jobs(repo_name, rev, buildername)
+    successful_jobs, pending_jobs, running_jobs, _, failed_jobs = _status_summary(matching_jobs)
+
+    potential_jobs = pending_jobs + running_jobs + successful_jobs + failed_jobs
+    # TODO: change this debug message when we have a less hardcoded _status_summary
+    LOG.debug("We found %d pending/running jobs, %d successful jobs and "
+              "%d failed jobs" % (pending_jobs + running_jobs, successful_jobs, failed_jobs))
+
+    if potential_jobs >= times:
+        LOG.info("We have %d job(s) for '%s' which is enough for the %d job(s) we want." %
+                 (potential_jobs, buildername, times))
+        return None
+
+    # 2) If we have less potential jobs than 'times' instances then
+    #    we need to fill it in.
+    LOG.info("We have found %d potential job(s) matching '%s' on %s. "
+             "We need to trigger more." % (potential_jobs, buildername, rev))
+
+    # If a job matching what we want already exists, we can
+    # use the retrigger API in self-serve to retrigger that
+    # instead of creating a new arbitrary job
+    if len(matching_jobs) > 0 and files is None:
+        return (rev, matching_jobs[0], times - potential_jobs)
+
+    # If no matching job exists, we have to trigger a new arbitrary job
+    list_of_requests = trigger_job(
+        revision=rev,
+        buildername=buildername,
+        times=(times - potential_jobs),
+        dry_run=dry_run,
+        files=files,
+        extra_properties=extra_properties,
+        trigger_build_if_missing=trigger_build_if_missing)
+
+    if list_of_requests and any(req.status_code != 202 for req in list_of_requests):
+        LOG.warning("Not all requests succeeded.")
+
+    # TODO:
+    # 3) Once we trigger a build job, we have to monitor it to make sure that it finishes;
+    #    at that point we have to trigger as many test jobs as we originally intended
+    #    If a build job does not finish, we have to notify the user... what should it then
+    #    happen?
+    return None
+
+
+def _retrigger_jobs(buildername, retriggers, dry_run=False):
+    """Retrigger the jobs returned by _trigger_revision, looking up their request_ids at once."""
+    if not retriggers:
+        return
+
+    repo_name = query_repo_name_from_buildername(buildername)
+    request_ids = QUERY_SOURCE.get_buildapi_request_ids(
+        repo_name, [retrigger[1] for retrigger in retriggers])
+    for (rev, _, count), request_id in zip(retriggers, request_ids):
+        LOG.info("Retriggering %d job(s) of %s on %s" % (count, buildername, rev))
+        buildapi.make_retrigger_request(
+            repo_name,
+            request_id,
+            count=count,
+            dry_run=dry_run)
+        if not dry_run:
+            expire_jobs(repo_name, rev)
+
+
+def _prepare_revisions(buildernames, revisions):
+    """Validate and prefetch the jobs of 'revisions' for the repositories of 'buildernames'."""
+    for repo_name in sorted(set(map(query_repo_name_from_buildername, buildernames))):
+        # Validate every revision at once; the checks of _trigger_revision are
+        # answered from VALID_CACHE
+        pushlog.valid_revisions(buildapi.query_repo_url(repo_name), revisions)
+        QUERY_SOURCE.prefetch(repo_name, revisions)
+
+
+def trigger_range(buildername, revisions, times=1, dry_run=False,
+                  files=None, extra_properties=None, trigger_build_if_missing=True,
+                  max_workers=None):
+    """
+    Schedule the job named "buildername" ("times" times) in every revision on 'revisions'.
+
+    Up to max_workers (PARALLEL_WIDTH by default) revisions are handled at the same time.
+    """
     LOG.info("We want to have %s job(s) of %s on revisions %s" %
              (times, buildername, str(revisions)))
-    for rev in revisions:
-        LOG.info("")
-        LOG.info("=== %s ===" % rev)
-        if not pushlog.valid_revision(repo_url, rev):
-            LOG.info("We can't trigger anything on pushes without a valid revision.")
-            continue
+    _prepare_revisions([buildername], revisions)
 
-        LOG.info("We want to have %s job(s) of %s on revision %s" %
-                 (times, buildername, rev))
+    def _trigger(rev):
+        return _trigger_revision(buildername, rev, times, dry_run, files, extra_properties,
+                                 trigger_build_if_missing)
 
-        # 1) How many potentially completed jobs can we get for this buildername?
-        matching_jobs = QUERY_SOURCE.get_matching_jobs(repo_name, rev, buildername)
-        successful_jobs, pending_jobs, running_jobs, _, failed_jobs = _status_summary(matching_jobs)
+    retriggers = parallel_map_with_logs(_trigger, revisions,
+                                        max_workers=max_workers or PARALLEL_WIDTH)
+    _retrigger_jobs(buildername, [retrigger for retrigger in retriggers if retrigger],
+                    dry_run)
 
-        potential_jobs = pending_jobs + running_jobs + successful_jobs + failed_jobs
-        # TODO: change this debug message when we have a less hardcoded _status_summary
-        LOG.debug("We found %d pending/running jobs, %d successful jobs and "
-                  "%d failed jobs" % (pending_jobs + running_jobs, successful_jobs, failed_jobs))
 
-        if potential_jobs >= times:
-            LOG.info("We have %d job(s) for '%s' which is enough for the %d job(s) we want." %
-                     (potential_jobs, buildername, times))
+def _trigger_range_in_parallel(buildernames, revisions, max_workers, times=1, dry_run=False,
+                               files=None, extra_properties=None,
+                               trigger_build_if_missing=True):
+    """trigger_range for several buildernames handling every (builder, revision) concurrently."""
+    for buildername in buildernames:
+        LOG.info("We want to have %s job(s) of %s on revisions %s" %
+                 (times, buildername, str(revisions)))
+    _prepare_revisions(buildernames, revisions)
 
-        else:
-            # 2) If we have less potential jobs than 'times' instances then
-            #    we need to fill it in.
-            LOG.info("We have found %d potential job(s) matching '%s' on %s. "
-                     "We need to trigger more." % (potential_jobs, buildername, rev))
-
-            # If a job matching what we want already exists, we can
-            # use the retrigger API in self-serve to retrigger that
-            # instead of creating a new arbitrary job
-            if len(matching_jobs) > 0 and files is None:
-                request_id = QUERY_SOURCE.get_buildapi_request_id(repo_name, matching_jobs[0])
-                buildapi.make_retrigger_request(
-                    repo_name,
-                    request_id,
-                    count=(times - potential_jobs),
-                    dry_run=dry_run)
-
-            # If no matching job exists, we have to trigger a new arbitrary job
-            else:
-                list_of_requests = trigger_job(
-                    revision=rev,
-                    buildername=buildername,
-                    times=(times - potential_jobs),
-                    dry_run=dry_run,
-                    files=files,
-                    extra_properties=extra_properties,
-                    trigger_build_if_missing=trigger_build_if_missing)
+    units = [(buildername, rev) for buildername in buildernames for rev in revisions]
+
+    def _trigger(unit):
+        return _trigger_revision(unit[0], unit[1], times, dry_run, files, extra_properties,
+                                 trigger_build_if_missing)
+
+    retriggers = parallel_map_with_logs(_trigger, units, max_workers=max_workers)
+    for buildername in buildernames:
+        _retrigger_jobs(buildername,
+                        [retrigger for (name, _), retrigger in zip(units, retriggers)
+                         if retrigger and name == buildername],
+                        dry_run)
 
-                if list_of_requests and any(req.status_code != 202 for req in list_of_requests):
-                    LOG.warning("Not all requests succeeded.")
 
-        # TODO:
-        # 3) Once we trigger a build job, we have to monitor it to make sure that it finishes;
-        #    at that point we have to trigger as many test jobs as we originally intended
-        #    If a build job does not finish, we have to notify the user... what should it then
-        #    happen?
+def trigger_range_for_builders(buildernames, revisions, times=1, dry_run=False, files=None,
+                               extra_properties=None, trigger_build_if_missing=True,
+                               max_workers=None):
+    """
+    Schedule every job of 'buildernames' ("times" times) in every revision on 'revisions'.
+
+    The buildernames are grouped under the build jobs they depend on (see
+    plan_build_jobs) so we only look once per revision for the build job
+    shared by several test jobs and we trigger it at most once.
+
+    If max_workers (PARALLEL_WIDTH by default) is more than 1 every builder on every
+    revision is handled concurrently; what each of them logs is kept together.
+    """
+    global BUILD_JOBS_FOUND, TRIGGER_BATCH
+
+    plan = plan_build_jobs(buildernames)
+    LOG.info("We need %d build job(s) for the %d job(s) requested." %
+             (len([upstream for upstream in plan if upstream is not None]), len(buildernames)))
+    ordered_buildernames = [buildername for build_buildername in sorted(plan.keys())
+                            for buildername in plan[build_buildername]]
+    max_workers = max_workers or PARALLEL_WIDTH
+
+    BUILD_JOBS_FOUND = {}
+    TRIGGER_BATCH = []
+    try:
+        if max_workers > 1:
+            _trigger_range_in_parallel(ordered_buildernames, revisions, max_workers,
+                                       times=times,
+                                       dry_run=dry_run,
+                                       files=files,
+                                       extra_properties=extra_properties,
+                                       trigger_build_if_missing=trigger_build_if_missing)
+        else:
+            for buildername in ordered_buildernames:
+                trigger_range(buildername=buildername,
+                              revisions=revisions,
+                              times=times,
+                              dry_run=dry_run,
+                              files=files,
+                              extra_properties=extra_properties,
+                              trigger_build_if_missing=trigger_build_if_missing)
+
+        # The new jobs are requested at once
+        if TRIGGER_BATCH:
+            list_of_requests = _submit_triggers(TRIGGER_BATCH)
+            if len(list_of_requests) != len(TRIGGER_BATCH) or \
+                    any(req.status_code != 202 for req in list_of_requests):
+                LOG.warning("Not all requests succeeded.")
+    finally:
+        BUILD_JOBS_FOUND = None
+        TRIGGER_BATCH = None
 
 
 def trigger(builder, revision, files=[], dry_run=False, extra_properties=None):
@@ -447,17 +650,64 @@ def trigger(builder, revision, files=[], dry_run=False, extra_properties=None):
 
     Returns a request.
     """
+    _record_scheduling(builder, revision, dry_run=dry_run, downstream=bool(files))
+
+    repo_name = query_repo_name_from_buildername(builder)
+    if TRIGGER_BATCH is not None and not dry_run:
+        TRIGGER_BATCH.append((repo_name, builder, revision, files, extra_properties))
+        return None
+
+    req = buildapi.trigger_arbitrary_job(repo_name, builder, revision, files, dry_run,
+                                         extra_properties)
+    if req is not None:
+        expire_jobs(repo_name, revision)
+    return req
+
+
+def _record_scheduling(builder, revision, times=1, dry_run=False, unique=False,
+                       downstream=False):
+    """
+    Remember that we scheduled 'builder' on 'revision' (see _unique_build_request).
+
+    Unless dry_run is True, the other mozci processes learn about it through the journal.
+    Only build jobs need to be unique across processes so downstream (test) jobs are
+    not added to it. If unique is True we only schedule it if no other process (or
+    thread) has done it already; we return False if one has.
+    """
     global SCHEDULING_MANAGER
-    sch_mgr = SCHEDULING_MANAGER
+    with _SCHEDULING_LOCK:
+        # trigger_range_for_builders can handle two test jobs sharing this build concurrently
+        if unique and builder in SCHEDULING_MANAGER.get(revision, ()):
+            return False
+        if not dry_run:
+            if unique and not journal.reserve(revision, builder):
+                return False
+            if not unique and not downstream:
+                journal.record(revision, [builder] * times)
 
-    if revision not in sch_mgr:
-        sch_mgr[revision] = []
+        SCHEDULING_MANAGER.setdefault(revision, set()).add(builder)
+    return True
 
-    sch_mgr[revision].append(builder)
 
-    repo_name = query_repo_name_from_buildername(builder)
-    return buildapi.trigger_arbitrary_job(repo_name, builder, revision, files, dry_run,
-                                          extra_properties)
+def _submit_triggers(job_requests):
+    """
+    Request concurrently the jobs of 'job_requests' (see buildapi.trigger_arbitrary_jobs).
+
+    We return the list of requests which did not raise an exception.
+    """
+    list_of_requests = []
+    results = buildapi.trigger_arbitrary_jobs(job_requests)
+    for (repo_name, builder, revision, files, _), result in zip(job_requests, results):
+        if isinstance(result, Exception):
+            LOG.error("We failed to request '%s' on %s: %s" % (builder, revision, result))
+            if not files:
+                # Let other processes (or the next run) request the build job
+                journal.forget(revision, [builder])
+            continue
+
+        expire_jobs(repo_name, revision)
+        list_of_requests.append(result)
+    return list_of_requests
 
 
 def trigger_missing_jobs_for_revision(repo_name, revision, dry_run=False):
@@ -469,14 +719,13 @@ def trigger_missing_jobs_for_revision(repo_name, revision, dry_run=False):
                                            ['hg bundle', 'b2g', 'pgo'],
                                            allthethings.list_builders())
 
-    for buildername in all_buildernames:
-        trigger_range(buildername=buildername,
-                      revisions=[revision],
-                      times=1,
-                      dry_run=dry_run,
-                      extra_properties={'mozci_request': {
-                                        'type': 'trigger_missing_jobs_for_revision'}
-                                        })
+    trigger_range_for_builders(buildernames=all_buildernames,
+                               revisions=[revision],
+                               times=1,
+                               dry_run=dry_run,
+                               extra_properties={'mozci_request': {
+                                                 'type': 'trigger_missing_jobs_for_revision'}
+                                                 })
 
 
 def trigger_all_talos_jobs(repo_name, revision, times, dry_run=False):
@@ -487,15 +736,14 @@ def trigger_all_talos_jobs(repo_name, revision, times, dry_run=False):
     if repo_name in ['mozilla-central', 'mozilla-aurora', 'mozilla-beta']:
         pgo = True
     buildernames = build_talos_buildernames_for_repo(repo_name, pgo)
-    for buildername in buildernames:
-        trigger_range(buildername=buildername,
-                      revisions=[revision],
-                      times=times,
-                      dry_run=dry_run,
-                      extra_properties={'mozci_request': {
-                                        'type': 'trigger_all_talos_jobs',
-                                        'times': times}
-                                        })
+    trigger_range_for_builders(buildernames=buildernames,
+                               revisions=[revision],
+                               times=times,
+                               dry_run=dry_run,
+                               extra_properties={'mozci_request': {
+                                                 'type': 'trigger_all_talos_jobs',
+                                                 'times': times}
+                                                 })
 
 
 def manual_backfill(revision, buildername, max_revisions, dry_run=False):
@@ -538,6 +786,7 @@ def _filter_backfill_revlist(buildername, revisions, only_successful=False):
     repo_name = query_repo_name_from_buildername(buildername)
     LOG.info("We want to find a job for '%s' in this range: [%s:%s]" %
              (buildername, revisions[0], revisions[-1]))
+    QUERY_SOURCE.prefetch(repo_name, revisions)
     for rev in revisions:
         matching_jobs = QUERY_SOURCE.get_matching_jobs(repo_name, rev, buildername)
         if not only_successful:
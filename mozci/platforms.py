@@ -330,6 +330,126 @@ def filter_buildernames(include, exclude, buildernames):
     return sorted(buildernames)
 
 
+def plan_build_jobs(buildernames):
+    """
+    Determine the minimal set of build jobs needed by a list of buildernames.
+
+    Returns a dictionary mapping every build job to the requested buildernames
+    which depend on it (the build job itself is included if it was requested).
+    Buildernames without a build job associated to them are under None.
+    """
+    plan = {}
+    for buildername in buildernames:
+        upstream = determine_upstream_builder(buildername)
+        if upstream is None:
+            LOG.warning("We could not find a build job associated to '%s'." % buildername)
+
+        requested = plan.setdefault(upstream, [])
+        if buildername not in requested:
+            requested.append(buildername)
+
+    for upstream, requested in shared_build_jobs(plan).iteritems():
+        LOG.debug("%d of the requested jobs depend on '%s': %s" %
+                  (len(requested), upstream, ', '.join(requested)))
+
+    return plan
+
+
+def shared_build_jobs(plan):
+    """Return the build jobs of a plan (see plan_build_jobs) shared by several test jobs."""
+    shared = {}
+    for upstream, requested in plan.iteritems():
+        if upstream is None:
+            continue
+        downstream = [b for b in requested if b != upstream]
+        if len(downstream) > 1:
+            shared[upstream] = downstream
+    return shared
+
+
+# Buildernames are indexed by their lowercased form so we can find the right
+# capitalization in constant time, e.g.
+# "ubuntu vm 12.04 fx-team opt test jittest-1" : "Ubuntu VM 12.04 fx-team opt test jittest-1"
+# BUILDERNAMES_TRIGRAMS maps every trigram to the buildernames containing it. It is only
+# computed the first time that we need to suggest buildernames for a misspelled one.
+BUILDERNAMES_INDEX = {}
+BUILDERNAMES_TRIGRAMS = {}
+INDEXED_BUILDERS = None
+
+
+def _load_buildernames_index():
+    """Fill BUILDERNAMES_INDEX unless it already represents the current builders."""
+    global INDEXED_BUILDERS
+    builders = fetch_allthethings_data()['builders']
+    if builders is INDEXED_BUILDERS:
+        return builders
+
+    LOG.debug("Indexing buildernames from allthethings data.")
+    BUILDERNAMES_INDEX.clear()
+    BUILDERNAMES_TRIGRAMS.clear()
+    for buildername in builders:
+        BUILDERNAMES_INDEX[buildername.lower()] = buildername
+    INDEXED_BUILDERS = builders
+    return builders
+
+
+def _trigrams(text):
+    """Return the set of trigrams of a lowercased and padded text."""
+    text = '  %s ' % text.lower()
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def _edit_distance(a, b):
+    """Return the Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = range(len(b) + 1)
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def canonical_buildername(buildername):
+    """
+    Return the buildername as it is spelled in allthethings.json.
+
+    The comparison is case insensitive. None is returned for unknown buildernames.
+    """
+    builders = _load_buildernames_index()
+    if buildername in builders:
+        return buildername
+    return BUILDERNAMES_INDEX.get(buildername.lower())
+
+
+def suggest_buildernames(buildername, limit=5, candidates=50):
+    """
+    Return up to 'limit' valid buildernames which are the closest to 'buildername'.
+
+    We first select the 'candidates' buildernames sharing the most trigrams with
+    'buildername' and then we sort them by their edit distance to it.
+    """
+    _load_buildernames_index()
+    if not BUILDERNAMES_TRIGRAMS:
+        for lowercase_name in BUILDERNAMES_INDEX:
+            for trigram in _trigrams(lowercase_name):
+                BUILDERNAMES_TRIGRAMS.setdefault(trigram, []).append(lowercase_name)
+
+    shared_trigrams = collections.Counter()
+    for trigram in _trigrams(buildername):
+        shared_trigrams.update(BUILDERNAMES_TRIGRAMS.get(trigram, []))
+
+    lowercase_buildername = buildername.lower()
+    closest = sorted(
+        (name for name, _ in shared_trigrams.most_common(candidates)),
+        key=lambda name: (_edit_distance(lowercase_buildername, name), name))
+    return [BUILDERNAMES_INDEX[name] for name in closest[:limit]]
+
+
 def _generate_builders_relations_dictionary():
     """Create a dictionary that maps every upstream job to its downstream jobs."""
     builders = list_builders()
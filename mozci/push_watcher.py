@@ -0,0 +1,124 @@
+"""
+This module lets us react to new pushes on many repositories.
+
+A PushWatcher remembers the last push id it has seen on every repository and polls
+json-pushes with startID=<last push id>, so every poll only returns the new pushes.
+The repositories are polled concurrently over the session shared by the sources.
+
+.. code-block:: python
+
+    from mozci.push_watcher import PushWatcher
+
+    def new_push(push):
+        print push["repo_name"], push["pushid"], push["revision"]
+
+    # Every repository in buildapi.query_repositories() unless we give a list
+    PushWatcher(callback=new_push).run()
+
+    # Or, without a callback
+    for push in PushWatcher(["mozilla-inbound", "fx-team"]).watch():
+        ...
+"""
+from __future__ import absolute_import
+
+import logging
+import time
+
+from mozci.sources import buildapi, pushlog
+from mozci.utils.concurrency import MAX_WORKERS, parallel_map
+from mozci.utils.transfer import get_session
+
+LOG = logging.getLogger('mozci')
+# Seconds between two polls of the same repository
+POLL_INTERVAL = 60
+
+
+class PushWatcher(object):
+    """Find the new pushes of several repositories."""
+
+    def __init__(self, repo_names=None, callback=None, interval=POLL_INTERVAL,
+                 max_workers=MAX_WORKERS, remember=False):
+        """
+        If 'remember' is True the pushes found are added to what mozci.sources.pushlog
+        keeps on disk about pushes, so later lookups of their revisions need no request.
+        """
+        if repo_names is None:
+            repo_names = sorted(name for name, repo in buildapi.query_repositories().iteritems()
+                                if repo.get("repo_type", "hg") == "hg")
+        self.repo_names = list(repo_names)
+        self.callback = callback
+        self.interval = interval
+        self.max_workers = max_workers
+        self.remember = remember
+        # Repository name to the last push id we have seen
+        self.last_push_ids = {}
+
+    def _poll_repo(self, repo_name):
+        """Return the pushes of a repository since the last poll (oldest first)."""
+        repo_url = buildapi.query_repo_url(repo_name)
+        last_push_id = self.last_push_ids.get(repo_name)
+        url = "%s?version=2&startID=%d" % (pushlog.JSON_PUSHES % {"repo_url": repo_url},
+                                           last_push_id or 0)
+        if last_push_id is None:
+            # The first poll only tells us where the repository is
+            url += "&endID=0"
+
+        LOG.debug("About to fetch %s" % url)
+        data = get_session().get(url).json()
+        self.last_push_ids[repo_name] = max(last_push_id or 0, data["lastpushid"])
+        pushes = data["pushes"]
+        if not pushes:
+            return []
+
+        if self.remember:
+            pushlog._remember_pushes(repo_url, pushes)
+        return [{
+            "repo_name": repo_name,
+            "repo_url": repo_url,
+            # Like the "pushid" of pushlog.query_revision_info
+            "pushid": str(push_id),
+            "revision": pushes[str(push_id)]["changesets"][-1][:12],
+            "changesets": pushes[str(push_id)]["changesets"],
+            "date": pushes[str(push_id)]["date"],
+            "user": pushes[str(push_id)]["user"],
+        } for push_id in sorted(map(int, pushes.keys()))]
+
+    def poll(self):
+        """
+        Return the new pushes of every repository since the previous poll.
+
+        The first poll only finds the last push of every repository and returns nothing.
+        Every push is a dictionary with its "repo_name", "repo_url", "pushid" (a string),
+        "revision" (12 chars of the tip), "changesets", "date" and "user"; they are sorted
+        by date.
+        """
+        def _poll(repo_name):
+            try:
+                return self._poll_repo(repo_name)
+            except Exception, e:
+                # We will get these pushes on the next poll
+                LOG.warning("We failed to poll the pushes of %s: %s" % (repo_name, e))
+                return []
+
+        new_pushes = []
+        for pushes in parallel_map(_poll, self.repo_names, max_workers=self.max_workers):
+            new_pushes.extend(pushes)
+        if new_pushes and self.remember:
+            pushlog._save_push_info()
+        return sorted(new_pushes, key=lambda push: (push["date"], int(push["pushid"])))
+
+    def watch(self, polls=None):
+        """Yield every new push as we find it; poll 'polls' times (forever if None)."""
+        count = 0
+        while polls is None or count < polls:
+            if count:
+                time.sleep(self.interval)
+            count += 1
+            for push in self.poll():
+                yield push
+
+    def run(self, polls=None):
+        """Call the callback with every new push; poll 'polls' times (forever if None)."""
+        assert self.callback is not None, "We need a callback to call with the new pushes"
+        for push in self.watch(polls):
+            self.callback(push)
@@ -1,9 +1,16 @@
+import json
 import logging
+import os
+import tempfile
+import threading
+import time
 
 from abc import ABCMeta, abstractmethod
 from thclient import TreeherderClient
 from sources import buildapi
-from sources.buildjson import query_job_data, BuildjsonException
+from sources.buildjson import query_jobs_data, BuildjsonException
+from utils.concurrency import MAX_WORKERS, parallel_imap, parallel_map
+from utils.transfer import path_to_file
 
 
 LOG = logging.getLogger('mozci')
@@ -12,12 +19,136 @@ LOG = logging.getLogger('mozci')
 PENDING, RUNNING, COALESCED, UNKNOWN = range(-4, 0)
 SUCCESS, WARNING, FAILURE, SKIPPED, EXCEPTION, RETRY, CANCELLED = range(7)
 JOBS_CACHE = {}
+# Freshness of the entries of JOBS_CACHE, e.g.
+# ("try", "146071751b1e"): {"expires": 1433166609.2, "validators": {"etag": '"abc"'}}
+# Once every job of a revision has completed the entry never expires ("expires" is None).
+# Revisions with pending or running jobs expire after JOBS_CACHE_TTL seconds and are then
+# refreshed with a conditional request. Entries without metadata are considered fresh.
+JOBS_CACHE_METADATA = {}
+JOBS_CACHE_TTL = 120
+# Jobs from Treeherder keyed by repository, revision and query parameters
+# with the same expiration policy as JOBS_CACHE.
+TREEHERDER_JOBS_CACHE = {}
+TREEHERDER_JOBS_CACHE_METADATA = {}
+# Maximum number of jobs that Treeherder returns per request
+TREEHERDER_PAGE_SIZE = 2000
+# The cached jobs of a revision grouped by buildername (and by request_id for buildapi).
+# Every entry keeps the list of jobs it was computed from so we can tell when it is outdated.
+JOBS_INDEX = {}
+TREEHERDER_JOBS_INDEX = {}
+# Whether the successful buildapi jobs were coalesced (COALESCED) or not (SUCCESS)
+# keyed by request_id. A completed job never changes so these never expire.
+COALESCED_CACHE = {}
+# Buildapi request_ids of Treeherder jobs keyed by repository and job id, e.g.
+# {"mozilla-inbound": {"11236754": 71123549}}. Job ids never change so we store them on disk.
+TREEHERDER_REQUEST_IDS = None
+TREEHERDER_REQUEST_IDS_FILE = path_to_file("treeherder_request_ids.json")
+# Number of job ids we ask the artifacts API about in a single request
+ARTIFACTS_BATCH_SIZE = 100
+# Treeherder's internal ids of the revisions keyed by repository and revision, e.g.
+# {"mozilla-inbound": {"146071751b1e": 16679}}. They never change so we store them on disk.
+TREEHERDER_RESULTSET_IDS = None
+TREEHERDER_RESULTSET_IDS_FILE = path_to_file("treeherder_resultset_ids.json")
+# Number of revisions we ask the resultsets API about in a single request
+RESULTSETS_BATCH_SIZE = 50
+# Revisions Treeherder did not know about keyed by repository and revision, with the time
+# we asked. We ask again after UNKNOWN_RESULTSETS_TTL seconds since they might have been
+# pushed since.
+UNKNOWN_RESULTSETS = {}
+UNKNOWN_RESULTSETS_TTL = 10 * 60
+# Guards TREEHERDER_REQUEST_IDS, TREEHERDER_RESULTSET_IDS and UNKNOWN_RESULTSETS
+# (and saving them) since several threads can look up ids at the same time
+TREEHERDER_IDS_LOCK = threading.RLock()
 
 
 class TreeherderException(Exception):
     pass
 
 
+def _fresh_in_cache(cache, metadata, key):
+    """Determine if 'key' is in 'cache' and it has not expired."""
+    if key not in cache:
+        return False
+    expires = metadata.get(key, {}).get("expires")
+    return expires is None or expires > time.time()
+
+
+def _cache_jobs(cache, metadata, key, jobs, completed, validators=None):
+    """Store the jobs of a revision in 'cache' and determine when they will expire."""
+    cache[key] = jobs
+    metadata[key] = {
+        "expires": None if completed else time.time() + JOBS_CACHE_TTL,
+        "validators": validators or {},
+    }
+
+
+def expire_jobs(repo_name, revision):
+    """
+    Make the cached jobs of a revision expire now.
+
+    Call it after scheduling jobs on a revision; the cached jobs do not include the new
+    ones. The validators are kept so the next fetch can be a conditional request.
+    """
+    now = time.time()
+    for metadata in (JOBS_CACHE_METADATA, TREEHERDER_JOBS_CACHE_METADATA):
+        for key, entry in metadata.items():
+            if key[:2] == (repo_name, revision):
+                entry["expires"] = now
+    buildapi.remove_completed_jobs_schedule(repo_name, revision)
+
+
+def _group_jobs(jobs, field):
+    """Return a dictionary mapping every value of 'field' to the jobs with it."""
+    grouped = {}
+    for job in jobs:
+        grouped.setdefault(job[field], []).append(job)
+    return grouped
+
+
+def _load_json_file(filepath):
+    """Return the dictionary stored on 'filepath' or an empty one."""
+    if os.path.exists(filepath):
+        try:
+            with open(filepath) as fd:
+                return json.load(fd)
+        except ValueError:
+            LOG.debug("%s is corrupted; we will fetch its data again." % filepath)
+    return {}
+
+
+def _save_json_file(filepath, data):
+    """Store 'data' on 'filepath'."""
+    # We write to a temporary file first so other processes never read a partial file
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    with os.fdopen(fd, "w") as tmp_fd:
+        json.dump(data, tmp_fd)
+    os.rename(tmp_filepath, filepath)
+
+
+def _load_request_ids():
+    """Return TREEHERDER_REQUEST_IDS after loading it from disk if needed."""
+    global TREEHERDER_REQUEST_IDS
+    with TREEHERDER_IDS_LOCK:
+        if TREEHERDER_REQUEST_IDS is None:
+            TREEHERDER_REQUEST_IDS = _load_json_file(TREEHERDER_REQUEST_IDS_FILE)
+        return TREEHERDER_REQUEST_IDS
+
+
+def _load_resultset_ids():
+    """Return TREEHERDER_RESULTSET_IDS after loading it from disk if needed."""
+    global TREEHERDER_RESULTSET_IDS
+    with TREEHERDER_IDS_LOCK:
+        if TREEHERDER_RESULTSET_IDS is None:
+            TREEHERDER_RESULTSET_IDS = _load_json_file(TREEHERDER_RESULTSET_IDS_FILE)
+        return TREEHERDER_RESULTSET_IDS
+
+
+def _unknown_resultset(repo_name, revision):
+    """Determine if Treeherder did not know 'revision' less than UNKNOWN_RESULTSETS_TTL ago."""
+    asked_at = UNKNOWN_RESULTSETS.get((repo_name, revision))
+    return asked_at is not None and time.time() - asked_at < UNKNOWN_RESULTSETS_TTL
+
+
 class QueryApi(object):
     """ Base class for common query methods """
 
@@ -31,10 +162,27 @@ class QueryApi(object):
     def get_buildapi_request_id(self, repo_name, job):
         pass
 
+    def get_buildapi_request_ids(self, repo_name, jobs):
+        """
+        Return the buildapi request_ids of several jobs (in the same order).
+
+        Sources which can look them up in batches override this.
+        """
+        return [self.get_buildapi_request_id(repo_name, job) for job in jobs]
+
     @abstractmethod
     def get_job_status(self, job):
         pass
 
+    def prefetch(self, repo_name, revisions):
+        """
+        Fetch ahead of time the jobs of several revisions.
+
+        Sources which can fetch many revisions at once override this; by default
+        the jobs are fetched as they are needed.
+        """
+        pass
+
 
 class BuildApi(QueryApi):
 
@@ -46,11 +194,62 @@ class BuildApi(QueryApi):
 
         raises BuildapiException
         """
-        if (repo_name, revision) not in JOBS_CACHE:
-            JOBS_CACHE[(repo_name, revision)] = \
-                buildapi.query_jobs_schedule(repo_name, revision)
-
-        return JOBS_CACHE[(repo_name, revision)]
+        key = (repo_name, revision)
+        if not _fresh_in_cache(JOBS_CACHE, JOBS_CACHE_METADATA, key) and \
+                not self._load_completed_jobs(key):
+            validators = self._validators(key)
+            jobs = buildapi.query_jobs_schedule(repo_name, revision, validators=validators)
+            self._cache_jobs(key, jobs, validators)
+
+        return JOBS_CACHE[key]
+
+    def _load_completed_jobs(self, key):
+        """Fill the cache with the jobs stored on disk for a revision. Return True if found."""
+        if key in JOBS_CACHE:
+            # The jobs on disk could only be older than the ones in memory
+            return False
+
+        jobs = buildapi.load_completed_jobs_schedule(*key)
+        if jobs is None:
+            return False
+
+        _cache_jobs(JOBS_CACHE, JOBS_CACHE_METADATA, key, jobs, completed=True)
+        return True
+
+    def _validators(self, key):
+        """Return a copy of the validators of a cached revision for a conditional request."""
+        if key not in JOBS_CACHE:
+            return {}
+        return dict(JOBS_CACHE_METADATA.get(key, {}).get("validators", {}))
+
+    def _cache_jobs(self, key, jobs, validators):
+        """Store the jobs of a revision. If jobs is None the cached jobs have not changed."""
+        if jobs is None:
+            LOG.debug("The jobs of %s have not changed since we fetched them." % str(key))
+            jobs = JOBS_CACHE[key]
+
+        completed = len(jobs) > 0 and all(self._is_completed(job) for job in jobs)
+        _cache_jobs(JOBS_CACHE, JOBS_CACHE_METADATA, key, jobs, completed, validators)
+        if completed:
+            buildapi.save_completed_jobs_schedule(key[0], key[1], jobs)
+
+    def _is_completed(self, job):
+        """Determine if a job from self-serve has reached a final state."""
+        return job.get("status") is not None
+
+    def prefetch(self, repo_name, revisions):
+        """Fetch concurrently the jobs of the revisions that are not fresh in JOBS_CACHE."""
+        keys = [(repo_name, rev) for rev in revisions
+                if not _fresh_in_cache(JOBS_CACHE, JOBS_CACHE_METADATA, (repo_name, rev)) and
+                not self._load_completed_jobs((repo_name, rev))]
+        if not keys:
+            return
+
+        validators = dict((key[1], self._validators(key)) for key in keys)
+        schedules = buildapi.query_jobs_schedules(repo_name, [key[1] for key in keys],
+                                                  validators=validators)
+        for revision, jobs in schedules.iteritems():
+            self._cache_jobs((repo_name, revision), jobs, validators[revision])
 
     def get_buildapi_request_id(self, repo_name, job):
         """ Method to return buildapi's request_id for a job. """
@@ -60,19 +259,38 @@ class BuildApi(QueryApi):
             return job["requests"][0]["request_id"]
         return job["request_id"]
 
+    def _jobs_index(self, repo_name, revision):
+        """Return the jobs of a revision indexed by buildername and by request_id."""
+        key = (repo_name, revision)
+        all_jobs = self._get_all_jobs(repo_name, revision)
+        entry = JOBS_INDEX.get(key)
+        if entry is None or entry[0] is not all_jobs:
+            by_request_id = {}
+            for job in all_jobs:
+                for request in job.get("requests", []):
+                    by_request_id[request["request_id"]] = job
+                if "request_id" in job:
+                    by_request_id[job["request_id"]] = job
+
+            entry = (all_jobs, _group_jobs(all_jobs, "buildername"), by_request_id)
+            JOBS_INDEX[key] = entry
+
+        return entry[1], entry[2]
+
     def get_matching_jobs(self, repo_name, revision, buildername):
         """Return all jobs that matched the criteria."""
         LOG.debug("Find jobs matching '%s'" % buildername)
-        all_jobs = self._get_all_jobs(repo_name, revision)
-        matching_jobs = []
-        for j in all_jobs:
-            if j["buildername"] == buildername:
-                matching_jobs.append(j)
+        jobs_by_buildername = self._jobs_index(repo_name, revision)[0]
+        matching_jobs = list(jobs_by_buildername.get(buildername, []))
 
         LOG.debug("We have found %d job(s) of '%s'." %
                   (len(matching_jobs), buildername))
         return matching_jobs
 
+    def get_job_by_request_id(self, repo_name, revision, request_id):
+        """Return the job of a revision associated to a buildapi request_id or None."""
+        return self._jobs_index(repo_name, revision)[1].get(request_id)
+
     def get_job_status(self, job):
         """Helper to determine the scheduling status of a job from self-serve."""
         if "status" not in job:
@@ -100,16 +318,38 @@ class BuildApi(QueryApi):
         """
         assert job["status"] == SUCCESS
 
-        req = job["requests"][0]
-        status_data = query_job_data(req["complete_at"], req["request_id"])
-        if not status_data:
+        request_id = job["requests"][0]["request_id"]
+        if request_id not in COALESCED_CACHE:
+            self._classify_successful_jobs([job])
+
+        if request_id not in COALESCED_CACHE:
             LOG.info("We have not found the job. We assume the job to be running.")
             return RUNNING
+        return COALESCED_CACHE[request_id]
 
-        if status_data["properties"]["revision"][0:12] != req["revision"][0:12]:
-            return COALESCED
-        else:
-            return SUCCESS
+    def _classify_successful_jobs(self, jobs):
+        """
+        Determine which of the jobs with status 'SUCCESS' were coalesced.
+
+        We look up in buildjson all jobs we have not classified before at once and store
+        the results in COALESCED_CACHE.
+        """
+        requests = [job["requests"][0] for job in jobs
+                    if job["requests"][0]["request_id"] not in COALESCED_CACHE]
+        if not requests:
+            return
+
+        status_data = query_jobs_data([(req["complete_at"], req["request_id"])
+                                       for req in requests])
+        for req in requests:
+            data = status_data[req["request_id"]]
+            if not data:
+                continue
+
+            if data["properties"]["revision"][0:12] != req["revision"][0:12]:
+                COALESCED_CACHE[req["request_id"]] = COALESCED
+            else:
+                COALESCED_CACHE[req["request_id"]] = SUCCESS
 
     def find_all_jobs_by_status(self, repo_name, revision, status):
         """
@@ -118,6 +358,13 @@ class BuildApi(QueryApi):
         Returns a list with the request_ids of the jobs whose only status is 'status'.
         """
         all_jobs = self._get_all_jobs(repo_name, revision)
+        try:
+            self._classify_successful_jobs([job for job in all_jobs
+                                            if job.get("status") == SUCCESS])
+        except BuildjsonException:
+            # We will find out below which jobs we can't get information for
+            pass
+
         request_id_by_buildername = {}
         right_status_buildernames = set()
         wrong_status_buildernames = set()
@@ -148,29 +395,174 @@ class TreeherderApi(QueryApi):
         Return all jobs for a given revision.
         If we can't query about this revision in treeherder api, we return an empty list.
         """
-        # We query treeherder for its internal revision_id, and then get the jobs from them.
-        # We cannot get jobs directly from revision and repo_name in TH api.
-        # See: https://bugzilla.mozilla.org/show_bug.cgi?id=1165401
-        results = self.treeherder_client.get_resultsets(repo_name, revision=revision, **params)
+        key = (repo_name, revision) + tuple(sorted(params.iteritems()))
+        if not _fresh_in_cache(TREEHERDER_JOBS_CACHE, TREEHERDER_JOBS_CACHE_METADATA, key):
+            # iter_jobs caches the jobs once we have gone through all of them
+            list(self.iter_jobs(repo_name, revision, **params))
+
+        return TREEHERDER_JOBS_CACHE[key]
+
+    def iter_jobs(self, repo_name, revision, fields=None, **params):
+        """
+        Yield all jobs for a given revision as they arrive from Treeherder.
+
+        The jobs are requested in pages of TREEHERDER_PAGE_SIZE jobs; after the first page,
+        up to MAX_WORKERS pages are requested at the same time.
+        If a list of fields is given, only those keys of every job are yielded.
+        """
+        key = (repo_name, revision) + tuple(sorted(params.iteritems()))
+        cached = _fresh_in_cache(TREEHERDER_JOBS_CACHE, TREEHERDER_JOBS_CACHE_METADATA, key)
+        if cached:
+            pages = [TREEHERDER_JOBS_CACHE[key]]
+        else:
+            pages = self._iter_job_pages(repo_name, revision, **params)
+
         all_jobs = []
-        if results:
-            revision_id = results[0]["id"]
-            all_jobs = self.treeherder_client.get_jobs(repo_name, count=2000,
-                                                       result_set_id=revision_id, **params)
-        return all_jobs
+        for page in pages:
+            all_jobs.extend(page)
+            for job in page:
+                if fields is None:
+                    yield job
+                else:
+                    yield dict((field, job[field]) for field in fields if field in job)
+
+        if not cached:
+            completed = len(all_jobs) > 0 and \
+                all(job["state"] == "completed" for job in all_jobs)
+            _cache_jobs(TREEHERDER_JOBS_CACHE, TREEHERDER_JOBS_CACHE_METADATA, key, all_jobs,
+                        completed)
+
+    def _iter_job_pages(self, repo_name, revision, **params):
+        """Yield in order the pages of jobs for a given revision."""
+        revision_id = self.query_resultset_ids(repo_name, [revision]).get(revision)
+        if revision_id is None:
+            return
+
+        def _fetch_page(offset):
+            LOG.debug("Fetching the jobs of %s starting at %d" % (revision, offset))
+            return self.treeherder_client.get_jobs(repo_name, count=TREEHERDER_PAGE_SIZE,
+                                                   offset=offset, result_set_id=revision_id,
+                                                   **params)
+
+        # Most revisions fit in one page; the client does not give us the number of jobs
+        # so we request twice as many pages at once (up to MAX_WORKERS) after every full wave
+        offsets = [0]
+        while True:
+            for page in parallel_imap(_fetch_page, offsets):
+                yield page
+                if len(page) < TREEHERDER_PAGE_SIZE:
+                    # Closing parallel_imap drops the pages of the wave not requested yet
+                    return
+            wave = min(2 * len(offsets), MAX_WORKERS)
+            offsets = [offsets[-1] + TREEHERDER_PAGE_SIZE * i for i in range(1, wave + 1)]
 
     def get_buildapi_request_id(self, repo_name, job):
         """ Method to return buildapi's request_id. """
-        job_id = job["id"]
-        query_params = {'job_id': job_id,
-                        'name': 'buildapi'}
-        LOG.debug("We are fetching request_id from treeherder artifacts api")
-        artifact_content = self.treeherder_client.get_artifacts(repo_name,
-                                                                **query_params)
-        return artifact_content[0]["blob"]["request_id"]
+        return self.get_buildapi_request_ids(repo_name, [job])[0]
+
+    def get_buildapi_request_ids(self, repo_name, jobs):
+        """
+        Return the buildapi request_ids of several jobs (in the same order).
+
+        We ask the artifacts API about ARTIFACTS_BATCH_SIZE jobs per request and only
+        about jobs we have not looked up before.
+        """
+        with TREEHERDER_IDS_LOCK:
+            request_ids = _load_request_ids().setdefault(repo_name, {})
+            job_ids = [str(job["id"]) for job in jobs]
+            missing = sorted(set(job_id for job_id in job_ids if job_id not in request_ids))
+
+        if missing:
+            LOG.debug("We are fetching %d request_id(s) from treeherder artifacts api" %
+                      len(missing))
+            batches = [missing[i:i + ARTIFACTS_BATCH_SIZE]
+                       for i in range(0, len(missing), ARTIFACTS_BATCH_SIZE)]
+
+            def _fetch_batch(batch):
+                return self.treeherder_client.get_artifacts(repo_name,
+                                                            job_id__in=",".join(batch),
+                                                            name='buildapi')
+
+            all_artifacts = parallel_map(_fetch_batch, batches)
+            with TREEHERDER_IDS_LOCK:
+                for artifacts in all_artifacts:
+                    for artifact in artifacts:
+                        request_ids[str(artifact["job_id"])] = artifact["blob"]["request_id"]
+                _save_json_file(TREEHERDER_REQUEST_IDS_FILE, TREEHERDER_REQUEST_IDS)
+
+        for job_id in job_ids:
+            if job_id not in request_ids:
+                raise TreeherderException("Treeherder has no buildapi artifact for job %s" %
+                                          job_id)
+        return [request_ids[job_id] for job_id in job_ids]
+
+    def query_resultset_ids(self, repo_name, revisions):
+        """
+        Return a dictionary mapping revisions to Treeherder's internal id for them.
+
+        We cannot get jobs directly from revision and repo_name in TH api.
+        See: https://bugzilla.mozilla.org/show_bug.cgi?id=1165401
+        We ask the resultsets API about RESULTSETS_BATCH_SIZE revisions per request and
+        only about revisions we have not looked up before. Unknown revisions are left out
+        (and not asked about again for UNKNOWN_RESULTSETS_TTL seconds).
+        """
+        with TREEHERDER_IDS_LOCK:
+            resultset_ids = _load_resultset_ids().setdefault(repo_name, {})
+            missing = sorted(set(revision for revision in revisions
+                                 if revision not in resultset_ids and
+                                 not _unknown_resultset(repo_name, revision)))
+
+        if missing:
+            LOG.debug("We are fetching %d resultset id(s) from treeherder" % len(missing))
+            batches = [missing[i:i + RESULTSETS_BATCH_SIZE]
+                       for i in range(0, len(missing), RESULTSETS_BATCH_SIZE)]
+
+            def _fetch_batch(batch):
+                return self.treeherder_client.get_resultsets(repo_name,
+                                                             revision__in=",".join(batch),
+                                                             count=len(batch))
+
+            all_results = parallel_map(_fetch_batch, batches)
+            with TREEHERDER_IDS_LOCK:
+                for results in all_results:
+                    for result in results:
+                        # We might have asked about a short revision and got the long one back
+                        for revision in missing:
+                            if result["revision"].startswith(revision) or \
+                                    revision.startswith(result["revision"]):
+                                resultset_ids[revision] = result["id"]
+                now = time.time()
+                unknown = [revision for revision in missing if revision not in resultset_ids]
+                for revision in unknown:
+                    UNKNOWN_RESULTSETS[(repo_name, revision)] = now
+                if len(unknown) < len(missing):
+                    _save_json_file(TREEHERDER_RESULTSET_IDS_FILE, TREEHERDER_RESULTSET_IDS)
+
+        return dict((revision, resultset_ids[revision]) for revision in revisions
+                    if revision in resultset_ids)
+
+    def prefetch(self, repo_name, revisions, hidden=False):
+        """
+        Fetch concurrently the jobs of several revisions (and their hidden jobs if 'hidden').
+
+        The Treeherder ids of all the revisions are looked up at once.
+        """
+        revisions = list(revisions)
+        self.query_resultset_ids(repo_name, revisions)
+        queries = [(revision, {}) for revision in revisions]
+        if hidden:
+            queries += [(revision, {"visibility": "excluded"}) for revision in revisions]
+
+        def _fetch_jobs(query):
+            revision, params = query
+            return self._get_all_jobs(repo_name, revision, **params)
+
+        parallel_map(_fetch_jobs, queries)
 
     def get_hidden_jobs(self, repo_name, revision):
         """ Return all hidden jobs on Treeherder """
+        # Whoever looks at the hidden jobs also looks at the visible ones
+        self.prefetch(repo_name, [revision], hidden=True)
         return self._get_all_jobs(repo_name, revision=revision, visibility='excluded')
 
     def get_matching_jobs(self, repo_name, revision, buildername):
@@ -178,11 +570,13 @@ class TreeherderApi(QueryApi):
         Return all jobs that matched the criteria.
         """
         LOG.debug("Find jobs matching '%s'" % buildername)
+        key = (repo_name, revision)
         all_jobs = self._get_all_jobs(repo_name, revision)
-        matching_jobs = []
-        for j in all_jobs:
-            if j["ref_data_name"] == buildername:
-                matching_jobs.append(j)
+        entry = TREEHERDER_JOBS_INDEX.get(key)
+        if entry is None or entry[0] is not all_jobs:
+            entry = (all_jobs, _group_jobs(all_jobs, "ref_data_name"))
+            TREEHERDER_JOBS_INDEX[key] = entry
+        matching_jobs = list(entry[1].get(buildername, []))
 
         LOG.debug("We have found %d job(s) of '%s'." %
                   (len(matching_jobs), buildername))
@@ -3,12 +3,15 @@ import urllib
 
 from argparse import ArgumentParser
 
-from mozci.mozci import find_backfill_revlist, trigger_range, set_query_source,\
-    query_repo_name_from_buildername, query_repo_url_from_buildername, query_builders
+from mozci.mozci import find_backfill_revlist, trigger_range_for_builders, set_query_source,\
+    query_repo_name_from_buildername, query_repo_url_from_buildername
+from mozci.platforms import canonical_buildername
 from mozci.sources.buildapi import make_retrigger_request, query_repo_url, valid_credentials
-from mozci.query_jobs import BuildApi, COALESCED
+from mozci.query_jobs import BuildApi, COALESCED, expire_jobs
 from mozci.sources.pushlog import query_revisions_range, \
     query_revisions_range_from_revision_before_and_after
+from mozci.utils import cassette
+from mozci.utils.concurrency import parallel_map_with_logs
 from mozci.utils.misc import setup_logging
 from mozci.sources.pushlog import query_repo_tip
 
@@ -63,6 +66,22 @@ def parse_args(argv=None):
                         dest="debug",
                         help="set debug for logging.")
 
+    parser.add_argument("--record",
+                        metavar="CASSETTE",
+                        dest="record",
+                        help="Store every http request made on a cassette file.")
+
+    parser.add_argument("--replay",
+                        metavar="CASSETTE",
+                        dest="replay",
+                        help="Answer every http request from a cassette file recorded "
+                        "with --record.")
+
+    parser.add_argument("--zero-latency",
+                        action="store_true",
+                        dest="zero_latency",
+                        help="This flag is used with --replay. Replayed requests take no time.")
+
     parser.add_argument("--query-source",
                         metavar="[buildapi|treeherder]",
                         dest="query_source",
@@ -107,6 +126,12 @@ def parse_args(argv=None):
                         dest="repo_name",
                         help="Branch name")
 
+    parser.add_argument("--parallel",
+                        dest="parallel",
+                        type=int,
+                        default=1,
+                        help="Number of revisions (and builders) we handle at the same time.")
+
     options = parser.parse_args(argv)
     return options
 
@@ -133,6 +158,9 @@ def validate_options(options):
             error_message = "You should not pass --end-rev " \
                             "when you use --delta."
 
+    if options.record and options.replay:
+        error_message = "You should not pass --record and --replay together."
+
     if error_message:
         raise Exception(error_message)
 
@@ -145,11 +173,7 @@ def sanitize_buildernames(buildernames):
     ret_value = []
     for buildername in buildernames_list:
         buildername = buildername.strip()
-        builders = query_builders()
-        for builder in builders:
-            if buildername.lower() == builder.lower():
-                buildername = builder
-        ret_value.append(buildername)
+        ret_value.append(canonical_buildername(buildername) or buildername)
     return ret_value
 
 
@@ -195,6 +219,11 @@ def determine_revlist(repo_url, buildername, rev, back_revisions,
 def main():
     options = parse_args()
     validate_options(options)
+    if options.record:
+        cassette.record(options.record)
+    elif options.replay:
+        cassette.replay(options.replay, zero_latency=options.zero_latency)
+
     valid_credentials()
 
     if options.debug:
@@ -227,13 +256,31 @@ def main():
             make_retrigger_request(repo_name=options.repo_name,
                                    request_id=request_id,
                                    dry_run=options.dry_run)
+        if request_ids and not options.dry_run:
+            expire_jobs(options.repo_name, options.rev)
 
         return
 
-    for buildername in options.buildernames:
+    if options.backfill:
+        # Every builder has its own last good job to backfill to
+        def _backfill_revlist(buildername):
+            return ([buildername], determine_revlist(
+                repo_url=repo_url,
+                buildername=buildername,
+                rev=options.rev,
+                back_revisions=options.back_revisions,
+                delta=options.delta,
+                from_rev=options.from_rev,
+                backfill=options.backfill,
+                skips=options.skips,
+                max_revisions=options.max_revisions))
+
+        revlists = parallel_map_with_logs(_backfill_revlist, options.buildernames,
+                                          max_workers=options.parallel)
+    else:
         revlist = determine_revlist(
             repo_url=repo_url,
-            buildername=buildername,
+            buildername=None,
             rev=options.rev,
             back_revisions=options.back_revisions,
             delta=options.delta,
@@ -241,26 +288,32 @@ def main():
             backfill=options.backfill,
             skips=options.skips,
             max_revisions=options.max_revisions)
+        # All builders share the revisions; trigger them together so every
+        # build job they depend on is only considered once per revision
+        revlists = [(options.buildernames, revlist)]
 
+    for buildernames, revlist in revlists:
         try:
-            trigger_range(
-                buildername=buildername,
+            trigger_range_for_builders(
+                buildernames=buildernames,
                 revisions=revlist,
                 times=options.times,
                 dry_run=options.dry_run,
                 files=options.files,
-                trigger_build_if_missing=options.trigger_build_if_missing
+                trigger_build_if_missing=options.trigger_build_if_missing,
+                max_workers=options.parallel
             )
         except Exception, e:
             LOG.exception(e)
             exit(1)
 
         if revlist:
-            LOG.info('https://treeherder.mozilla.org/#/jobs?%s' %
-                     urllib.urlencode({'repo': options.repo_name,
-                                       'fromchange': revlist[-1],
-                                       'tochange': revlist[0],
-                                       'filter-searchStr': buildername}))
+            for buildername in buildernames:
+                LOG.info('https://treeherder.mozilla.org/#/jobs?%s' %
+                         urllib.urlencode({'repo': options.repo_name,
+                                           'fromchange': revlist[-1],
+                                           'tochange': revlist[0],
+                                           'filter-searchStr': buildername}))
 
 
 if __name__ == "__main__":
@@ -12,21 +12,33 @@ http://moz-releng-buildapi.readthedocs.org
 from __future__ import absolute_import
 # We use json instead of ujson because it does not support
 # json.dumps() with sort_keys
+import gzip
 import json
 import logging
 import os
+import tempfile
 
 import requests
 
 from mozci.utils.authentication import get_credentials, remove_credentials, \
     AuthenticationError
-from mozci.utils.transfer import path_to_file
+from mozci.utils.concurrency import MAX_WORKERS, SingleFlight, TokenBucket, parallel_map
+from mozci.utils.transfer import get_session, path_to_file
 from mozci.sources import pushlog
 
 LOG = logging.getLogger('mozci')
 HOST_ROOT = 'https://secure.pub.build.mozilla.org/buildapi/self-serve'
 REPOSITORIES_FILE = path_to_file("repositories.txt")
 REPOSITORIES = {}
+# Self-serve should not receive more than TRIGGER_RATE requests to schedule or cancel
+# jobs per second on average
+TRIGGER_RATE = 5
+TRIGGER_BURST = MAX_WORKERS
+# The job schedules of revisions whose jobs have all completed do not change anymore.
+# We store them in here, e.g. jobs_schedules/try/146071751b1e.json.gz
+JOBS_SCHEDULES_DIR = path_to_file("jobs_schedules")
+# Identical requests made at the same time share one request
+IN_FLIGHT = SingleFlight()
 
 
 class BuildapiException(Exception):
@@ -66,6 +78,41 @@ def trigger_arbitrary_job(repo_name, builder, revision, files=[], dry_run=False,
     return req
 
 
+def trigger_arbitrary_jobs(job_requests, dry_run=False, max_workers=MAX_WORKERS,
+                           rate_limiter=None):
+    """
+    Request buildapi to trigger several jobs concurrently.
+
+    job_requests is a list of (repo_name, builder, revision, files, extra_properties).
+    The requests are rate limited with a TokenBucket (TRIGGER_RATE per second by default).
+
+    We return a list with the request made for every job (None if dry_run is True)
+    or the exception we got while requesting it.
+    """
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(TRIGGER_RATE, TRIGGER_BURST)
+
+    if not dry_run:
+        # Ask for the credentials (if needed) only once and before using threads
+        get_credentials()
+
+    def _trigger(job_request):
+        repo_name, builder, revision, files, extra_properties = job_request
+        rate_limiter.acquire()
+        try:
+            return trigger_arbitrary_job(repo_name, builder, revision, files or [], dry_run,
+                                         extra_properties)
+        except AuthenticationError:
+            # Every other request would fail the same way
+            raise
+        except Exception, e:
+            LOG.debug("We failed to request '%s' on %s: %s" % (builder, revision, e))
+            return e
+
+    LOG.debug("About to request %d job(s)" % len(job_requests))
+    return parallel_map(_trigger, job_requests, max_workers=max_workers)
+
+
 def make_retrigger_request(repo_name, request_id, count=1, priority=0, dry_run=True):
     """
     Retrigger a request using buildapi self-serve. Returns a request.
@@ -119,6 +166,54 @@ def make_cancel_request(repo_name, request_id, dry_run=True):
     return req
 
 
+def make_stop_build_request(repo_name, build_id, dry_run=True):
+    """
+    Stop a running build using buildapi self-serve. Returns a request.
+
+    Buildapi documentation:
+    DELETE /self-serve/{branch}/build/{build_id} Stop the given build
+    """
+    url = '{}/{}/build/{}'.format(HOST_ROOT, repo_name, build_id)
+    if dry_run:
+        LOG.info('We would make a DELETE request to %s.' % url)
+        return None
+
+    LOG.info("We're going to stop the build at %s" % url)
+    return requests.delete(url, auth=get_credentials())
+
+
+def cancel_jobs(repo_name, jobs, dry_run=True, max_workers=MAX_WORKERS, rate_limiter=None):
+    """
+    Cancel several jobs of a repository concurrently.
+
+    jobs are jobs of query_jobs_schedule; the builds which have started are stopped
+    and the requests of the other jobs are cancelled. The requests are rate limited
+    like in trigger_arbitrary_jobs.
+
+    We return a list with the request made for every job (None if dry_run is True)
+    or the exception we got while making it.
+    """
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(TRIGGER_RATE, TRIGGER_BURST)
+
+    if not dry_run:
+        # Ask for the credentials (if needed) only once and before using threads
+        get_credentials()
+
+    def _cancel(job):
+        rate_limiter.acquire()
+        try:
+            if "build_id" in job:
+                return make_stop_build_request(repo_name, job["build_id"], dry_run)
+            return make_cancel_request(repo_name, job["requests"][0]["request_id"], dry_run)
+        except Exception, e:
+            LOG.debug("We failed to cancel '%s': %s" % (job["buildername"], e))
+            return e
+
+    LOG.debug("About to cancel %d job(s)" % len(jobs))
+    return parallel_map(_cancel, jobs, max_workers=max_workers)
+
+
 def _builders_api_url(repo_name, builder, revision):
     return r'''%s/%s/builders/%s/%s''' % (
         HOST_ROOT,
@@ -171,22 +266,138 @@ def valid_credentials():
 #
 # Functions to query
 #
-def query_jobs_schedule(repo_name, revision):
-    """ Query Buildapi for jobs """
+def query_jobs_schedule(repo_name, revision, session=None, validators=None):
+    """
+    Query Buildapi for jobs.
+
+    If a requests session is given, it is used to make the request.
+
+    If a dictionary of validators is given (the "etag" and "last-modified" of a
+    previous response) we make a conditional request and return None if the jobs
+    have not changed since. The dictionary is updated with the new validators.
+    """
     repo_url = query_repo_url(repo_name)
     if not pushlog.valid_revision(repo_url, revision):
         raise BuildapiException
 
     url = "%s/%s/rev/%s?format=json" % (HOST_ROOT, repo_name, revision)
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url, auth=get_credentials())
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last-modified"):
+            headers["If-Modified-Since"] = validators["last-modified"]
+
+    key = (url, tuple(sorted(headers.items())))
+    status_code, response_validators, jobs = IN_FLIGHT.do(
+        key, _fetch_jobs_schedule, url, headers, session)
+
+    if status_code == 304 and headers:
+        return None
 
     # If the revision doesn't exist on buildapi, that means there are
     # no builapi jobs for this revision
-    if req.status_code not in [200]:
+    if status_code not in [200]:
         return []
 
-    return req.json()
+    if validators is not None:
+        validators.clear()
+        validators.update(response_validators)
+
+    return jobs
+
+
+def _fetch_jobs_schedule(url, headers, session=None):
+    """Return the status code, the validators and the jobs (if any) of a buildapi url."""
+    LOG.debug("About to fetch %s" % url)
+    req = (session or get_session()).get(url, auth=get_credentials(), headers=headers)
+    if req.status_code != 200:
+        return req.status_code, {}, None
+
+    validators = {}
+    for header in ("etag", "last-modified"):
+        value = req.headers.get(header)
+        if value:
+            validators[header] = value
+    return req.status_code, validators, req.json()
+
+
+def query_jobs_schedules(repo_name, revisions, max_workers=MAX_WORKERS, validators=None):
+    """
+    Query Buildapi for the jobs of several revisions concurrently.
+
+    All requests share the connections of the session of the sources (see get_session).
+    validators can map revisions to the validators passed to query_jobs_schedule.
+
+    Returns a dictionary mapping every valid revision to its jobs (or to None if
+    its jobs have not changed according to its validators).
+    """
+    validators = validators or {}
+
+    def _query(revision):
+        try:
+            return True, query_jobs_schedule(repo_name, revision,
+                                             validators=validators.get(revision))
+        except BuildapiException:
+            LOG.debug("We can't query the jobs of %s since it is not a valid revision." %
+                      revision)
+            return False, None
+
+    revisions = list(revisions)
+    LOG.debug("About to fetch the jobs of %d revision(s) of %s" % (len(revisions), repo_name))
+    # Ask for the credentials (if needed) only once and before using threads
+    get_credentials()
+    results = parallel_map(_query, revisions, max_workers=max_workers)
+    return dict((revision, jobs) for revision, (valid, jobs) in zip(revisions, results)
+                if valid)
+
+
+def _jobs_schedule_path(repo_name, revision):
+    return os.path.join(JOBS_SCHEDULES_DIR, repo_name, "%s.json.gz" % revision)
+
+
+def load_completed_jobs_schedule(repo_name, revision):
+    """Return the jobs stored by save_completed_jobs_schedule or None if there are none."""
+    filepath = _jobs_schedule_path(repo_name, revision)
+    if not os.path.exists(filepath):
+        return None
+
+    LOG.debug("Loading the jobs of %s from %s" % (revision, filepath))
+    try:
+        with gzip.open(filepath, "rb") as fd:
+            return json.load(fd)
+    except (IOError, ValueError):
+        LOG.debug("%s is corrupted; we will fetch the jobs again." % filepath)
+        os.remove(filepath)
+        return None
+
+
+def save_completed_jobs_schedule(repo_name, revision, jobs):
+    """Store on disk the jobs of a revision whose jobs have all completed."""
+    filepath = _jobs_schedule_path(repo_name, revision)
+    dirname = os.path.dirname(filepath)
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Another process might have created it
+            if not os.path.isdir(dirname):
+                raise
+
+    # We write to a temporary file first so other processes never read a partial file
+    fd, tmp_filepath = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    with os.fdopen(fd, "wb") as tmp_fd:
+        gzipper = gzip.GzipFile(fileobj=tmp_fd, mode="wb")
+        json.dump(jobs, gzipper)
+        gzipper.close()
+    os.rename(tmp_filepath, filepath)
+
+
+def remove_completed_jobs_schedule(repo_name, revision):
+    """Remove from disk the jobs of a revision (e.g. because we scheduled more jobs)."""
+    filepath = _jobs_schedule_path(repo_name, revision)
+    if os.path.exists(filepath):
+        os.remove(filepath)
 
 
 def query_jobs_url(repo_name, revision):
@@ -5,6 +5,7 @@ systems: http://builddata.pub.build.mozilla.org/builddata/buildjson
 """
 import logging
 import os
+import threading
 
 from mozci.utils.tzone import utc_dt, utc_time, utc_day
 from mozci.utils.transfer import load_file, path_to_file
@@ -17,6 +18,13 @@ BUILDS_DAY_FILE = "builds-%s.js"
 
 # This helps us read into memory and load less from disk
 BUILDS_CACHE = {}
+# The jobs of every file in BUILDS_CACHE keyed by request_id, e.g.
+# {"builds-4hr.js": (jobs, {71123549: job})}. Every entry keeps the list of jobs it
+# was computed from so we can tell when it is outdated.
+BUILDS_INDEX = {}
+# Concurrent lookups load, reload and index every file one at a time
+FILE_LOCKS = {}
+_FILE_LOCKS_LOCK = threading.Lock()
 
 
 class BuildjsonException(Exception):
@@ -47,22 +55,45 @@ def _fetch_data(filename):
     return json_contents["builds"]
 
 
-def _find_job(request_id, jobs, loaded_from):
-    """
-    Look for request_id in a list of jobs.
+def _index_jobs(jobs, loaded_from):
+    """Return a dictionary mapping the request_ids of the jobs of a file to the jobs."""
+    entry = BUILDS_INDEX.get(loaded_from)
+    if entry is None or entry[0] is not jobs:
+        index = {}
+        for job in jobs:
+            # XXX: Issue 104 - We have an unclear source of request ids
+            prop_req_ids = job["properties"].get("request_ids", [])
+            root_req_ids = job["request_ids"]
+            for request_id in set(prop_req_ids + root_req_ids):
+                index.setdefault(request_id, job)
+        entry = (jobs, index)
+        BUILDS_INDEX[loaded_from] = entry
+
+    return entry[1]
 
-    loaded_from is simply to indicate where those jobs were loaded from.
-    """
-    LOG.debug("We are going to look for %s in %s." % (request_id, loaded_from))
 
-    for job in jobs:
-        # XXX: Issue 104 - We have an unclear source of request ids
-        prop_req_ids = job["properties"].get("request_ids", [])
-        root_req_ids = job["request_ids"]
-        if request_id in list(set(prop_req_ids + root_req_ids)):
-            return job
+def _file_lock(filename):
+    """Return the lock serializing the loading and indexing of a buildjson file."""
+    with _FILE_LOCKS_LOCK:
+        return FILE_LOCKS.setdefault(filename, threading.Lock())
 
-    return None
+
+def _buildjson_filename(complete_at):
+    """Return the buildjson file which contains the jobs completed at 'complete_at'."""
+    date = utc_day(complete_at)
+    LOG.debug("Job identified with complete_at value: %d run on %s UTC." % (complete_at, date))
+
+    then = utc_dt(complete_at)
+    hours_ago = (utc_dt() - then).total_seconds() / (60 * 60)
+    LOG.debug("The job completed at %s (%d hours ago)." % (utc_time(complete_at), hours_ago))
+
+    # If it has finished in the last 4 hours
+    if hours_ago < 4:
+        # We might be able to grab information about pending and running jobs
+        # from builds-running.js and builds-pending.js
+        return BUILDS_4HR_FILE
+    else:
+        return BUILDS_DAY_FILE % date
 
 
 def query_job_data(complete_at, request_id):
@@ -125,40 +156,44 @@ def query_job_data(complete_at, request_id):
     This means that since 4pm to midnight we generate the same file again and again
     without adding any new data.
     """
-    global BUILDS_CACHE
+    return query_jobs_data([(complete_at, request_id)])[request_id]
 
-    assert type(request_id) is int
-    assert type(complete_at) is int
 
-    date = utc_day(complete_at)
-    LOG.debug("Job identified with complete_at value: %d run on %s UTC." % (complete_at, date))
-
-    then = utc_dt(complete_at)
-    hours_ago = (utc_dt() - then).total_seconds() / (60 * 60)
-    LOG.debug("The job completed at %s (%d hours ago)." % (utc_time(complete_at), hours_ago))
-
-    # If it has finished in the last 4 hours
-    if hours_ago < 4:
-        # We might be able to grab information about pending and running jobs
-        # from builds-running.js and builds-pending.js
-        filename = BUILDS_4HR_FILE
-    else:
-        filename = BUILDS_DAY_FILE % date
-    job = _find_job(request_id, _fetch_data(filename), filename)
-
-    if job:
-        return job
-
-    # If we have not found the job, it might be that our cache for this
-    # file is old. We will clean the cache and try one more time. If
-    # it fails, we will raise an Exception
-    LOG.debug("We did not find %d in %s, we'll clear our cache and try again."
-              % (request_id, filename))
-    del BUILDS_CACHE[filename]
+def query_jobs_data(requests):
+    """
+    Look for several jobs at once; 'requests' is a list of (complete_at, request_id).
 
-    job = _find_job(request_id, _fetch_data(filename), filename)
-    if job:
-        return job
+    Returns a dictionary mapping every request_id to the same value as query_job_data.
+    The requests are grouped by buildjson file so every file is loaded and indexed once.
+    """
+    global BUILDS_CACHE
 
-    LOG.info("We have not found the job with request_id %s in %s" % (request_id, filename))
-    return None
+    request_ids_by_filename = {}
+    for complete_at, request_id in requests:
+        assert type(request_id) is int
+        assert type(complete_at) is int
+        filename = _buildjson_filename(complete_at)
+        request_ids_by_filename.setdefault(filename, set()).add(request_id)
+
+    found = {}
+    for filename, request_ids in sorted(request_ids_by_filename.iteritems()):
+        with _file_lock(filename):
+            index = _index_jobs(_fetch_data(filename), filename)
+            missing = [request_id for request_id in request_ids if request_id not in index]
+
+            if missing:
+                # If we have not found some jobs, it might be that our cache for this
+                # file is old. We will clean the cache and try one more time.
+                LOG.debug("We did not find %d job(s) in %s, we'll clear our cache and try "
+                          "again." % (len(missing), filename))
+                BUILDS_CACHE.pop(filename, None)
+                index = _index_jobs(_fetch_data(filename), filename)
+
+        for request_id in request_ids:
+            job = index.get(request_id)
+            if job is None:
+                LOG.info("We have not found the job with request_id %s in %s" %
+                         (request_id, filename))
+            found[request_id] = job
+
+    return found
@@ -17,14 +17,243 @@ Important notes from the pushlog documentation::
     * Always use the latest format version.
     * Don't be afraid to ask for a new pushlog feature to make your life easier.
 """
+import json
 import logging
+import os
+import tempfile
+import threading
+import time
 
-import requests
+from ijson.common import ObjectBuilder
 
+from mozci.sources import pushlog_mirror
+from mozci.utils.concurrency import MAX_WORKERS, SingleFlight, parallel_imap, parallel_map
+from mozci.utils.transfer import ResponseReader, get_session, path_to_file
+
+# yajl2 backend is faster then the default backend, but it requires
+# libyajl2 to be installed in the system
+try:
+    import ijson.backends.yajl2 as ijson
+except ImportError:
+    import ijson
 
 LOG = logging.getLogger('mozci')
 JSON_PUSHES = "%(repo_url)s/json-pushes"
 VALID_CACHE = {}
+# Pushes never change once pushed so we keep what we learn about them on disk.
+# For every repo_url we have:
+#   "pushes": push id to {"changesets": [tip], "date": ..., "user": ...}
+#   "revisions": 12 char revision to [the full revision (if we know it), push id]
+#   "invalid": revision to the time we found it was not valid
+PUSH_INFO = None
+PUSH_INFO_FILE = path_to_file("push_info.json")
+# Seconds during which a revision which was not valid is not asked again
+INVALID_TTL = 10 * 60
+# Pushes kept per repository; the oldest ones (and their revisions) are forgotten first
+PUSH_INFO_MAX_PUSHES = 5000
+_PUSH_INFO_LOCK = threading.RLock()
+# Whether PUSH_INFO has changed since we last stored it
+_PUSH_INFO_DIRTY = False
+# Number of pushes fetched per request by iter_pushes
+PUSHES_CHUNK = 500
+# Number of pushes fetched on each side of a revision by valid_revisions
+VALIDATION_WINDOW = 50
+# Answer from a local mirror of the pushlog when possible (see pushlog_mirror)
+USE_MIRROR = False
+# Identical requests made at the same time share one request and its json
+IN_FLIGHT = SingleFlight()
+
+
+def _get_json(url):
+    """
+    Return the json of a json-pushes url.
+
+    The result can be shared with other callers so it must not be modified.
+    """
+    return IN_FLIGHT.do(url, lambda: get_session().get(url).json())
+
+
+def _read_push_info_file():
+    """Return what PUSH_INFO_FILE holds or an empty dictionary."""
+    if os.path.exists(PUSH_INFO_FILE):
+        try:
+            with open(PUSH_INFO_FILE) as fd:
+                return json.load(fd)
+        except ValueError:
+            LOG.debug("%s is corrupted; we will fetch its data again." % PUSH_INFO_FILE)
+    return {}
+
+
+def _load_push_info(repo_url):
+    """Return the PUSH_INFO of a repository after loading PUSH_INFO from disk if needed."""
+    global PUSH_INFO
+    with _PUSH_INFO_LOCK:
+        if PUSH_INFO is None:
+            PUSH_INFO = _read_push_info_file()
+        return PUSH_INFO.setdefault(repo_url, {"pushes": {}, "revisions": {}, "invalid": {}})
+
+
+def _merge_push_info(push_info, other):
+    """Add to 'push_info' what 'other' (e.g. what another process stored) knows."""
+    for repo_url, other_info in other.iteritems():
+        info = push_info.setdefault(repo_url, {"pushes": {}, "revisions": {}, "invalid": {}})
+        for push_id, push in other_info["pushes"].iteritems():
+            info["pushes"].setdefault(push_id, push)
+        for revision, (node, push_id) in other_info["revisions"].iteritems():
+            if info["revisions"].get(revision, [None])[0] is None:
+                info["revisions"][revision] = [node, push_id]
+        for revision, invalid_since in other_info["invalid"].iteritems():
+            if revision[:12] not in info["revisions"]:
+                info["invalid"][revision] = max(invalid_since,
+                                                info["invalid"].get(revision, 0))
+
+
+def _evict_push_info(info):
+    """Forget the expired invalid revisions and the pushes beyond PUSH_INFO_MAX_PUSHES."""
+    now = time.time()
+    for revision, invalid_since in info["invalid"].items():
+        if now - invalid_since >= INVALID_TTL:
+            del info["invalid"][revision]
+
+    if len(info["pushes"]) > PUSH_INFO_MAX_PUSHES:
+        kept = set(sorted(info["pushes"].keys(), key=int)[-PUSH_INFO_MAX_PUSHES:])
+        for push_id in info["pushes"].keys():
+            if push_id not in kept:
+                del info["pushes"][push_id]
+        for revision, (_, push_id) in info["revisions"].items():
+            if push_id not in kept:
+                del info["revisions"][revision]
+
+
+def _save_push_info():
+    """
+    Store PUSH_INFO on disk if it has changed.
+
+    What other processes have stored since we loaded the file is kept.
+    """
+    global _PUSH_INFO_DIRTY
+    with _PUSH_INFO_LOCK:
+        if PUSH_INFO is None or not _PUSH_INFO_DIRTY:
+            return
+
+        _merge_push_info(PUSH_INFO, _read_push_info_file())
+        for info in PUSH_INFO.itervalues():
+            _evict_push_info(info)
+        # We write to a temporary file first so other processes never read a partial file
+        fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(PUSH_INFO_FILE), suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_fd:
+            json.dump(PUSH_INFO, tmp_fd)
+        os.rename(tmp_filepath, PUSH_INFO_FILE)
+        _PUSH_INFO_DIRTY = False
+
+
+def _cached_push_id(repo_url, revision):
+    """
+    Return the push id of 'revision' if we know it.
+
+    We return False if the revision was recently not valid and None if we do not know.
+    """
+    push_info = _load_push_info(repo_url)
+    with _PUSH_INFO_LOCK:
+        invalid_since = push_info["invalid"].get(revision)
+        if invalid_since is not None and time.time() - invalid_since < INVALID_TTL:
+            return False
+        if len(revision) < 12 or revision[:12] not in push_info["revisions"]:
+            return None
+
+        node, push_id = push_info["revisions"][revision[:12]]
+        if node is not None and not node.startswith(revision):
+            return None
+        return int(push_id)
+
+
+def _remember_pushes(repo_url, pushes, revisions=()):
+    """
+    Remember the pushes of a json-pushes response and the revisions found in them.
+
+    The changesets of the pushes are indexed too; the ones given in 'revisions' are
+    the revisions asked for (needed when only the tip of a push was requested).
+    """
+    global _PUSH_INFO_DIRTY
+    push_info = _load_push_info(repo_url)
+    with _PUSH_INFO_LOCK:
+        _PUSH_INFO_DIRTY = True
+        for push_id, push in pushes.iteritems():
+            changesets = push["changesets"]
+            push_info["pushes"][push_id] = {
+                "changesets": changesets[-1:],
+                "date": push["date"],
+                "user": push["user"],
+            }
+            for node in changesets:
+                push_info["revisions"][node[:12]] = [node, push_id]
+            for revision in revisions:
+                if revision[:12] not in push_info["revisions"]:
+                    push_info["revisions"][revision[:12]] = [None, push_id]
+                push_info["invalid"].pop(revision, None)
+
+
+def _remember_invalid(repo_url, revision):
+    global _PUSH_INFO_DIRTY
+    push_info = _load_push_info(repo_url)
+    with _PUSH_INFO_LOCK:
+        _PUSH_INFO_DIRTY = True
+        push_info["invalid"][revision] = time.time()
+
+
+def iter_pushes(repo_url, start_id, end_id, newest_first=False, tipsonly=True,
+                chunk_size=None, max_workers=MAX_WORKERS):
+    """
+    Yield (push_id, push) for every push from start_id to end_id (both included).
+
+    The range is fetched in windows of chunk_size (PUSHES_CHUNK by default) pushes; up to
+    max_workers windows are fetched ahead of the caller and yielded in order as soon as
+    they (and the ones before them) arrive. If the caller stops early the windows not
+    requested yet never are. Every push looks like {"changesets": [...], "date": ..., ...}.
+    """
+    chunk_size = chunk_size or PUSHES_CHUNK
+    windows = [(low, min(low + chunk_size - 1, end_id))
+               for low in range(start_id, end_id + 1, chunk_size)]
+    if newest_first:
+        windows.reverse()
+
+    def _fetch(window):
+        url = "%s?startID=%s&endID=%s&version=2" % (
+            JSON_PUSHES % {"repo_url": repo_url},
+            window[0] - 1,  # off by one to compensate for pushlog as it skips start_id
+            window[1]
+        )
+        if tipsonly:
+            url += "&tipsonly=1"
+        LOG.debug("About to fetch %s" % url)
+        return _get_json(url)["pushes"]
+
+    for pushes in parallel_imap(_fetch, windows, max_workers=max_workers):
+        # Querying by push ID is preferred because date ordering is
+        # not guaranteed (due to system clock skew)
+        for push_id in sorted(map(int, pushes.keys()), reverse=newest_first):
+            yield push_id, pushes[str(push_id)]
+
+
+def iter_pushid_range(repo_url, start_id, end_id):
+    """Generator version of query_pushid_range (newest push id first)."""
+    for _, push in iter_pushes(repo_url, start_id, end_id, newest_first=True):
+        # We can interact with self-serve with the 12 char representation
+        yield push["changesets"][-1][0:12]
+
+
+def iter_revisions_range(repo_url, from_revision, to_revision):
+    """Generator version of query_revisions_range (oldest first)."""
+    from_id, to_id = parallel_map(lambda revision: _query_push_id(repo_url, revision),
+                                  [from_revision, to_revision])
+    if from_id is None or to_id is None:
+        raise Exception("Revision %s not found on %s" %
+                        (to_revision if from_id else from_revision, repo_url))
+
+    # json-pushes does not include the starting revision
+    yield from_revision
+    for _, push in iter_pushes(repo_url, from_id + 1, to_id):
+        yield push["changesets"][-1][0:12]
 
 
 def query_revisions_range(repo_url, from_revision, to_revision, version=2, tipsonly=1):
@@ -36,6 +265,15 @@ def query_revisions_range(repo_url, from_revision, to_revision, version=2, tipso
     to_revision   - from which revision to end with (newest)
     version        - version of json-pushes to use (see docs)
     """
+    if USE_MIRROR and tipsonly == 1:
+        revisions = pushlog_mirror.query_revisions_range(repo_url, from_revision, to_revision)
+        if revisions is not None:
+            return revisions
+
+    if tipsonly == 1:
+        # Large ranges are fetched in chunks (see iter_pushes)
+        return list(iter_revisions_range(repo_url, from_revision, to_revision))
+
     revisions = []
     url = "%s?fromchange=%s&tochange=%s&version=%d&tipsonly=%d" % (
         JSON_PUSHES % {"repo_url": repo_url},
@@ -45,15 +283,11 @@ def query_revisions_range(repo_url, from_revision, to_revision, version=2, tipso
         tipsonly
     )
     LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    pushes = req.json()["pushes"]
+    pushes = _get_json(url)["pushes"]
     # json-pushes does not include the starting revision
     revisions.append(from_revision)
-    for push_id in sorted(pushes.keys()):
-        # Querying by push ID is preferred because date ordering is
-        # not guaranteed (due to system clock skew)
-        # We can interact with self-serve with the 12 char representation
-        revisions.append(pushes[push_id]["changesets"][-1][0:12])
+    for push_id in sorted(map(int, pushes.keys())):
+        revisions.append(pushes[str(push_id)]["changesets"][-1][0:12])
 
     return revisions
 
@@ -66,26 +300,15 @@ def query_pushid_range(repo_url, start_id, end_id, version=2):
     start_id - from which pushid to start with (oldest)
     end_id   - from which pushid to end with (most recent)
     version  - version of json-pushes to use (see docs)
+
+    Large ranges are fetched in chunks (see iter_pushes).
     """
-    revisions = []
-    url = "%s?startID=%s&endID=%s&version=%s&tipsonly=1" % (
-        JSON_PUSHES % {"repo_url": repo_url},
-        start_id - 1,  # off by one to compensate for pushlog as it skips start_id
-        end_id,
-        version
-    )
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    pushes = req.json()["pushes"]
-    # pushes.keys() is a list of strings which we need to map to integers
-    # We use reverse in order to return list sorted from newest to oldest push id
-    for push_id in sorted(map(int, pushes.keys()), reverse=True):
-        # Querying by push ID is preferred because date ordering is
-        # not guaranteed (due to system clock skew)
-        # We can interact with self-serve with the 12 char representation
-        revisions.append(pushes[str(push_id)]["changesets"][0][0:12])
+    if USE_MIRROR:
+        revisions = pushlog_mirror.query_pushid_range(repo_url, start_id, end_id)
+        if revisions is not None:
+            return revisions
 
-    return revisions
+    return list(iter_pushid_range(repo_url, start_id, end_id))
 
 
 def query_revisions_range_from_revision_before_and_after(repo_url, revision, before, after):
@@ -110,17 +333,34 @@ def query_revision_info(repo_url, revision, full=False):
         * changesets
         * date
         * user
+
+    With full=True the whole response is loaded in memory; iter_revision_changesets
+    streams it instead.
     """
+    if USE_MIRROR and not full:
+        push_info = pushlog_mirror.query_revision_info(repo_url, revision)
+        if push_info is not None:
+            return push_info
+
+    if not full:
+        push_id = _cached_push_id(repo_url, revision)
+        if push_id:
+            push_info = _load_push_info(repo_url)["pushes"][str(push_id)]
+            return dict(push_info, pushid=str(push_id))
+
     url = "%s?changeset=%s&tipsonly=1" % (JSON_PUSHES % {"repo_url": repo_url}, revision)
     if full:
         url += "&full=1"
     LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    data = req.json()
+    data = _get_json(url)
     assert len(data) == 1, "We should only have information about one push"
-    push_id, push_info = data.popitem()
-    push_info["pushid"] = push_id
+    push_id, push_info = data.items()[0]
+    push_info = dict(push_info, pushid=push_id)
     if not full:
+        # valid_revision() requests the same url
+        VALID_CACHE[(repo_url, revision)] = True
+        _remember_pushes(repo_url, data, [revision])
+        _save_push_info()
         LOG.debug("Push info: %s" % str(push_info))
     else:
         LOG.debug("Requesting the info with full=1 can yield too much unnecessary output "
@@ -128,14 +368,87 @@ def query_revision_info(repo_url, revision, full=False):
     return push_info
 
 
+def iter_revision_changesets(repo_url, revision):
+    """
+    Yield the changesets of the push of a revision as json-pushes returns them with full=1.
+
+    Every changeset looks like {"node": ..., "author": ..., "desc": ..., "files": [...], ...}.
+    The response is parsed as it arrives so we never hold all of it in memory (the
+    pushes of merges can list tens of thousands of files).
+    """
+    url = "%s?changeset=%s&full=1&version=2" % (JSON_PUSHES % {"repo_url": repo_url}, revision)
+    LOG.debug("About to stream %s" % url)
+    req = get_session().get(url, stream=True)
+    try:
+        req.raise_for_status()
+        events = ijson.parse(ResponseReader(req))
+        first = next(events, (None, None, None))
+        assert first[1] == "start_map", "We should get an object from %s" % url
+        builder = None
+        for prefix, event, value in events:
+            # The changesets are at pushes.<push id>.changesets.item
+            if builder is None:
+                if event == "start_map" and prefix.startswith("pushes.") and \
+                        prefix.endswith(".changesets.item") and prefix.count(".") == 3:
+                    builder, item_prefix = ObjectBuilder(), prefix
+                    builder.event(event, value)
+                continue
+
+            builder.event(event, value)
+            if event == "end_map" and prefix == item_prefix:
+                yield builder.value
+                builder = None
+    finally:
+        req.close()
+
+
+def iter_revision_files(repo_url, revision):
+    """Yield once every file touched by the push of a revision (see iter_revision_changesets)."""
+    seen = set()
+    for changeset in iter_revision_changesets(repo_url, revision):
+        for filename in changeset.get("files", []):
+            if filename not in seen:
+                seen.add(filename)
+                yield filename
+
+
 def query_repo_tip(repo_url):
     """Return the tip of a branch."""
+    if USE_MIRROR:
+        tip = pushlog_mirror.query_repo_tip(repo_url)
+        if tip is not None:
+            return tip
+
     url = "%s?tipsonly=1" % (JSON_PUSHES % {"repo_url": repo_url})
-    recent_commits = requests.get(url).json()
-    tip_id = sorted(map(int, recent_commits.keys()))[-1]
+    recent_commits = _get_json(url)
+    tip_id = max(map(int, recent_commits.keys()))
     return recent_commits[str(tip_id)]["changesets"][0][:12]
 
 
+def _query_push_id(repo_url, revision, save=True):
+    """Return the push id of 'revision' (None if it is not valid) and fill VALID_CACHE."""
+    push_id = _cached_push_id(repo_url, revision)
+    if push_id is not None:
+        VALID_CACHE[(repo_url, revision)] = push_id is not False
+        return push_id or None
+
+    url = "%s?changeset=%s&tipsonly=1" % (JSON_PUSHES % {"repo_url": repo_url}, revision)
+    data = _get_json(url)
+
+    # A valid revision will return a dictionary with information about exactly one revision
+    if len(data) != 1:
+        LOG.warning("Revision %s not found on branch %s" % (revision, repo_url))
+        _remember_invalid(repo_url, revision)
+    else:
+        push_id = int(data.keys()[0])
+        _remember_pushes(repo_url, data, [revision])
+
+    if save:
+        _save_push_info()
+    VALID_CACHE[(repo_url, revision)] = push_id is not None
+    return push_id
+
+
 def valid_revision(repo_url, revision):
     """Verify that a revision exists in a given branch."""
 
@@ -143,15 +456,65 @@ def valid_revision(repo_url, revision):
     if (repo_url, revision) in VALID_CACHE:
         return VALID_CACHE[(repo_url, revision)]
 
+    if USE_MIRROR and pushlog_mirror.valid_revision(repo_url, revision):
+        VALID_CACHE[(repo_url, revision)] = True
+        return True
+
     LOG.debug("Determine if the revision is valid.")
-    url = "%s?changeset=%s&tipsonly=1" % (JSON_PUSHES % {"repo_url": repo_url}, revision)
-    data = requests.get(url).json()
-    ret = True
+    return _query_push_id(repo_url, revision) is not None
 
-    # A valid revision will return a dictionary with information about exactly one revision
-    if len(data) != 1:
-        LOG.warning("Revision %s not found on branch %s" % (revision, repo_url))
-        ret = False
 
-    VALID_CACHE[(repo_url, revision)] = ret
-    return ret
+def valid_revisions(repo_url, revisions):
+    """
+    Verify that several revisions exist in a given branch.
+
+    We look up the push of one revision and fetch the tips of the pushes around it
+    (VALIDATION_WINDOW on each side); every revision found in there is valid. We repeat
+    it with the revisions left, so a range of pushes only takes two requests. If a
+    window has none of the revisions left (they are not tips) we look them up one by one.
+
+    Returns a dictionary mapping every revision to True or False.
+    """
+    pending = [revision for revision in revisions if (repo_url, revision) not in VALID_CACHE]
+    if USE_MIRROR:
+        for revision in pending:
+            valid_revision(repo_url, revision)
+        pending = []
+
+    for revision in pending:
+        push_id = _cached_push_id(repo_url, revision)
+        if push_id is not None:
+            VALID_CACHE[(repo_url, revision)] = push_id is not False
+    pending = [revision for revision in pending if (repo_url, revision) not in VALID_CACHE]
+    fetched = bool(pending)
+
+    use_windows = True
+    while pending:
+        push_id = _query_push_id(repo_url, pending[0], save=False)
+        pending = pending[1:]
+        if push_id is None or not pending or not use_windows:
+            continue
+
+        url = "%s?version=2&tipsonly=1&startID=%d&endID=%d" % (
+            JSON_PUSHES % {"repo_url": repo_url},
+            max(0, push_id - VALIDATION_WINDOW - 1),
+            push_id + VALIDATION_WINDOW
+        )
+        LOG.debug("About to fetch %s" % url)
+        pushes = _get_json(url)["pushes"]
+        _remember_pushes(repo_url, pushes)
+        nodes = [node for push in pushes.itervalues() for node in push["changesets"]]
+        prefixes = {}
+        for revision in pending:
+            length = len(revision)
+            if length not in prefixes:
+                prefixes[length] = set(node[:length] for node in nodes)
+            if revision in prefixes[length]:
+                VALID_CACHE[(repo_url, revision)] = True
+        left = [revision for revision in pending if (repo_url, revision) not in VALID_CACHE]
+        use_windows = len(left) < len(pending)
+        pending = left
+
+    if fetched:
+        _save_push_info()
+    return dict((revision, VALID_CACHE[(repo_url, revision)]) for revision in revisions)
@@ -0,0 +1,198 @@
+"""
+This module keeps a local mirror of the pushlog of the repositories we query.
+
+The pushes are stored in a SQLite database and we only fetch the pushes newer than
+the last one we have (startID=<last push id>). The first sync of a repository only
+fetches its latest MIRROR_HISTORY pushes.
+
+mozci.sources.pushlog answers from the mirror when pushlog.USE_MIRROR is True:
+
+.. code-block:: python
+
+    from mozci.sources import pushlog
+
+    pushlog.USE_MIRROR = True
+    # Only the pushes since the last sync are fetched
+    pushlog.query_pushid_range(repo_url, start_id, end_id)
+
+Every function in here returns None when the mirror cannot answer; the caller
+should then ask json-pushes.
+"""
+from __future__ import absolute_import
+
+import logging
+import sqlite3
+import threading
+import time
+
+from contextlib import closing
+
+from mozci.utils.transfer import get_session, path_to_file
+
+LOG = logging.getLogger('mozci')
+JSON_PUSHES = "%(repo_url)s/json-pushes"
+MIRROR_FILE = path_to_file("pushlog_mirror.sqlite")
+# Number of pushes fetched the first time we mirror a repository
+MIRROR_HISTORY = 10000
+# Number of pushes fetched per request
+SYNC_CHUNK = 1000
+# Lookups which miss only trigger a sync if the last one is older than this (seconds)
+SYNC_INTERVAL = 60
+# Seconds to wait for another process to release the database
+LOCK_TIMEOUT = 30
+_SYNC_LOCK = threading.Lock()
+
+
+def _connect():
+    """Return a connection to the mirror (in autocommit mode) creating it if needed."""
+    conn = sqlite3.connect(MIRROR_FILE, timeout=LOCK_TIMEOUT, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS pushes (repo_url TEXT, push_id INTEGER, "
+                 "date INTEGER, user TEXT, tip TEXT, PRIMARY KEY (repo_url, push_id))")
+    conn.execute("CREATE TABLE IF NOT EXISTS changesets (repo_url TEXT, node TEXT, "
+                 "push_id INTEGER, PRIMARY KEY (repo_url, node))")
+    conn.execute("CREATE TABLE IF NOT EXISTS syncs (repo_url TEXT PRIMARY KEY, "
+                 "first_push_id INTEGER, last_push_id INTEGER, synced_at REAL)")
+    return conn
+
+
+def _sync_state(conn, repo_url):
+    """Return (first_push_id, last_push_id, synced_at) of a repository or None."""
+    return conn.execute("SELECT first_push_id, last_push_id, synced_at FROM syncs "
+                        "WHERE repo_url = ?", (repo_url,)).fetchone()
+
+
+def _fetch(repo_url, start_id, end_id=None):
+    """Return the json-pushes (version 2) data of the pushes after start_id."""
+    url = "%s?version=2&startID=%d" % (JSON_PUSHES % {"repo_url": repo_url}, start_id)
+    if end_id is not None:
+        url += "&endID=%d" % end_id
+    LOG.debug("About to fetch %s" % url)
+    return get_session().get(url).json()
+
+
+def _store(conn, repo_url, pushes):
+    conn.executemany(
+        "INSERT OR REPLACE INTO pushes VALUES (?, ?, ?, ?, ?)",
+        [(repo_url, int(push_id), push["date"], push["user"], push["changesets"][-1])
+         for push_id, push in pushes.iteritems()])
+    conn.executemany(
+        "INSERT OR REPLACE INTO changesets VALUES (?, ?, ?)",
+        [(repo_url, node, int(push_id))
+         for push_id, push in pushes.iteritems() for node in push["changesets"]])
+
+
+def sync(repo_url):
+    """Fetch the pushes of a repository newer than the ones in the mirror; return the last id."""
+    with _SYNC_LOCK, closing(_connect()) as conn:
+        state = _sync_state(conn, repo_url)
+        if state is None:
+            # Without endID we get the latest pushes and the id of the last one
+            last_push_id = _fetch(repo_url, 0, 0)["lastpushid"]
+            first_push_id = last_push_id = max(0, last_push_id - MIRROR_HISTORY)
+            first_push_id += 1
+        else:
+            first_push_id, last_push_id, _ = state
+
+        while True:
+            data = _fetch(repo_url, last_push_id, last_push_id + SYNC_CHUNK)
+            pushes = data["pushes"]
+            conn.execute("BEGIN IMMEDIATE")
+            _store(conn, repo_url, pushes)
+            if pushes:
+                last_push_id = max(last_push_id, max(map(int, pushes.keys())))
+            else:
+                last_push_id = min(last_push_id + SYNC_CHUNK, data["lastpushid"])
+            conn.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)",
+                         (repo_url, first_push_id, last_push_id, time.time()))
+            conn.execute("COMMIT")
+            if last_push_id >= data["lastpushid"]:
+                break
+
+        LOG.debug("The pushlog mirror of %s is at push %d" % (repo_url, last_push_id))
+        return last_push_id
+
+
+def _ensure_synced(conn, repo_url, force=False):
+    """Sync the repository if it was never synced (or if 'force' and it is due)."""
+    state = _sync_state(conn, repo_url)
+    if state is None or (force and time.time() - state[2] > SYNC_INTERVAL):
+        sync(repo_url)
+        state = _sync_state(conn, repo_url)
+    return state
+
+
+def _find_push(conn, repo_url, revision):
+    """Return the (push_id, date, user, tip) of the push containing 'revision' or None."""
+    # Revisions are hexadecimal; this range matches every node starting with 'revision'
+    return conn.execute(
+        "SELECT pushes.push_id, date, user, tip FROM changesets JOIN pushes "
+        "ON pushes.repo_url = changesets.repo_url AND pushes.push_id = changesets.push_id "
+        "WHERE changesets.repo_url = ? AND node >= ? AND node < ? LIMIT 1",
+        (repo_url, revision, revision + "g")).fetchone()
+
+
+def _lookup(conn, repo_url, revision):
+    """Return the push containing 'revision', syncing once if we do not know it."""
+    _ensure_synced(conn, repo_url)
+    push = _find_push(conn, repo_url, revision)
+    if push is None:
+        # It could have been pushed since the last sync
+        _ensure_synced(conn, repo_url, force=True)
+        push = _find_push(conn, repo_url, revision)
+    return push
+
+
+def query_revision_info(repo_url, revision):
+    """Return what pushlog.query_revision_info returns (without full=1) or None."""
+    with closing(_connect()) as conn:
+        push = _lookup(conn, repo_url, revision)
+    if push is None:
+        return None
+
+    push_id, date, user, tip = push
+    return {"changesets": [tip], "date": date, "user": user, "pushid": str(push_id)}
+
+
+def valid_revision(repo_url, revision):
+    """Return True if the mirror knows 'revision' or None if it does not."""
+    with closing(_connect()) as conn:
+        return True if _lookup(conn, repo_url, revision) else None
+
+
+def query_pushid_range(repo_url, start_id, end_id):
+    """Return what pushlog.query_pushid_range returns or None."""
+    with closing(_connect()) as conn:
+        first_push_id, last_push_id, _ = _ensure_synced(conn, repo_url)
+        if end_id > last_push_id:
+            first_push_id, last_push_id, _ = _ensure_synced(conn, repo_url, force=True)
+        if start_id < first_push_id or end_id > last_push_id:
+            return None
+
+        rows = conn.execute("SELECT tip FROM pushes WHERE repo_url = ? AND push_id >= ? AND "
+                            "push_id <= ? ORDER BY push_id DESC",
+                            (repo_url, start_id, end_id))
+        return [row[0][:12] for row in rows]
+
+
+def query_revisions_range(repo_url, from_revision, to_revision):
+    """Return what pushlog.query_revisions_range returns (with tipsonly=1) or None."""
+    with closing(_connect()) as conn:
+        from_push = _lookup(conn, repo_url, from_revision)
+        to_push = _lookup(conn, repo_url, to_revision)
+        if from_push is None or to_push is None:
+            return None
+
+        rows = conn.execute("SELECT tip FROM pushes WHERE repo_url = ? AND push_id > ? AND "
+                            "push_id <= ? ORDER BY push_id",
+                            (repo_url, from_push[0], to_push[0]))
+        # json-pushes does not include the starting revision
+        return [from_revision] + [row[0][:12] for row in rows]
+
+
+def query_repo_tip(repo_url):
+    """Sync the repository and return its tip."""
+    last_push_id = sync(repo_url)
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT tip FROM pushes WHERE repo_url = ? AND push_id = ?",
+                           (repo_url, last_push_id)).fetchone()
+    return row[0][:12] if row else None
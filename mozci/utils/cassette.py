@@ -0,0 +1,198 @@
+"""
+This module records the http requests mozci makes and replays them offline.
+
+Every request (pushlog, buildapi, allthethings, buildjson, Treeherder and TaskCluster)
+goes through requests.Session.send, which we replace while a cassette is in use.
+
+.. code-block:: python
+
+    from mozci.utils import cassette
+
+    cassette.record("backfill.json.gz")
+    manual_backfill(revision, buildername, max_revisions=20, dry_run=True)
+    cassette.stop()
+
+    # Later and without network access; zero_latency leaves only the CPU time
+    cassette.replay("backfill.json.gz", zero_latency=True)
+    manual_backfill(revision, buildername, max_revisions=20, dry_run=True)
+    print cassette.stop().network_time
+
+Request headers are not stored so credentials never end up in a cassette; only the
+headers of conditional requests (CONDITIONAL_HEADERS) are, since the response depends
+on them. A conditional request is only answered by a response recorded with the same
+conditions, so a cache which is empty while replaying never gets a recorded 304.
+"""
+import atexit
+import base64
+import gzip
+import io
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+LOG = logging.getLogger('mozci')
+# The cassette in use (if any)
+CASSETTE = None
+_ORIGINAL_SEND = requests.Session.send
+# Request headers which are part of what identifies a request
+CONDITIONAL_HEADERS = ("If-Match", "If-Modified-Since", "If-None-Match", "If-Unmodified-Since")
+
+
+class CassetteException(requests.exceptions.ConnectionError):
+    pass
+
+
+class Cassette(object):
+    """The http exchanges of a recording and the time they took."""
+
+    def __init__(self, filepath, replaying=False, zero_latency=False):
+        self.filepath = filepath
+        self.replaying = replaying
+        self.zero_latency = zero_latency
+        self.interactions = []
+        # Number of requests made and seconds spent on them (or pretending to)
+        self.requests = 0
+        self.network_time = 0.0
+        self._replays = {}
+        self._lock = threading.Lock()
+
+        if replaying:
+            with gzip.open(filepath, "rb") as fd:
+                self.interactions = json.load(fd)
+            for interaction in self.interactions:
+                self._replays.setdefault(_key(interaction), []).append(interaction)
+
+    def send(self, session, request, **kwargs):
+        """Replacement of requests.Session.send."""
+        if self.replaying:
+            return self._replay(request)
+
+        start = time.time()
+        response = _ORIGINAL_SEND(session, request, **kwargs)
+        # Reading the content now makes streamed responses replayable; streaming
+        # consumers read it back from raw
+        content = response.content
+        response.raw = io.BytesIO(content or "")
+        elapsed = time.time() - start
+
+        with self._lock:
+            self.requests += 1
+            self.network_time += elapsed
+            self.interactions.append({
+                "method": request.method,
+                "url": request.url,
+                "body": _body(request),
+                "conditions": _conditions(request),
+                "status": response.status_code,
+                "reason": response.reason,
+                "headers": dict(response.headers),
+                "content": base64.b64encode(content or ""),
+                "elapsed": elapsed,
+            })
+        return response
+
+    def _replay(self, request):
+        key = (request.method, request.url, _body(request),
+               tuple(sorted(_conditions(request).items())))
+        with self._lock:
+            interactions = self._replays.get(key)
+            if not interactions:
+                raise CassetteException("%s %s is not in %s" %
+                                        (request.method, request.url, self.filepath))
+            # Identical requests get their responses in the order we recorded them;
+            # the last one is repeated if we are asked more times than we recorded
+            interaction = interactions.pop(0) if len(interactions) > 1 else interactions[0]
+            elapsed = 0.0 if self.zero_latency else interaction["elapsed"]
+            self.requests += 1
+            self.network_time += elapsed
+
+        if elapsed:
+            time.sleep(elapsed)
+
+        response = Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction["reason"]
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response._content = base64.b64decode(interaction["content"])
+        response._content_consumed = True
+        response.raw = io.BytesIO(response._content)
+        return response
+
+    def save(self):
+        with gzip.open(self.filepath, "wb") as fd:
+            json.dump(self.interactions, fd)
+
+
+def _body(request):
+    if request.body is None:
+        return None
+    return base64.b64encode(request.body)
+
+
+def _conditions(request):
+    """Return the conditional headers of a request."""
+    return dict((name, request.headers[name]) for name in CONDITIONAL_HEADERS
+                if name in request.headers)
+
+
+def _key(interaction):
+    # Cassettes recorded before we stored the conditions have none
+    return (interaction["method"], interaction["url"], interaction["body"],
+            tuple(sorted(interaction.get("conditions", {}).items())))
+
+
+def _start(cassette):
+    global CASSETTE
+    if CASSETTE is not None:
+        stop()
+
+    CASSETTE = cassette
+    requests.Session.send = lambda session, request, **kwargs: \
+        cassette.send(session, request, **kwargs)
+    return cassette
+
+
+def record(filepath):
+    """Record every http exchange until stop() is called and store them on 'filepath'."""
+    LOG.info("Recording the http requests to %s" % filepath)
+    return _start(Cassette(filepath))
+
+
+def replay(filepath, zero_latency=False):
+    """
+    Answer every http request with the responses recorded on 'filepath'.
+
+    The responses take as long as they originally did unless 'zero_latency' is True.
+    Requests which were not recorded raise CassetteException.
+    """
+    LOG.info("Replaying the http requests from %s" % filepath)
+    return _start(Cassette(filepath, replaying=True, zero_latency=zero_latency))
+
+
+def stop():
+    """Stop using the cassette (storing it if we were recording) and return it."""
+    global CASSETTE
+    cassette, CASSETTE = CASSETTE, None
+    if cassette is None:
+        return None
+
+    requests.Session.send = _ORIGINAL_SEND
+    if not cassette.replaying:
+        cassette.save()
+    LOG.info("%d http request(s) took %.2f seconds." %
+             (cassette.requests, cassette.network_time))
+    return cassette
+
+
+# Scripts can exit at any point; we still want to store what we recorded
+atexit.register(stop)
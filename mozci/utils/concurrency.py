@@ -0,0 +1,226 @@
+"""This module helps us run network bound work concurrently."""
+import collections
+import itertools
+import logging
+import sys
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+LOG = logging.getLogger('mozci')
+# Maximum number of requests we make at the same time to a single service
+MAX_WORKERS = 8
+# The log records held for the call (see parallel_map_with_logs) a thread works for
+_LOG_CONTEXT = threading.local()
+
+
+def _in_log_context(function):
+    """
+    Return 'function' running in the log context of the calling thread.
+
+    The calls made by pools nested in a parallel_map_with_logs call then have their
+    records held with the ones of that call.
+    """
+    records = getattr(_LOG_CONTEXT, "records", None)
+    if records is None:
+        return function
+
+    def _call(*args, **kwargs):
+        previous, _LOG_CONTEXT.records = getattr(_LOG_CONTEXT, "records", None), records
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _LOG_CONTEXT.records = previous
+
+    return _call
+
+
+def parallel_map(function, items, max_workers=MAX_WORKERS):
+    """
+    Return the list of results of calling 'function' on every item of 'items'.
+
+    The calls are distributed over a pool of at most 'max_workers' threads and
+    the results keep the order of 'items'. The first exception raised by a call
+    is raised again.
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return map(function, items)
+
+    pool = ThreadPool(min(max_workers, len(items)))
+    try:
+        return pool.map(_in_log_context(function), items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def parallel_imap(function, items, max_workers=MAX_WORKERS):
+    """
+    Generator version of parallel_map.
+
+    Every result is yielded as soon as it and the ones before it are ready. At most
+    'max_workers' calls are made ahead of the consumer so the results never pile up,
+    and the calls not started yet are dropped if the generator is closed early.
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    function = _in_log_context(function)
+    pool = ThreadPool(min(max_workers, len(items)))
+    remaining = iter(items)
+    pending = collections.deque(pool.apply_async(function, (item,))
+                                for item in itertools.islice(remaining, max_workers))
+    completed = False
+    try:
+        while pending:
+            result = pending.popleft().get()
+            # The next call runs while the consumer deals with this result
+            for item in itertools.islice(remaining, 1):
+                pending.append(pool.apply_async(function, (item,)))
+            yield result
+        completed = True
+    finally:
+        if completed:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+class _LogBuffer(logging.Filter):
+    """
+    Hold the records logged by the threads which called start() until they call stop().
+
+    The threads of the pools they use (parallel_map and parallel_imap) log into the
+    same records.
+    """
+
+    def start(self):
+        _LOG_CONTEXT.records = []
+
+    def stop(self):
+        records, _LOG_CONTEXT.records = _LOG_CONTEXT.records, None
+        return records
+
+    def filter(self, record):
+        records = getattr(_LOG_CONTEXT, "records", None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+def parallel_map_with_logs(function, items, max_workers=MAX_WORKERS, logger=LOG):
+    """
+    parallel_map for calls which log what they do.
+
+    What every call logs through 'logger' is held until the call returns and then
+    logged in the order of 'items', so the output reads as if the calls ran one
+    after the other.
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return map(function, items)
+
+    log_buffer = _LogBuffer()
+
+    def _call(item):
+        log_buffer.start()
+        try:
+            return function(item), None, log_buffer.stop()
+        except Exception:
+            return None, sys.exc_info(), log_buffer.stop()
+
+    results, errors = [], []
+    logger.addFilter(log_buffer)
+    try:
+        for result, error, records in parallel_imap(_call, items, max_workers=max_workers):
+            for record in records:
+                logger.handle(record)
+            if error is not None:
+                errors.append(error)
+            results.append(result)
+    finally:
+        logger.removeFilter(log_buffer)
+
+    if errors:
+        # The other calls have run anyway; we raise the first exception like parallel_map
+        exc_type, exc_value, exc_traceback = errors[0]
+        raise exc_type, exc_value, exc_traceback
+    return results
+
+
+class TokenBucket(object):
+    """
+    Rate limiter allowing 'rate' operations per second on average.
+
+    Up to 'capacity' operations can happen at once after a quiet period.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.timestamp = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until we are allowed to perform one more operation."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SingleFlight(object):
+    """
+    Make identical calls running at the same time share a single call.
+
+    The first caller of do() for a key runs the function; callers arriving while
+    it runs wait for it and get the same result (or exception). Nothing is kept
+    once the call returns, caching is up to the callers.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """Return function(*args, **kwargs), sharing the call with the callers of 'key'."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+
+        if not leader:
+            # Waiting without a timeout cannot be interrupted with Ctrl+C
+            while not call["done"].wait(1):
+                pass
+            if "error" in call:
+                exc_type, exc_value, exc_traceback = call["error"]
+                raise exc_type, exc_value, exc_traceback
+            return call["result"]
+
+        try:
+            call["result"] = function(*args, **kwargs)
+            return call["result"]
+        except BaseException:
+            call["error"] = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
@@ -0,0 +1,126 @@
+"""
+This module keeps a journal of the jobs we have recently requested.
+
+The journal is a SQLite database shared by every mozci process of the machine so
+two processes (or a process which restarted) do not request the same build job
+on the same revision. Entries older than JOURNAL_TTL seconds are ignored; by then
+buildapi knows about the job. Revisions are stored with 12 characters.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from contextlib import closing
+
+from mozci.utils.transfer import path_to_file
+
+LOG = logging.getLogger('mozci')
+JOURNAL_FILE = path_to_file("scheduling_journal.sqlite")
+JOURNAL_TTL = 3 * 60 * 60
+# Seconds to wait for another process to release the database
+LOCK_TIMEOUT = 30
+# Identifies the entries of this process so forget() leaves the ones of others alone
+OWNER = "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+# Journal files whose tables we have already created
+_INITIALIZED = set()
+_INITIALIZED_LOCK = threading.Lock()
+
+
+def _connect():
+    """Return a connection to the journal (in autocommit mode) creating it if needed."""
+    conn = sqlite3.connect(JOURNAL_FILE, timeout=LOCK_TIMEOUT, isolation_level=None)
+    with _INITIALIZED_LOCK:
+        if JOURNAL_FILE not in _INITIALIZED:
+            conn.execute("CREATE TABLE IF NOT EXISTS triggers "
+                         "(revision TEXT, buildername TEXT, triggered_at REAL)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(triggers)")]
+            if "owner" not in columns:
+                # Journals created before we knew who made every entry
+                conn.execute("ALTER TABLE triggers ADD COLUMN owner TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS triggers_revision "
+                         "ON triggers (revision, buildername)")
+            _INITIALIZED.add(JOURNAL_FILE)
+    return conn
+
+
+def _scheduled(conn, revision, buildernames):
+    placeholders = ",".join("?" * len(buildernames))
+    rows = conn.execute(
+        "SELECT DISTINCT buildername FROM triggers WHERE revision = ? AND "
+        "triggered_at > ? AND buildername IN (%s)" % placeholders,
+        [revision, time.time() - JOURNAL_TTL] + list(buildernames))
+    return set(row[0] for row in rows)
+
+
+def _insert(conn, revision, buildernames):
+    now = time.time()
+    conn.executemany("INSERT INTO triggers VALUES (?, ?, ?, ?)",
+                     [(revision, buildername, now, OWNER) for buildername in buildernames])
+    conn.execute("DELETE FROM triggers WHERE triggered_at <= ?", (now - JOURNAL_TTL,))
+
+
+def scheduled(revision, buildernames):
+    """Return the set of 'buildernames' requested on 'revision' within JOURNAL_TTL."""
+    buildernames = list(buildernames)
+    if not buildernames:
+        return set()
+
+    with closing(_connect()) as conn:
+        return _scheduled(conn, revision[:12], buildernames)
+
+
+def record(revision, buildernames):
+    """Record that we requested every builder of 'buildernames' on 'revision'."""
+    buildernames = list(buildernames)
+    if not buildernames:
+        return
+
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _insert(conn, revision[:12], buildernames)
+        conn.execute("COMMIT")
+
+
+def reserve(revision, buildername):
+    """
+    Record that we request 'buildername' on 'revision' unless it was already requested.
+
+    The check and the record happen under the database lock so only one process
+    can reserve a builder. Returns True if we got the reservation.
+    """
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _scheduled(conn, revision[:12], [buildername]):
+                LOG.debug("'%s' was already requested on %s." % (buildername, revision))
+                return False
+            _insert(conn, revision[:12], [buildername])
+        finally:
+            conn.execute("COMMIT")
+    return True
+
+
+def forget(revision, buildernames):
+    """
+    Remove one of our records for every builder of 'buildernames' on 'revision'.
+
+    Call it when requesting them failed; the records of other processes are kept.
+    """
+    buildernames = list(buildernames)
+    if not buildernames:
+        return
+
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for buildername in buildernames:
+            conn.execute("DELETE FROM triggers WHERE rowid IN (SELECT rowid FROM triggers "
+                         "WHERE revision = ? AND buildername = ? AND owner = ? "
+                         "ORDER BY triggered_at DESC LIMIT 1)",
+                         (revision[:12], buildername, OWNER))
+        conn.execute("COMMIT")
@@ -9,6 +9,7 @@ import os
 import platform
 import shutil
 import subprocess
+import threading
 import time
 
 import requests
@@ -24,6 +25,49 @@ except:
 
 LOG = logging.getLogger('mozci')
 MEMORY_SAVING_MODE = False
+# Connections kept open per host by the session shared by the sources
+SESSION_POOL_SIZE = 32
+SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """Return the requests session the sources share so they reuse their connections."""
+    global SESSION
+    with _SESSION_LOCK:
+        if SESSION is None:
+            SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=SESSION_POOL_SIZE,
+                                                    pool_maxsize=SESSION_POOL_SIZE)
+            SESSION.mount("https://", adapter)
+            SESSION.mount("http://", adapter)
+        return SESSION
+
+
+class ResponseReader(object):
+    """
+    File-like view of the body of a streamed response (e.g. for ijson).
+
+    It reads through iter_content() so the body is decompressed and it also works
+    with responses whose raw was already consumed (see mozci.utils.cassette).
+    """
+
+    def __init__(self, response, chunk_size=16 * 1024):
+        self._chunks = response.iter_content(chunk_size=chunk_size)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
 
 def path_to_file(filename):
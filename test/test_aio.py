@@ -0,0 +1,49 @@
+import threading
+import time
+import unittest
+
+from mock import patch
+from mozci import aio
+
+
+class TestSubmit(unittest.TestCase):
+
+    def tearDown(self):
+        aio.shutdown()
+
+    def test_async_function(self):
+        """The async functions should return an AsyncResult with the value of the call."""
+        def query_repo_tip(repo_url):
+            return "146071751b1e"
+
+        result = aio._make_async("pushlog", query_repo_tip)("https://hg.mozilla.org/try")
+        self.assertEquals(aio.wait(result), "146071751b1e")
+
+    @patch.dict('mozci.aio.LIMITS', {"test": 2})
+    def test_limits(self):
+        """We should never run more calls to a service than its limit at the same time."""
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def call(i):
+            with lock:
+                running.append(i)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(i)
+            return i
+
+        results = [aio.submit("test", call, i) for i in range(8)]
+        self.assertEquals(aio.gather(results), range(8))
+        self.assertEquals(max(peak), 2)
+
+    @patch.dict('mozci.aio.LIMITS', {"slow": 1, "fast": 1})
+    def test_services_do_not_wait_for_each_other(self):
+        """Calls queued for a busy service should not hold up the calls to the others."""
+        release = threading.Event()
+        slow = [aio.submit("slow", release.wait, 5) for _ in range(4 * aio.MAX_WORKERS)]
+        self.assertEquals(aio.wait(aio.submit("fast", lambda: 1), timeout=1), 1)
+        release.set()
+        aio.gather(slow)
@@ -205,6 +205,32 @@ class TestTriggerJob(unittest.TestCase):
             buildapi.trigger_arbitrary_job("repo", "builder", "123456123456", dry_run=False)
 
 
+class TestTriggerArbitraryJobs(unittest.TestCase):
+
+    """Test that trigger_arbitrary_jobs makes one POST request per job."""
+
+    @patch('requests.post', return_value=mock_response(POST_RESPONSE, 202))
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    def test_results(self, get_credentials, post):
+        """Every job should get its request or the exception raised while requesting it."""
+        post.side_effect = [mock_response(POST_RESPONSE, 202), ValueError("Bad json"),
+                            mock_response(POST_RESPONSE, 202)]
+        results = buildapi.trigger_arbitrary_jobs(
+            [("repo", "builder", "123456123456", None, None)] * 3, max_workers=1)
+        self.assertEquals(post.call_count, 3)
+        self.assertEquals(results[0].status_code, 202)
+        assert isinstance(results[1], ValueError)
+        self.assertEquals(results[2].status_code, 202)
+
+    @patch('requests.post', return_value=mock_response(POST_RESPONSE, 401))
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    @patch('mozci.sources.buildapi.remove_credentials', return_value=None)
+    def test_bad_credentials(self, remove_credentials, get_credentials, post):
+        """Invalid credentials should stop the whole batch."""
+        with self.assertRaises(AuthenticationError):
+            buildapi.trigger_arbitrary_jobs([("repo", "builder", "123456123456", None, None)] * 3)
+
+
 class TestMakeRetriggerRequest(unittest.TestCase):
 
     """Test that make_retrigger_request makes the right POST requests."""
@@ -254,6 +280,22 @@ class TestMakeRetriggerRequest(unittest.TestCase):
             auth=get_credentials())
 
 
+class TestCancelJobs(unittest.TestCase):
+
+    """Test that cancel_jobs makes the right DELETE requests."""
+
+    @patch('requests.delete', return_value=Mock())
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    def test_pending_and_running(self, get_credentials, delete):
+        """Running jobs should have their build stopped and pending ones their request."""
+        jobs = [{"buildername": "builder", "requests": [{"request_id": 1}]},
+                {"buildername": "builder", "build_id": 2, "requests": [{"request_id": 3}]}]
+        buildapi.cancel_jobs("repo", jobs, dry_run=False, max_workers=1)
+        self.assertEquals(
+            [call[0][0] for call in delete.call_args_list],
+            ['%s/repo/request/1' % buildapi.HOST_ROOT, '%s/repo/build/2' % buildapi.HOST_ROOT])
+
+
 class TestMakeCancelRequest(unittest.TestCase):
 
     """Test that make_cancel_request makes the right DELETE requests."""
@@ -0,0 +1,60 @@
+import threading
+import time
+import unittest
+
+from mock import patch
+from mozci.sources import buildjson
+from mozci.utils.concurrency import parallel_map
+
+
+def mock_job(request_id, revision):
+    """A buildjson job scheduled with 'request_id' on 'revision'."""
+    return {"request_ids": [request_id],
+            "properties": {"request_ids": [request_id], "revision": revision}}
+
+
+class TestQueryJobsData(unittest.TestCase):
+
+    def setUp(self):
+        buildjson.BUILDS_CACHE = {}
+        buildjson.BUILDS_INDEX = {}
+
+    @patch('mozci.sources.buildjson._buildjson_filename', return_value="builds-4hr.js")
+    @patch('mozci.sources.buildjson._fetch_data')
+    def test_one_pass_per_file(self, fetch_data, _buildjson_filename):
+        """Jobs of the same buildjson file should be looked up with a single load."""
+        fetch_data.return_value = [mock_job(1, "146071751b1e"), mock_job(2, "2bcb1ec25d42")]
+        found = buildjson.query_jobs_data([(1433166610, 1), (1433166611, 2)])
+        self.assertEquals(found[1]["properties"]["revision"], "146071751b1e")
+        self.assertEquals(found[2]["properties"]["revision"], "2bcb1ec25d42")
+        self.assertEquals(fetch_data.call_count, 1)
+
+    @patch('mozci.sources.buildjson._buildjson_filename', return_value="builds-4hr.js")
+    @patch('mozci.sources.buildjson._fetch_data')
+    def test_missing_job(self, fetch_data, _buildjson_filename):
+        """A job missing from a file should make us load the file again once."""
+        buildjson.BUILDS_CACHE["builds-4hr.js"] = []
+        fetch_data.return_value = [mock_job(1, "146071751b1e")]
+        self.assertEquals(buildjson.query_job_data(1433166610, 3), None)
+        self.assertEquals(fetch_data.call_count, 2)
+
+    @patch('mozci.sources.buildjson._buildjson_filename', return_value="builds-4hr.js")
+    @patch('mozci.sources.buildjson.load_file')
+    def test_concurrent_misses(self, load_file, _buildjson_filename):
+        """Concurrent lookups missing jobs should reload the file one at a time."""
+        loading = []
+        overlaps = []
+
+        def _load_file(filepath, url):
+            loading.append(threading.current_thread())
+            if len(loading) > 1:
+                overlaps.append(filepath)
+            time.sleep(0.01)
+            loading.pop()
+            return {"builds": [mock_job(1, "146071751b1e")]}
+
+        load_file.side_effect = _load_file
+        found = parallel_map(lambda request_id: buildjson.query_job_data(1433166610, request_id),
+                             range(2, 10), max_workers=8)
+        self.assertEquals(found, [None] * 8)
+        self.assertEquals(overlaps, [])
@@ -0,0 +1,81 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from mozci.fake_services import FakeData, FakeServices
+from mozci.utils import cassette
+
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, "cassette.json.gz")
+
+    def tearDown(self):
+        cassette.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_record_and_replay(self):
+        """Replaying should give back the recorded responses without a server."""
+        with FakeServices(FakeData.synthetic(pushes=2), latency=0.05) as services:
+            url = services.url + "/builddata/reports/allthethings.json"
+            cassette.record(self.filepath)
+            recorded = requests.get(url).json()
+            self.assertEquals(requests.get(url, stream=True).status_code, 200)
+            self.assertEquals(cassette.stop().requests, 2)
+
+        cassette.replay(self.filepath)
+        self.assertEquals(requests.get(url).json(), recorded)
+        self.assertEquals(
+            "".join(requests.get(url, stream=True).iter_content(1024)), requests.get(url).content)
+        replayed = cassette.stop()
+        self.assertEquals(replayed.requests, 3)
+        assert replayed.network_time >= 0.15
+
+    def test_zero_latency_and_missing_requests(self):
+        """Requests which were not recorded should fail as if we were offline."""
+        with FakeServices(FakeData.synthetic(pushes=2), latency=0.05) as services:
+            url = services.url + "/builddata/reports/allthethings.json"
+            cassette.record(self.filepath)
+            requests.get(url)
+            cassette.stop()
+
+        cassette.replay(self.filepath, zero_latency=True)
+        requests.get(url)
+        self.assertEquals(cassette.CASSETTE.network_time, 0)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            requests.get(url + "?other=1")
+
+    def test_conditional_requests(self):
+        """A conditional request should only be answered by one recorded with its conditions."""
+        with FakeServices(FakeData.synthetic(pushes=2)) as services:
+            url = services.url + "/builddata/reports/allthethings.json"
+            cassette.record(self.filepath)
+            requests.get(url, headers={"If-None-Match": '"abc"', "Authorization": "secret"})
+            cassette.stop()
+
+        with open(self.filepath) as fd:
+            assert "secret" not in gzip.GzipFile(fileobj=fd).read()
+        cassette.replay(self.filepath)
+        requests.get(url, headers={"If-None-Match": '"abc"'})
+        # What we would send with an empty cache was never recorded
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            requests.get(url)
+
+    def test_streaming_from_raw(self):
+        """Streamed responses should still be readable from raw."""
+        with FakeServices(FakeData.synthetic(pushes=2)) as services:
+            url = services.url + "/builddata/reports/allthethings.json"
+            cassette.record(self.filepath)
+            recorded = requests.get(url, stream=True).raw.read()
+            cassette.stop()
+
+        self.assertIn("builders", json.loads(recorded))
+        cassette.replay(self.filepath)
+        self.assertEquals(requests.get(url, stream=True).raw.read(), recorded)
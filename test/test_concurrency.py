@@ -0,0 +1,141 @@
+import logging
+import time
+import unittest
+
+from mozci.utils.concurrency import SingleFlight, TokenBucket, parallel_imap, parallel_map, \
+    parallel_map_with_logs
+
+
+class TestParallelMap(unittest.TestCase):
+
+    def test_order(self):
+        """The results should keep the order of the items."""
+        self.assertEquals(parallel_map(lambda x: x * 2, range(20), max_workers=4),
+                          range(0, 40, 2))
+
+
+class TestParallelImap(unittest.TestCase):
+
+    def test_bounded_look_ahead(self):
+        """Only max_workers calls should be made ahead of the consumer."""
+        calls = []
+
+        def function(x):
+            calls.append(x)
+            time.sleep(0.01)
+            return x
+
+        results = parallel_imap(function, range(100), max_workers=4)
+        self.assertEquals(next(results), 0)
+        # Closing the generator should not wait for the other items
+        results.close()
+        self.assertTrue(len(calls) <= 5)
+        self.assertEquals(list(parallel_imap(function, range(10), max_workers=4)), range(10))
+
+
+class TestParallelMapWithLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('mozci.test_concurrency')
+        self.logger.propagate = False
+        self.messages = []
+        self.handler = logging.Handler()
+        self.handler.emit = lambda record: self.messages.append(record.getMessage())
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_log_order(self):
+        """What every call logs should be kept together in the order of the items."""
+        def function(x):
+            self.logger.warning("start %d" % x)
+            # The first items finish last
+            time.sleep((5 - x) * 0.01)
+            self.logger.warning("end %d" % x)
+            return x * 2
+
+        self.assertEquals(parallel_map_with_logs(function, range(5), max_workers=5,
+                                                 logger=self.logger),
+                          range(0, 10, 2))
+        self.assertEquals(self.messages,
+                          sum([["start %d" % x, "end %d" % x] for x in range(5)], []))
+        self.assertEquals(self.logger.filters, [])
+
+    def test_exception(self):
+        """The first exception should be raised once every call has logged."""
+        def function(x):
+            self.logger.warning("call %d" % x)
+            if x % 2:
+                raise ValueError(x)
+
+        with self.assertRaises(ValueError) as cm:
+            parallel_map_with_logs(function, range(4), max_workers=4, logger=self.logger)
+        self.assertEquals(cm.exception.args, (1,))
+        self.assertEquals(self.messages, ["call %d" % x for x in range(4)])
+
+    def test_nested_pools(self):
+        """What the pools used by a call log should be kept with the call."""
+        def inner(y):
+            time.sleep((3 - y) * 0.01)
+            self.logger.warning("inner %d" % y)
+
+        def function(x):
+            self.logger.warning("start %d" % x)
+            time.sleep((3 - x) * 0.01)
+            list(parallel_imap(inner, range(2), max_workers=2))
+            parallel_map(inner, range(2, 4), max_workers=2)
+            self.logger.warning("end %d" % x)
+
+        parallel_map_with_logs(function, range(3), max_workers=3, logger=self.logger)
+        for x in range(3):
+            messages = self.messages[x * 6:(x + 1) * 6]
+            self.assertEquals((messages[0], messages[-1]), ("start %d" % x, "end %d" % x))
+            self.assertEquals(sorted(messages[1:-1]), ["inner %d" % y for y in range(4)])
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_rate(self):
+        """After the initial burst we should wait 1/rate seconds per operation."""
+        bucket = TokenBucket(rate=50, capacity=2)
+        start = time.time()
+        for _ in range(7):
+            bucket.acquire()
+        assert time.time() - start >= 0.09
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.calls = []
+
+    def _slow(self, value):
+        self.calls.append(value)
+        time.sleep(0.1)
+        if value is None:
+            raise ValueError("No value")
+        return value
+
+    def test_shared_call(self):
+        """Identical calls at the same time should share the result of one call."""
+        results = parallel_map(lambda _: self.single_flight.do("key", self._slow, 42), range(4))
+        self.assertEquals(results, [42] * 4)
+        self.assertEquals(self.calls, [42])
+
+    def test_shared_exception(self):
+        """The callers waiting for a call should get its exception."""
+        def _call(_):
+            try:
+                return self.single_flight.do("key", self._slow, None)
+            except ValueError as e:
+                return str(e)
+
+        self.assertEquals(parallel_map(_call, range(4)), ["No value"] * 4)
+        self.assertEquals(len(self.calls), 1)
+
+    def test_sequential_calls(self):
+        """Nothing should be kept once the call returns."""
+        self.single_flight.do("key", self._slow, 1)
+        self.assertEquals(self.single_flight.do("key", self._slow, 2), 2)
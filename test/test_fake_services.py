@@ -0,0 +1,144 @@
+"""This file exercises mozci end-to-end against mozci.fake_services."""
+import unittest
+
+import requests
+
+from mock import patch
+
+from mozci import mozci, query_jobs
+from mozci.ci_manager import BuildAPIManager
+from mozci.fake_services import FakeData, FakeServices
+from mozci.platforms import determine_upstream_builder
+from mozci.query_jobs import BuildApi, TreeherderApi, CANCELLED, PENDING, RUNNING, \
+    SUCCESS, UNKNOWN
+from mozci.sources import buildapi, pushlog
+
+BUILDERNAME = "Linux x86-64 mozilla-inbound opt test mochitest-1"
+
+
+class TestFakeServices(unittest.TestCase):
+
+    def setUp(self):
+        self.data = FakeData.synthetic(pushes=3, failure_rate=0)
+        self.revision = self.data.pushes["mozilla-inbound"][0]["changesets"][-1]["node"][:12]
+
+    def test_sources(self):
+        """The sources should get the synthetic data from the fake services."""
+        with FakeServices(self.data):
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            tip = self.data.pushes["mozilla-inbound"][-1]["changesets"][-1]["node"]
+            self.assertEquals(pushlog.query_repo_tip(repo_url), tip[:12])
+            self.assertEquals(len(pushlog.query_pushid_range(repo_url, 1, 3)), 3)
+            self.assertEquals(determine_upstream_builder(BUILDERNAME),
+                              "Linux x86-64 mozilla-inbound build")
+
+            jobs = BuildApi().get_matching_jobs("mozilla-inbound", self.revision, BUILDERNAME)
+            self.assertEquals(len(jobs), 1)
+            self.assertEquals(BuildApi().get_job_status(jobs[0]), SUCCESS)
+
+        # Everything is back as it was
+        self.assertEquals(buildapi.HOST_ROOT,
+                          "https://secure.pub.build.mozilla.org/buildapi/self-serve")
+        self.assertEquals(query_jobs.JOBS_CACHE.get(("mozilla-inbound", self.revision)), None)
+
+    def test_treeherder(self):
+        """The fake Treeherder should serve the same jobs as buildapi."""
+        with FakeServices(self.data) as services:
+            url = services.url + "/api/project/mozilla-inbound/%s/"
+            resultsets = requests.get(url % "resultset",
+                                      params={"revision__in": self.revision}).json()["results"]
+            self.assertEquals(resultsets[0]["id"], 1)
+
+            jobs = requests.get(url % "jobs", params={"result_set_id": 1}).json()["results"]
+            self.assertEquals(len(jobs), len(self.data.builders))
+            self.assertEquals(TreeherderApi().get_job_status(jobs[0]), SUCCESS)
+
+            artifacts = requests.get(url % "artifact",
+                                     params={"job_id__in": jobs[0]["id"]}).json()
+            self.assertEquals(artifacts[0]["blob"]["request_id"], jobs[0]["id"])
+
+    def test_trigger(self):
+        """Retriggering a job should schedule a pending job on the fake buildapi."""
+        with FakeServices(self.data):
+            job = BuildApi().get_matching_jobs("mozilla-inbound", self.revision, BUILDERNAME)[0]
+            buildapi.make_retrigger_request("mozilla-inbound", job["requests"][0]["request_id"],
+                                            count=2, dry_run=False)
+            self.assertEquals(len(buildapi.query_jobs_schedule("mozilla-inbound",
+                                                               self.revision)),
+                              len(self.data.builders) + 2)
+
+    def test_failures(self):
+        """Injected failures should look like the service is down."""
+        with FakeServices(self.data, failures={"/buildapi/self-serve/mozilla-inbound": 503}):
+            self.assertEquals(buildapi.query_jobs_schedule("mozilla-inbound", self.revision), [])
+
+    def test_cancel_all(self):
+        """Cancelling a push should stop its running jobs and cancel its pending ones."""
+        data = FakeData.synthetic(pushes=2, failure_rate=0)
+        revision = data.pushes["mozilla-inbound"][-1]["changesets"][-1]["node"][:12]
+        data.add_pending_job("mozilla-inbound", revision, BUILDERNAME)
+        # A job which ended without a result
+        data.add_job("mozilla-inbound", revision, BUILDERNAME, status=None,
+                     endtime=data.pushes["mozilla-inbound"][-1]["date"] + 900)
+        first_revision = data.pushes["mozilla-inbound"][0]["changesets"][-1]["node"][:12]
+
+        with FakeServices(data), patch.object(BuildApi, "_is_coalesced") as is_coalesced:
+            report = BuildAPIManager().cancel_all("mozilla-inbound", revision,
+                                                  filters=["*mochitest*"], dry_run=False)
+            # Two platforms with two mochitest builders running plus the pending job
+            self.assertEquals(len(report), 6)
+            self.assertEquals(sorted(entry["status"] for entry in report),
+                              [PENDING] + [RUNNING] * 4 + [UNKNOWN])
+            self.assertEquals(sorted(entry["outcome"] for entry in report),
+                              ["cancelled"] * 5 + ["skipped"])
+
+            # We do not look at whether the finished jobs were coalesced
+            self.assertEquals(
+                BuildAPIManager().cancel_all("mozilla-inbound", first_revision), [])
+            self.assertFalse(is_coalesced.called)
+
+            statuses = [BuildApi().get_job_status(job)
+                        for job in buildapi.query_jobs_schedule("mozilla-inbound", revision)]
+            self.assertEquals(statuses.count(CANCELLED), 5)
+            self.assertEquals(statuses.count(RUNNING), len(data.builders) - 4)
+            self.assertEquals(statuses.count(UNKNOWN), 1)
+
+    def test_cancel_all_expires_jobs(self):
+        """The jobs we cached before cancelling them should not be served anymore."""
+        data = FakeData.synthetic(pushes=1, failure_rate=0)
+        revision = data.pushes["mozilla-inbound"][-1]["changesets"][-1]["node"][:12]
+
+        with FakeServices(data):
+            query_api = BuildApi()
+            jobs = query_api.get_matching_jobs("mozilla-inbound", revision, BUILDERNAME)
+            self.assertEquals(query_api.get_job_status(jobs[0]), RUNNING)
+
+            BuildAPIManager().cancel_all("mozilla-inbound", revision, filters=[BUILDERNAME],
+                                         dry_run=False)
+            self.assertFalse(query_jobs._fresh_in_cache(
+                query_jobs.JOBS_CACHE, query_jobs.JOBS_CACHE_METADATA,
+                ("mozilla-inbound", revision)))
+            jobs = query_api.get_matching_jobs("mozilla-inbound", revision, BUILDERNAME)
+            self.assertEquals(query_api.get_job_status(jobs[0]), CANCELLED)
+
+    def test_parallel_trigger_range(self):
+        """Test jobs sharing a build handled concurrently should only request it once."""
+        data = FakeData()
+        data.add_repository("mozilla-inbound")
+        buildernames = data.add_platform("mozilla-inbound", "Linux x86-64",
+                                         ("mochitest-1", "mochitest-2", "xpcshell"))
+        revisions = [data.add_push("mozilla-inbound")["changesets"][-1]["node"][:12]
+                     for _ in range(3)]
+
+        with FakeServices(data) as services, \
+                patch('mozci.mozci.SCHEDULING_MANAGER', {}), \
+                patch('mozci.mozci.QUERY_SOURCE', TreeherderApi()):
+            mozci.trigger_range_for_builders(buildernames[1:], revisions, max_workers=4)
+            requested = [path for method, path in services.requests
+                         if method == "POST" and "/builders/" in path]
+
+        self.assertEquals(sorted(requested), sorted(
+            "/buildapi/self-serve/mozilla-inbound/builders/%s/%s" %
+            (requests.utils.quote(buildernames[0]), revision) for revision in revisions))
+        self.assertEquals(sum(len(data.jobs["mozilla-inbound"][revision])
+                              for revision in revisions), 3)
@@ -0,0 +1,72 @@
+"""This file contains tests for mozci/utils/journal.py."""
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from mozci.utils import journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patcher = patch('mozci.utils.journal.JOURNAL_FILE',
+                             os.path.join(self.tmpdir, "journal.sqlite"))
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_scheduled(self):
+        """We should only get back the builders recorded on that revision."""
+        journal.record("4e030c8cf8c3", ["build", "test", "test"])
+        journal.record("146071751b1e", ["other build"])
+        self.assertEquals(journal.scheduled("4e030c8cf8c3", ["build", "test", "other build"]),
+                          set(["build", "test"]))
+
+    def test_reserve(self):
+        """Only the first reservation of a builder on a revision should succeed."""
+        self.assertTrue(journal.reserve("4e030c8cf8c3", "build"))
+        self.assertFalse(journal.reserve("4e030c8cf8c3", "build"))
+        journal.forget("4e030c8cf8c3", ["build"])
+        self.assertTrue(journal.reserve("4e030c8cf8c3", "build"))
+
+    def test_ttl(self):
+        """Records older than JOURNAL_TTL should be ignored."""
+        journal.record("4e030c8cf8c3", ["build"])
+        with patch('time.time', return_value=time.time() + journal.JOURNAL_TTL + 1):
+            self.assertEquals(journal.scheduled("4e030c8cf8c3", ["build"]), set())
+            self.assertTrue(journal.reserve("4e030c8cf8c3", "build"))
+
+    def test_forget_our_records_only(self):
+        """forget should leave the records of other processes alone."""
+        journal.record("4e030c8cf8c3", ["build"])
+        with patch('mozci.utils.journal.OWNER', "another process"):
+            journal.record("4e030c8cf8c3", ["build"])
+        journal.forget("4e030c8cf8c3", ["build"])
+        self.assertEquals(journal.scheduled("4e030c8cf8c3", ["build"]), set(["build"]))
+        with patch('mozci.utils.journal.OWNER', "another process"):
+            journal.forget("4e030c8cf8c3", ["build"])
+        self.assertEquals(journal.scheduled("4e030c8cf8c3", ["build"]), set())
+
+    def test_long_revisions(self):
+        """The 40 and 12 character forms of a revision should be the same entry."""
+        self.assertTrue(journal.reserve("4e030c8cf8c35158c9924f6bb33ffe8af00c162b", "build"))
+        self.assertFalse(journal.reserve("4e030c8cf8c3", "build"))
+        self.assertEquals(journal.scheduled("4e030c8cf8c35158c9924f6bb33ffe8af00c162b",
+                                            ["build"]), set(["build"]))
+
+    def test_old_journal(self):
+        """Journals without the owner of every entry should still be usable."""
+        conn = sqlite3.connect(journal.JOURNAL_FILE)
+        conn.execute("CREATE TABLE triggers (revision TEXT, buildername TEXT, triggered_at REAL)")
+        conn.commit()
+        conn.close()
+        self.assertTrue(journal.reserve("4e030c8cf8c3", "build"))
+        self.assertFalse(journal.reserve("4e030c8cf8c3", "build"))
@@ -1,11 +1,16 @@
 """This file contains tests for mozci/mozci.py."""
 
 import json
+import os
 import pytest
+import shutil
+import tempfile
 import unittest
 
 import mozci.mozci
 from mozci.query_jobs import SUCCESS, PENDING, RUNNING, COALESCED
+from mozci.utils import journal
+from mozci.utils.concurrency import parallel_map
 
 from mock import patch
 
@@ -16,6 +21,19 @@ MOCK_JSON = '''{
                     "graph_branches": ["Real-Repo"],
                     "repo_type": "hg"}}'''
 
+JOURNAL_DIR = tempfile.mkdtemp()
+JOURNAL_FILE = journal.JOURNAL_FILE
+
+
+def setUpModule():
+    # Do not mix the jobs these tests request with the real ones
+    journal.JOURNAL_FILE = os.path.join(JOURNAL_DIR, "scheduling_journal.sqlite")
+
+
+def tearDownModule():
+    journal.JOURNAL_FILE = JOURNAL_FILE
+    shutil.rmtree(JOURNAL_DIR)
+
 
 class TestQueries(unittest.TestCase):
 
@@ -44,6 +62,29 @@ class TestQueries(unittest.TestCase):
         with pytest.raises(Exception):
             mozci.mozci.query_repo_name_from_buildername("Linux not-a-repo opt build")
 
+    def test_query_repo_name_from_buildername_clobber(self):
+        """A repository missing from the cached file should be found after clobbering it."""
+        repositories = {False: {}, True: json.loads(MOCK_JSON)}
+        with patch('mozci.sources.buildapi.query_repositories',
+                   side_effect=lambda clobber: repositories[clobber]) as query_repositories:
+            self.assertEquals(
+                mozci.mozci.query_repo_name_from_buildername("Linux real-repo opt build"),
+                "real-repo")
+            query_repositories.assert_called_with(True)
+
+    @patch('mozci.sources.buildapi.query_repositories',
+           return_value=json.loads('{"b2g37": {}, "mozilla-b2g37_v2_2": {}, "real-repo": {}}'))
+    def test_query_repo_name_from_buildername_longest(self, query_repositories):
+        """The longest repository name found in the buildername should win."""
+        self.assertEquals(
+            mozci.mozci.query_repo_name_from_buildername(
+                "b2g_mozilla-b2g37_v2_2_flame-kk_periodic"),
+            "mozilla-b2g37_v2_2")
+        self.assertEquals(
+            mozci.mozci.query_repo_name_from_buildername("b2g_b2g37_flame-kk_periodic"),
+            "b2g37")
+        self.assertEquals(mozci.mozci.REPO_NAMES["b2g_b2g37_flame-kk_periodic"], "b2g37")
+
 
 class TestJobValidation(unittest.TestCase):
     """Test functions that deal with alljobs."""
@@ -121,3 +162,117 @@ class TestJobValidation(unittest.TestCase):
     def test_status_summary_coalesced(self, get_status):
         """Test _status_summary with a coalesced state."""
         assert mozci.mozci._status_summary(self.jobs) == (0, 0, 0, 1, 0)
+
+
+class TestTriggerRangeForBuilders(unittest.TestCase):
+    """Test trigger_range_for_builders."""
+
+    @patch('mozci.mozci.trigger_range')
+    @patch('mozci.mozci.plan_build_jobs',
+           return_value={'Platform repo build': ['Platform repo test', 'Platform repo other test'],
+                         'Other platform repo build': ['Other platform repo build']})
+    def test_grouped_by_build(self, plan_build_jobs, trigger_range):
+        """Jobs sharing a build job should be triggered one after the other."""
+        mozci.mozci.trigger_range_for_builders(
+            ['Platform repo test', 'Other platform repo build', 'Platform repo other test'],
+            ['4f2decfeb9c5'])
+        self.assertEquals(
+            [c[1]['buildername'] for c in trigger_range.call_args_list],
+            ['Other platform repo build', 'Platform repo test', 'Platform repo other test'])
+        # The build jobs found are only kept while we trigger the plan
+        self.assertEquals(mozci.mozci.BUILD_JOBS_FOUND, None)
+
+    @patch('mozci.mozci.expire_jobs')
+    @patch('mozci.sources.buildapi.trigger_arbitrary_jobs')
+    @patch('mozci.mozci.plan_build_jobs',
+           return_value={'Platform repo build': ['Platform repo test', 'Platform repo other test']})
+    def test_batched_triggers(self, plan_build_jobs, trigger_arbitrary_jobs, expire_jobs):
+        """The jobs requested while triggering the plan should be requested at once."""
+        def trigger_range(buildername, revisions, **kwargs):
+            mozci.mozci.trigger(buildername, revisions[0])
+
+        with patch('mozci.mozci.trigger_range', side_effect=trigger_range), \
+                patch('mozci.mozci.query_repo_name_from_buildername', return_value='repo'):
+            mozci.mozci.trigger_range_for_builders(
+                ['Platform repo test', 'Platform repo other test'], ['4f2decfeb9c5'])
+
+        trigger_arbitrary_jobs.assert_called_once_with([
+            ('repo', 'Platform repo test', '4f2decfeb9c5', [], None),
+            ('repo', 'Platform repo other test', '4f2decfeb9c5', [], None)])
+        self.assertEquals(mozci.mozci.TRIGGER_BATCH, None)
+
+    @patch('mozci.mozci._retrigger_jobs')
+    @patch('mozci.mozci._prepare_revisions')
+    @patch('mozci.mozci.plan_build_jobs',
+           return_value={'Platform repo build': ['Platform repo test', 'Platform repo other test']})
+    def test_parallel(self, plan_build_jobs, prepare_revisions, retrigger_jobs):
+        """With max_workers every builder on every revision should be handled concurrently."""
+        def trigger_revision(buildername, rev, *args):
+            # Only the first job of every builder can be retriggered
+            if rev == 'aaaaaaaaaaaa':
+                return (rev, {'buildername': buildername}, 1)
+
+        with patch('mozci.mozci._trigger_revision', side_effect=trigger_revision) as trigger:
+            mozci.mozci.trigger_range_for_builders(
+                ['Platform repo test', 'Platform repo other test'],
+                ['aaaaaaaaaaaa', 'bbbbbbbbbbbb', 'cccccccccccc'], max_workers=4)
+
+        self.assertEquals(trigger.call_count, 6)
+        prepare_revisions.assert_called_once_with(
+            ['Platform repo test', 'Platform repo other test'],
+            ['aaaaaaaaaaaa', 'bbbbbbbbbbbb', 'cccccccccccc'])
+        self.assertEquals(
+            [c[0][:2] for c in retrigger_jobs.call_args_list],
+            [('Platform repo test',
+              [('aaaaaaaaaaaa', {'buildername': 'Platform repo test'}, 1)]),
+             ('Platform repo other test',
+              [('aaaaaaaaaaaa', {'buildername': 'Platform repo other test'}, 1)])])
+
+
+class TestValidBuilder(unittest.TestCase):
+    """Test valid_builder."""
+
+    def test_no_buildername(self):
+        """A missing buildername (e.g. no upstream build job) should not be valid."""
+        self.assertFalse(mozci.mozci.valid_builder(None))
+
+
+class TestUniqueBuildRequest(unittest.TestCase):
+    """Test that we do not request a build job twice."""
+
+    @patch('mozci.mozci.is_downstream', return_value=False)
+    def test_other_process(self, is_downstream):
+        """A build requested by another process should not be requested again."""
+        self.assertTrue(mozci.mozci._unique_build_request("Platform repo build", "aaaaaaaaaaaa"))
+        # What another mozci process would do
+        journal.reserve("aaaaaaaaaaaa", "Platform repo build")
+        self.assertFalse(mozci.mozci._unique_build_request("Platform repo build", "aaaaaaaaaaaa"))
+        self.assertFalse(mozci.mozci._record_scheduling("Platform repo build", "aaaaaaaaaaaa",
+                                                        unique=True))
+
+    def test_concurrent_requests(self):
+        """Only one of the threads sharing a build job should request it."""
+        reservations = parallel_map(
+            lambda _: mozci.mozci._record_scheduling("Platform repo build", "bbbbbbbbbbbb",
+                                                     unique=True),
+            range(8), max_workers=8)
+        self.assertEquals(reservations.count(True), 1)
+
+    @patch('mozci.mozci.SCHEDULING_MANAGER', {})
+    def test_scheduled_once_per_builder(self):
+        """Scheduling a builder again should not grow what we remember."""
+        for _ in range(3):
+            mozci.mozci._record_scheduling("Platform repo opt test mochitest-1",
+                                           "dddddddddddd", times=2, dry_run=True)
+        self.assertEquals(mozci.mozci.SCHEDULING_MANAGER,
+                          {"dddddddddddd": set(["Platform repo opt test mochitest-1"])})
+
+    def test_downstream_jobs_are_not_journaled(self):
+        """Only build jobs should be added to the journal."""
+        mozci.mozci._record_scheduling("Platform repo opt test mochitest-1", "cccccccccccc",
+                                       downstream=True)
+        mozci.mozci._record_scheduling("Platform repo build", "cccccccccccc")
+        self.assertEquals(
+            journal.scheduled("cccccccccccc", ["Platform repo opt test mochitest-1",
+                                               "Platform repo build"]),
+            set(["Platform repo build"]))
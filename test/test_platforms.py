@@ -258,3 +258,61 @@ def test_get_job_type(test_job, expected):
     obtained = mozci.platforms._get_job_type(test_job)
     assert obtained == expected, \
         'obtained: "%s", expected "%s"' % (obtained, expected)
+
+
+class TestCanonicalBuildername(unittest.TestCase):
+
+    """Test canonical_buildername and suggest_buildernames with mock data."""
+
+    @patch('mozci.platforms.fetch_allthethings_data')
+    def test_canonical(self, fetch_allthethings_data):
+        """The lookup should ignore capitalization and return None for unknown builders."""
+        fetch_allthethings_data.return_value = MOCK_ALLTHETHINGS
+        self.assertEquals(
+            mozci.platforms.canonical_buildername('Platform1 repo build'),
+            'Platform1 repo build')
+        self.assertEquals(
+            mozci.platforms.canonical_buildername('platform1 REPO opt test mochitest-1'),
+            'Platform1 repo opt test mochitest-1')
+        self.assertEquals(
+            mozci.platforms.canonical_buildername('Platform3 repo build'), None)
+
+    @patch('mozci.platforms.fetch_allthethings_data')
+    def test_suggestions(self, fetch_allthethings_data):
+        """The closest buildernames to a misspelled one should come first."""
+        fetch_allthethings_data.return_value = MOCK_ALLTHETHINGS
+        self.assertEquals(
+            mozci.platforms.suggest_buildernames('Platform1 repo opt tset mochitest-1', limit=2),
+            ['Platform1 repo opt test mochitest-1', 'Platform1 repo debug test mochitest-1'])
+
+
+class TestPlanBuildJobs(unittest.TestCase):
+
+    """Test plan_build_jobs with mock data."""
+
+    @patch('mozci.platforms.fetch_allthethings_data')
+    def test_plan(self, fetch_allthethings_data):
+        """Test jobs should be grouped under the build job they depend on."""
+        fetch_allthethings_data.return_value = MOCK_ALLTHETHINGS
+        plan = mozci.platforms.plan_build_jobs([
+            'Platform1 repo opt test mochitest-1',
+            'Platform1 repo talos tp5o',
+            'Platform1 repo debug test mochitest-1',
+            'Platform1 repo build'])
+        self.assertEquals(
+            plan,
+            {'Platform1 repo build': ['Platform1 repo opt test mochitest-1',
+                                      'Platform1 repo talos tp5o',
+                                      'Platform1 repo build'],
+             'Platform1 repo leak test build': ['Platform1 repo debug test mochitest-1']})
+        self.assertEquals(
+            mozci.platforms.shared_build_jobs(plan),
+            {'Platform1 repo build': ['Platform1 repo opt test mochitest-1',
+                                      'Platform1 repo talos tp5o']})
+
+    @patch('mozci.platforms.determine_upstream_builder', return_value=None)
+    def test_no_build_job(self, determine_upstream_builder):
+        """Buildernames without a build job should still be in the plan."""
+        plan = mozci.platforms.plan_build_jobs(['Platform1 repo talos tp5o'])
+        self.assertEquals(plan, {None: ['Platform1 repo talos tp5o']})
+        self.assertEquals(mozci.platforms.shared_build_jobs(plan), {})
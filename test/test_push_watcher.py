@@ -0,0 +1,62 @@
+"""This file contains tests for mozci/push_watcher.py."""
+import unittest
+
+from mozci.fake_services import FakeData, FakeServices
+from mozci.push_watcher import PushWatcher
+from mozci.sources import buildapi, pushlog
+
+
+class TestPushWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.data = FakeData.synthetic(repo_names=("mozilla-inbound", "fx-team"), pushes=5)
+
+    def test_new_pushes(self):
+        """Only the pushes made since the previous poll should be found."""
+        with FakeServices(self.data) as services:
+            watcher = PushWatcher()
+            self.assertEquals(watcher.repo_names, ["fx-team", "mozilla-inbound"])
+            self.assertEquals(watcher.poll(), [])
+            self.assertEquals(watcher.last_push_ids, {"fx-team": 5, "mozilla-inbound": 5})
+
+            date = self.data.pushes["mozilla-inbound"][-1]["date"]
+            first = self.data.add_push("mozilla-inbound", date=date + 10)
+            second = self.data.add_push("fx-team", date=date + 20)
+            third = self.data.add_push("mozilla-inbound", changesets=2, date=date + 30)
+            pushes = watcher.poll()
+            self.assertEquals(
+                [(push["repo_name"], push["pushid"]) for push in pushes],
+                [("mozilla-inbound", "6"), ("fx-team", "6"), ("mozilla-inbound", "7")])
+            self.assertEquals([push["revision"] for push in pushes],
+                              [push["changesets"][-1]["node"][:12]
+                               for push in (first, second, third)])
+            self.assertEquals(len(pushes[2]["changesets"]), 2)
+
+            # Every poll asks for the pushes after the last one we have seen
+            self.assertEquals(watcher.poll(), [])
+            self.assertEquals(sorted(path.split("?")[1] for _, path in services.requests[-2:]),
+                              ["version=2&startID=6", "version=2&startID=7"])
+
+    def test_callback(self):
+        """The callback should be called with every new push."""
+        found = []
+        with FakeServices(self.data):
+            watcher = PushWatcher(["mozilla-inbound"], callback=found.append, interval=0)
+            watcher.run(polls=1)
+            self.data.add_push("mozilla-inbound")
+            watcher.run(polls=1)
+
+        self.assertEquals([push["pushid"] for push in found], ["6"])
+
+    def test_remember(self):
+        """The pushes found should only be stored with the other push info if asked."""
+        with FakeServices(self.data):
+            for remember in (False, True):
+                watcher = PushWatcher(["mozilla-inbound"], remember=remember)
+                watcher.poll()
+                push = self.data.add_push("mozilla-inbound")
+                watcher.poll()
+                repo_url = buildapi.query_repo_url("mozilla-inbound")
+                self.assertEquals(
+                    pushlog._cached_push_id(repo_url, push["changesets"][-1]["node"]),
+                    push["id"] if remember else None)
@@ -1,8 +1,17 @@
 import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
+import requests
+
 from mock import patch, Mock
-from mozci.sources import pushlog
+from mozci.fake_services import FakeData, FakeServices
+from mozci.sources import buildapi, pushlog
+from mozci.utils import cassette
+from mozci.utils.concurrency import parallel_map
 
 
 def mock_response(content):
@@ -16,6 +25,22 @@ def mock_response(content):
     response.json = mock_response_json
     return response
 
+
+PUSH_INFO_DIR = tempfile.mkdtemp()
+PUSH_INFO_FILE = pushlog.PUSH_INFO_FILE
+
+
+def setUpModule():
+    # Do not mix what these tests learn about pushes with the real data
+    pushlog.PUSH_INFO_FILE = os.path.join(PUSH_INFO_DIR, "push_info.json")
+
+
+def tearDownModule():
+    pushlog.PUSH_INFO_FILE = PUSH_INFO_FILE
+    pushlog.PUSH_INFO = None
+    shutil.rmtree(PUSH_INFO_DIR)
+
+
 INVALID_REVISION = """
 "unknown revision '123456123456s'"
 """
@@ -37,7 +62,12 @@ class TestValidRevision(unittest.TestCase):
 
     """Test valid_revision mocking GET requests."""
 
-    @patch('requests.get', return_value=mock_response(GOOD_REVISION))
+    def setUp(self):
+        pushlog.PUSH_INFO = None
+        if os.path.exists(pushlog.PUSH_INFO_FILE):
+            os.remove(pushlog.PUSH_INFO_FILE)
+
+    @patch('requests.Session.get', return_value=mock_response(GOOD_REVISION))
     def test_valid_without_any_cache(self, get):
         """Calling the function without in-memory cache."""
         # Making sure the original cache is empty
@@ -49,7 +79,7 @@ class TestValidRevision(unittest.TestCase):
         self.assertEquals(
             pushlog.VALID_CACHE, {("try", "4e030c8cf8c3"): True})
 
-    @patch('requests.get', return_value=mock_response(GOOD_REVISION))
+    @patch('requests.Session.get', return_value=mock_response(GOOD_REVISION))
     def test_in_memory_cache(self,  get):
         """Calling the function with in-memory cache should return without calling request.get."""
         pushlog.VALID_CACHE = {("try", "146071751b1e"): True}
@@ -58,8 +88,237 @@ class TestValidRevision(unittest.TestCase):
 
         assert get.call_count == 0
 
-    @patch('requests.get', return_value=mock_response(INVALID_REVISION))
+    @patch('requests.Session.get', return_value=mock_response(INVALID_REVISION))
     def test_invalid(self, get):
         """Calling the function with a bad revision."""
         self.assertEquals(
             pushlog.valid_revision("try", "123456123456"), False)
+
+    @patch('requests.Session.get', return_value=mock_response(GOOD_REVISION))
+    def test_on_disk_cache(self, get):
+        """A valid revision should not be asked again by another process."""
+        pushlog.VALID_CACHE = {}
+        pushlog.valid_revision("try", "4e030c8cf8c3")
+        # What a new process starts with
+        pushlog.VALID_CACHE = {}
+        pushlog.PUSH_INFO = None
+        # Longer revisions of the same changeset are known too
+        self.assertEquals(pushlog.valid_revision("try", "4e030c8cf8c35158"), True)
+        self.assertEquals(pushlog.query_revision_info("try", "4e030c8cf8c3"),
+                          {"changesets": ["4e030c8cf8c35158c9924f6bb33ffe8af00c162b"],
+                           "date": 1438992451, "user": "nobody@mozilla.com", "pushid": "82366"})
+        self.assertEquals(get.call_count, 1)
+        self.assertEquals(pushlog.valid_revision("try", "4e030c8cf8c4"), True)
+        self.assertEquals(get.call_count, 2)
+
+    @patch('requests.Session.get', return_value=mock_response(INVALID_REVISION))
+    def test_invalid_ttl(self, get):
+        """A revision which was not valid should only be asked again after INVALID_TTL."""
+        pushlog.valid_revision("try", "123456123456")
+        pushlog.VALID_CACHE = {}
+        self.assertEquals(pushlog.valid_revision("try", "123456123456"), False)
+        self.assertEquals(get.call_count, 1)
+
+        pushlog.VALID_CACHE = {}
+        with patch('time.time', return_value=time.time() + pushlog.INVALID_TTL):
+            pushlog.valid_revision("try", "123456123456")
+        self.assertEquals(get.call_count, 2)
+
+
+class TestPushInfo(unittest.TestCase):
+
+    """Test how what we learn about pushes is stored."""
+
+    def setUp(self):
+        pushlog.PUSH_INFO = None
+        if os.path.exists(pushlog.PUSH_INFO_FILE):
+            os.remove(pushlog.PUSH_INFO_FILE)
+
+    def _push(self, push_id):
+        node = (str(push_id) * 40)[:40]
+        return {str(push_id): {"changesets": [node], "date": push_id, "user": "nobody"}}
+
+    def test_other_processes(self):
+        """What another process stored since we loaded the file should be kept."""
+        pushlog._remember_pushes("repo", self._push(1))
+        pushlog._save_push_info()
+
+        # Another process learns about push 2 while we learn about push 3
+        pushlog.PUSH_INFO = None
+        pushlog._remember_pushes("repo", self._push(2))
+        other_process = pushlog.PUSH_INFO
+        pushlog._save_push_info()
+        pushlog.PUSH_INFO = other_process
+        del other_process["repo"]["pushes"]["2"]
+        pushlog._remember_pushes("repo", self._push(3))
+        pushlog._save_push_info()
+
+        pushlog.PUSH_INFO = None
+        self.assertEquals(sorted(pushlog._load_push_info("repo")["pushes"].keys()),
+                          ["1", "2", "3"])
+
+    @patch('mozci.sources.pushlog.PUSH_INFO_MAX_PUSHES', 2)
+    def test_eviction(self):
+        """Only the latest pushes (and their revisions) should be kept."""
+        for push_id in range(1, 5):
+            pushlog._remember_pushes("repo", self._push(push_id))
+        pushlog._remember_invalid("repo", "123456123456")
+        with patch('mozci.sources.pushlog.INVALID_TTL', 0):
+            pushlog._save_push_info()
+
+        pushlog.PUSH_INFO = None
+        push_info = pushlog._load_push_info("repo")
+        self.assertEquals(sorted(push_info["pushes"].keys()), ["3", "4"])
+        self.assertEquals(sorted(push_id for _, push_id in push_info["revisions"].values()),
+                          ["3", "4"])
+        self.assertEquals(push_info["invalid"], {})
+
+
+class TestQueryRevisionInfo(unittest.TestCase):
+
+    """Test query_revision_info mocking GET requests."""
+
+    @patch('requests.Session.get', return_value=mock_response(GOOD_REVISION))
+    def test_concurrent_queries(self, get):
+        """Identical queries at the same time should share one request and its json."""
+        pushlog.VALID_CACHE = {}
+        pushlog.PUSH_INFO = {}
+        data = json.loads(GOOD_REVISION)
+        get.return_value.json = Mock(return_value=data)
+        get.side_effect = lambda url: time.sleep(0.1) or get.return_value
+
+        results = parallel_map(lambda _: pushlog.query_revision_info("try", "4e030c8cf8c3"),
+                               range(4))
+        self.assertEquals(get.call_count, 1)
+        self.assertEquals(results, [dict(data["82366"], pushid="82366")] * 4)
+        # The shared json is left as it was
+        self.assertEquals(data, json.loads(GOOD_REVISION))
+
+        # We know the revision is valid without asking again
+        self.assertEquals(pushlog.valid_revision("try", "4e030c8cf8c3"), True)
+        self.assertEquals(get.call_count, 1)
+
+
+class TestValidRevisions(unittest.TestCase):
+
+    """Test valid_revisions against the fake json-pushes."""
+
+    def test_range(self):
+        """A range of pushes should be validated with two requests."""
+        data = FakeData.synthetic(pushes=60, failure_rate=0)
+        pushes = data.pushes["mozilla-inbound"]
+        revisions = [push["changesets"][-1]["node"][:12] for push in pushes[5:55]]
+
+        with FakeServices(data) as services:
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            before = len(services.requests)
+            valid = pushlog.valid_revisions(repo_url, revisions + ["123456123456"])
+            self.assertEquals(len(services.requests) - before, 3)
+
+        self.assertEquals(valid.pop("123456123456"), False)
+        self.assertEquals(valid, dict((revision, True) for revision in revisions))
+
+    def test_not_tips(self):
+        """Changesets which are not the tip of their push should be looked up one by one."""
+        data = FakeData.synthetic(pushes=10, failure_rate=0)
+        revisions = [push["changesets"][0]["node"][:12]
+                     for push in data.pushes["mozilla-inbound"][:4]]
+
+        with FakeServices(data) as services:
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            before = len(services.requests)
+            valid = pushlog.valid_revisions(repo_url, revisions)
+            # The first window has none of them so we stop fetching windows
+            self.assertEquals(len(services.requests) - before, 5)
+
+        self.assertEquals(valid, dict((revision, True) for revision in revisions))
+
+
+class TestQueryRanges(unittest.TestCase):
+
+    """Test the pushlog ranges against the fake json-pushes."""
+
+    def setUp(self):
+        self.data = FakeData.synthetic(pushes=25, failure_rate=0)
+        self.tips = [push["changesets"][-1]["node"][:12]
+                     for push in self.data.pushes["mozilla-inbound"]]
+
+    @patch('mozci.sources.pushlog.PUSHES_CHUNK', 4)
+    def test_chunks(self):
+        """Large ranges should be fetched in chunks and stitched in order."""
+        with FakeServices(self.data) as services:
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            before = len(services.requests)
+            self.assertEquals(pushlog.query_pushid_range(repo_url, 3, 20),
+                              list(reversed(self.tips[2:20])))
+            self.assertEquals(len(services.requests) - before, 5)
+
+            self.assertEquals(pushlog.query_revisions_range(repo_url, self.tips[0], self.tips[24]),
+                              self.tips)
+
+    def test_generator(self):
+        """The pushes should be yielded oldest first unless we ask otherwise."""
+        with FakeServices(self.data):
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            pushes = pushlog.iter_pushes(repo_url, 10, 12, chunk_size=2)
+            self.assertEquals([push_id for push_id, _ in pushes], [10, 11, 12])
+            pushes = pushlog.iter_pushes(repo_url, 10, 12, newest_first=True, chunk_size=2)
+            self.assertEquals([push_id for push_id, _ in pushes], [12, 11, 10])
+
+
+class TestIterRevisionChangesets(unittest.TestCase):
+
+    """Test the streaming of full=1 push info against the fake json-pushes."""
+
+    def test_changesets_and_files(self):
+        """Every changeset and every file should be yielded once."""
+        data = FakeData.synthetic(pushes=1, failure_rate=0)
+        data.add_repository("try")
+        push = data.add_push("try", changesets=3, files=("a/b.cpp", "c/d.js"))
+        revision = push["changesets"][-1]["node"][:12]
+
+        with FakeServices(data):
+            repo_url = buildapi.query_repo_url("try")
+            changesets = list(pushlog.iter_revision_changesets(repo_url, revision))
+            self.assertEquals(changesets, push["changesets"])
+            self.assertEquals(list(pushlog.iter_revision_files(repo_url, revision)),
+                              ["a/b.cpp", "c/d.js"])
+
+    def test_unknown_revision(self):
+        """An error from json-pushes should not look like a push without changesets."""
+        with FakeServices(FakeData.synthetic(pushes=1, failure_rate=0)):
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            with self.assertRaises(requests.exceptions.HTTPError):
+                list(pushlog.iter_revision_changesets(repo_url, "123456123456"))
+
+    def test_cassette(self):
+        """Streaming the changesets should work while recording and replaying."""
+        data = FakeData.synthetic(pushes=1, failure_rate=0)
+        push = data.pushes["mozilla-inbound"][0]
+        revision = push["changesets"][-1]["node"][:12]
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filepath = os.path.join(tmpdir, "changesets.json.gz")
+
+        with FakeServices(data):
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            cassette.record(filepath)
+            try:
+                self.assertEquals(list(pushlog.iter_revision_changesets(repo_url, revision)),
+                                  push["changesets"])
+            finally:
+                cassette.stop()
+
+        cassette.replay(filepath)
+        try:
+            self.assertEquals(list(pushlog.iter_revision_changesets(repo_url, revision)),
+                              push["changesets"])
+        finally:
+            cassette.stop()
+
+    @patch('requests.Session.get')
+    def test_not_an_object(self, get):
+        """A body which is not an object should raise."""
+        get.return_value.iter_content.return_value = iter(['"unknown revision"'])
+        with self.assertRaises(AssertionError):
+            list(pushlog.iter_revision_changesets("https://hg.mozilla.org/try", "123456123456"))
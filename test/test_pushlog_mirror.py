@@ -0,0 +1,66 @@
+"""This file contains tests for mozci/sources/pushlog_mirror.py."""
+import unittest
+
+from mock import patch
+
+from mozci.fake_services import FakeData, FakeServices
+from mozci.sources import buildapi, pushlog, pushlog_mirror
+
+
+class TestPushlogMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.data = FakeData.synthetic(pushes=30, failure_rate=0)
+        self.pushes = self.data.pushes["mozilla-inbound"]
+        self.patcher = patch('mozci.sources.pushlog.USE_MIRROR', True)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def _tip(self, push_id):
+        return self.pushes[push_id - 1]["changesets"][-1]["node"][:12]
+
+    def _json_pushes_requests(self, services):
+        return len([path for _, path in services.requests if path.endswith("json-pushes")])
+
+    def test_local_answers(self):
+        """Once synced, the pushlog queries should not reach json-pushes."""
+        with patch('mozci.sources.pushlog_mirror.SYNC_CHUNK', 8), \
+                FakeServices(self.data) as services:
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            self.assertEquals(pushlog.query_repo_tip(repo_url), self._tip(30))
+            fetched = self._json_pushes_requests(services)
+
+            self.assertEquals(pushlog.query_pushid_range(repo_url, 3, 5),
+                              [self._tip(5), self._tip(4), self._tip(3)])
+            self.assertEquals(pushlog.query_revisions_range(repo_url, self._tip(3), self._tip(5)),
+                              [self._tip(3), self._tip(4), self._tip(5)])
+            # Any changeset of a push is valid, not only its tip
+            first = self.pushes[9]["changesets"][0]["node"][:12]
+            self.assertTrue(pushlog.valid_revision(repo_url, first))
+            self.assertEquals(pushlog.query_revision_info(repo_url, first)["pushid"], "10")
+            self.assertEquals(self._json_pushes_requests(services), fetched)
+
+    def test_incremental_sync(self):
+        """New pushes should be fetched starting from the last push we have."""
+        with FakeServices(self.data) as services:
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            self.assertEquals(pushlog_mirror.sync(repo_url), 30)
+
+            push = self.data.add_push("mozilla-inbound")
+            revision = push["changesets"][-1]["node"][:12]
+            with patch('mozci.sources.pushlog_mirror.SYNC_INTERVAL', 0):
+                self.assertEquals(pushlog.query_revision_info(repo_url, revision)["pushid"],
+                                  "31")
+            self.assertIn("startID=30", services.requests[-1][1])
+
+    def test_before_the_mirror(self):
+        """Pushes older than the mirror should be asked to json-pushes."""
+        with patch('mozci.sources.pushlog_mirror.MIRROR_HISTORY', 10), FakeServices(self.data):
+            repo_url = buildapi.query_repo_url("mozilla-inbound")
+            self.assertEquals(pushlog.query_pushid_range(repo_url, 1, 2),
+                              [self._tip(2), self._tip(1)])
+            self.assertEquals(pushlog_mirror.query_pushid_range(repo_url, 1, 2), None)
+            self.assertEquals(pushlog_mirror.query_pushid_range(repo_url, 21, 21),
+                              [self._tip(21)])
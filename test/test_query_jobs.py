@@ -1,4 +1,8 @@
 import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
 from mock import patch, Mock
@@ -120,14 +124,26 @@ def mock_response(content, status):
     return response
 
 
+def _patch_module(test_case, module, **values):
+    """Replace attributes of 'module' until 'test_case' is over."""
+    for name, value in values.iteritems():
+        patcher = patch.object(module, name, value)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
 class TestBuildApiGetAllJobs(unittest.TestCase):
 
     def setUp(self):
         self.query_api = BuildApi()
-        buildapi.JOBS_CACHE = {}
-        query_jobs.JOBS_CACHE = {}
+        self.tmpdir = tempfile.mkdtemp()
+        _patch_module(self, buildapi, JOBS_SCHEDULES_DIR=self.tmpdir)
+        _patch_module(self, query_jobs, JOBS_CACHE={}, JOBS_CACHE_METADATA={})
 
-    @patch('requests.get', return_value=mock_response(JOBS_SCHEDULE, 200))
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @patch('requests.Session.get', return_value=mock_response(JOBS_SCHEDULE, 200))
     @patch('mozci.sources.pushlog.valid_revision', return_value=True)
     @patch('mozci.sources.buildapi.get_credentials', return_value=None)
     @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
@@ -144,7 +160,7 @@ class TestBuildApiGetAllJobs(unittest.TestCase):
             query_jobs.JOBS_CACHE[("try", "146071751b1e")],
             json.loads(JOBS_SCHEDULE))
 
-    @patch('requests.get', return_value=mock_response(JOBS_SCHEDULE, 200))
+    @patch('requests.Session.get', return_value=mock_response(JOBS_SCHEDULE, 200))
     @patch('mozci.sources.pushlog.valid_revision', return_value=True)
     @patch('mozci.sources.buildapi.get_credentials', return_value=None)
     @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
@@ -159,7 +175,7 @@ class TestBuildApiGetAllJobs(unittest.TestCase):
         # cache without calling get
         assert get.call_count == 0
 
-    @patch('requests.get', return_value=mock_response(JOBS_SCHEDULE, 400))
+    @patch('requests.Session.get', return_value=mock_response(JOBS_SCHEDULE, 400))
     @patch('mozci.sources.pushlog.valid_revision', return_value=True)
     @patch('mozci.sources.buildapi.get_credentials', return_value=None)
     @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
@@ -172,11 +188,127 @@ class TestBuildApiGetAllJobs(unittest.TestCase):
     @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
     def test_bad_revision(self, query_repo_url, valid_revision):
         """If an invalid revision is passed, _get_all_jobs should raise an Exception ."""
-        print "****", buildapi.JOBS_CACHE, query_jobs.JOBS_CACHE
         with self.assertRaises(Exception):
             self.query_api._get_all_jobs("try", "146071751b1e")
 
 
+class TestBuildApiJobsCacheFreshness(unittest.TestCase):
+
+    def setUp(self):
+        self.query_api = BuildApi()
+        self.tmpdir = tempfile.mkdtemp()
+        _patch_module(self, buildapi, JOBS_SCHEDULES_DIR=self.tmpdir)
+        _patch_module(self, query_jobs, JOBS_CACHE={}, JOBS_CACHE_METADATA={})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @patch('requests.Session.get', return_value=mock_response(JOBS_SCHEDULE, 200))
+    @patch('mozci.sources.pushlog.valid_revision', return_value=True)
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
+    def test_completed_jobs_never_expire(self, query_repo_url, get_credentials,
+                                         valid_revision, get):
+        """Revisions whose jobs have all completed should not be fetched again."""
+        self.query_api._get_all_jobs("try", "146071751b1e")
+        self.assertEquals(
+            query_jobs.JOBS_CACHE_METADATA[("try", "146071751b1e")]["expires"], None)
+
+    @patch('requests.Session.get', return_value=mock_response(JOBS_SCHEDULE, 200))
+    @patch('mozci.sources.pushlog.valid_revision', return_value=True)
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
+    def test_completed_jobs_from_disk(self, query_repo_url, get_credentials,
+                                      valid_revision, get):
+        """A new process should load the completed jobs from disk instead of fetching them."""
+        self.query_api._get_all_jobs("try", "146071751b1e")
+        query_jobs.JOBS_CACHE = {}
+        query_jobs.JOBS_CACHE_METADATA = {}
+
+        self.assertEquals(
+            self.query_api._get_all_jobs("try", "146071751b1e"), json.loads(JOBS_SCHEDULE))
+        assert get.call_count == 1
+
+        # Once we schedule more jobs on it we cannot trust what we have on disk
+        query_jobs.expire_jobs("try", "146071751b1e")
+        self.assertEquals(buildapi.load_completed_jobs_schedule("try", "146071751b1e"), None)
+
+    @patch('requests.Session.get',
+           return_value=mock_response(BASE_JSON % ('null', 'null', 0, 'null'), 200))
+    @patch('mozci.sources.pushlog.valid_revision', return_value=True)
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
+    def test_running_jobs_expire(self, query_repo_url, get_credentials, valid_revision, get):
+        """Revisions with running jobs should be refreshed with a conditional request."""
+        query_jobs.JOBS_CACHE[("try", "146071751b1e")] = []
+        query_jobs.JOBS_CACHE_METADATA[("try", "146071751b1e")] = {
+            "expires": 0, "validators": {"etag": '"1234"'}}
+        self.query_api._get_all_jobs("try", "146071751b1e")
+
+        self.assertEquals(get.call_args[1]['headers'], {'If-None-Match': '"1234"'})
+        self.assertEquals(len(query_jobs.JOBS_CACHE[("try", "146071751b1e")]), 1)
+        assert query_jobs.JOBS_CACHE_METADATA[("try", "146071751b1e")]["expires"] > 0
+
+    @patch('requests.Session.get', return_value=mock_response('', 304))
+    @patch('mozci.sources.pushlog.valid_revision', return_value=True)
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    @patch('mozci.sources.buildapi.query_repo_url', return_value=None)
+    def test_not_modified(self, query_repo_url, get_credentials, valid_revision, get):
+        """If the jobs have not changed we should keep the cached ones."""
+        query_jobs.JOBS_CACHE[("try", "146071751b1e")] = json.loads(JOBS_SCHEDULE)
+        query_jobs.JOBS_CACHE_METADATA[("try", "146071751b1e")] = {
+            "expires": 0, "validators": {"etag": '"1234"'}}
+        self.assertEquals(
+            self.query_api._get_all_jobs("try", "146071751b1e"), json.loads(JOBS_SCHEDULE))
+
+    def test_expire_running_jobs(self):
+        """Scheduling jobs on a revision should expire its cached jobs, running or not."""
+        for revision, expires in (("146071751b1e", time.time() + 60), ("a" * 12, None)):
+            query_jobs.JOBS_CACHE[("try", revision)] = []
+            query_jobs.JOBS_CACHE_METADATA[("try", revision)] = {
+                "expires": expires, "validators": {"etag": '"1234"'}}
+            query_jobs.expire_jobs("try", revision)
+            self.assertFalse(query_jobs._fresh_in_cache(
+                query_jobs.JOBS_CACHE, query_jobs.JOBS_CACHE_METADATA, ("try", revision)))
+            self.assertEquals(
+                query_jobs.JOBS_CACHE_METADATA[("try", revision)]["validators"],
+                {"etag": '"1234"'})
+
+
+class TestBuildApiPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.query_api = BuildApi()
+        self.tmpdir = tempfile.mkdtemp()
+        _patch_module(self, buildapi, JOBS_SCHEDULES_DIR=self.tmpdir)
+        _patch_module(self, query_jobs, JOBS_CACHE={})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    @patch('mozci.sources.buildapi.query_jobs_schedule')
+    def test_prefetch(self, query_jobs_schedule, get_credentials):
+        """prefetch should fill the cache for the revisions that are not cached yet."""
+        query_jobs.JOBS_CACHE[("try", "4f2decfeb9c5")] = []
+        query_jobs_schedule.return_value = json.loads(JOBS_SCHEDULE)
+        self.query_api.prefetch("try", ["4f2decfeb9c5", "146071751b1e", "fb64168bf663"])
+
+        self.assertEquals(
+            sorted(c[0][1] for c in query_jobs_schedule.call_args_list),
+            ["146071751b1e", "fb64168bf663"])
+        self.assertEquals(
+            query_jobs.JOBS_CACHE[("try", "fb64168bf663")], json.loads(JOBS_SCHEDULE))
+
+    @patch('mozci.sources.buildapi.get_credentials', return_value=None)
+    @patch('mozci.sources.buildapi.query_jobs_schedule',
+           side_effect=buildapi.BuildapiException)
+    def test_prefetch_invalid_revision(self, query_jobs_schedule, get_credentials):
+        """Invalid revisions should not be cached."""
+        self.query_api.prefetch("try", ["123456123456"])
+        assert ("try", "123456123456") not in query_jobs.JOBS_CACHE
+
+
 class TestBuildApiGetJobStatus(unittest.TestCase):
     """Test query_job_status with different types of jobs."""
 
@@ -264,6 +396,8 @@ class TestBuildApiGetMatchingJobs(unittest.TestCase):
 
     def setUp(self):
         self.query_api = BuildApi()
+        _patch_module(self, query_jobs, JOBS_CACHE_METADATA={},
+                      JOBS_CACHE={("try", "146071751b1e"): json.loads(JOBS_SCHEDULE)})
 
     def test_matching_jobs_existing(self):
         """_matching_jobs should return the whole dictionary for a buildername in alljobs."""
@@ -278,3 +412,178 @@ class TestBuildApiGetMatchingJobs(unittest.TestCase):
             self.query_api.get_matching_jobs(
                 "try", "146071751b1e",
                 'Invalid buildername'), [])
+
+
+class TestJobsIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs_cache = query_jobs.JOBS_CACHE
+        query_jobs.JOBS_CACHE = {("try", "146071751b1e"): json.loads(JOBS_SCHEDULE)}
+        query_jobs.TREEHERDER_JOBS_CACHE = {}
+        query_jobs.TREEHERDER_JOBS_CACHE_METADATA = {}
+        self.tmpdir = tempfile.mkdtemp()
+        self.resultset_ids_file = query_jobs.TREEHERDER_RESULTSET_IDS_FILE
+        query_jobs.TREEHERDER_RESULTSET_IDS_FILE = self.tmpdir + "/resultset_ids.json"
+        query_jobs.TREEHERDER_RESULTSET_IDS = None
+
+    def tearDown(self):
+        query_jobs.JOBS_CACHE = self.jobs_cache
+        query_jobs.TREEHERDER_RESULTSET_IDS_FILE = self.resultset_ids_file
+        query_jobs.TREEHERDER_RESULTSET_IDS = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_buildapi_index(self):
+        """The jobs of a revision should be indexed once by buildername and request_id."""
+        query_api = BuildApi()
+        query_api.get_matching_jobs("try", "146071751b1e", 'Linux x86-64 try build')
+        index = query_jobs.JOBS_INDEX[("try", "146071751b1e")]
+        query_api.get_matching_jobs("try", "146071751b1e", 'Invalid buildername')
+        assert query_jobs.JOBS_INDEX[("try", "146071751b1e")] is index
+
+        self.assertEquals(
+            query_api.get_job_by_request_id("try", "146071751b1e", 71123549)["build_id"],
+            72398103)
+
+    def test_treeherder_jobs_are_cached(self):
+        """Looking for several builders on a revision should query treeherder once."""
+        query_api = TreeherderApi()
+        query_api.treeherder_client = Mock()
+        query_api.treeherder_client.get_resultsets.return_value = [
+            {"id": 16679, "revision": "146071751b1e"}]
+        query_api.treeherder_client.get_jobs.return_value = [
+            json.loads(TREEHERDER_JOB % ("success", "completed"))]
+
+        buildername = "Ubuntu VM 12.04 x64 mozilla-inbound opt test mochitest-1"
+        self.assertEquals(
+            len(query_api.get_matching_jobs("mozilla-inbound", "146071751b1e", buildername)), 1)
+        self.assertEquals(
+            query_api.get_matching_jobs("mozilla-inbound", "146071751b1e", "Other builder"), [])
+        assert query_api.treeherder_client.get_jobs.call_count == 1
+
+
+class TestTreeherderApiIterJobs(unittest.TestCase):
+
+    def setUp(self):
+        query_jobs.TREEHERDER_JOBS_CACHE = {}
+        query_jobs.TREEHERDER_JOBS_CACHE_METADATA = {}
+        self.tmpdir = tempfile.mkdtemp()
+        self.resultset_ids_file = query_jobs.TREEHERDER_RESULTSET_IDS_FILE
+        query_jobs.TREEHERDER_RESULTSET_IDS_FILE = self.tmpdir + "/resultset_ids.json"
+        query_jobs.TREEHERDER_RESULTSET_IDS = None
+        query_jobs.UNKNOWN_RESULTSETS = {}
+        self.query_api = TreeherderApi()
+        self.query_api.treeherder_client = Mock()
+        self.query_api.treeherder_client.get_resultsets.side_effect = \
+            lambda repo_name, revision__in, count: [
+                {"id": 16679 + i, "revision": revision + "0" * 28}
+                for i, revision in enumerate(revision__in.split(","))]
+        jobs = [{"id": i, "state": "completed", "result": "success"} for i in range(7)]
+        self.query_api.treeherder_client.get_jobs.side_effect = \
+            lambda repo_name, count, offset, **params: jobs[offset:offset + count]
+
+    def tearDown(self):
+        query_jobs.TREEHERDER_RESULTSET_IDS_FILE = self.resultset_ids_file
+        query_jobs.TREEHERDER_RESULTSET_IDS = None
+        shutil.rmtree(self.tmpdir)
+
+    @patch('mozci.query_jobs.TREEHERDER_PAGE_SIZE', 3)
+    def test_all_pages_are_fetched(self):
+        """Jobs beyond the first page should not be truncated."""
+        jobs = self.query_api._get_all_jobs("mozilla-inbound", "146071751b1e")
+        self.assertEquals([job["id"] for job in jobs], range(7))
+        # The first page alone and the other two in one concurrent wave
+        self.assertEquals(
+            sorted(call[1]["offset"] for call in
+                   self.query_api.treeherder_client.get_jobs.call_args_list), [0, 3, 6])
+
+    @patch('mozci.query_jobs.TREEHERDER_PAGE_SIZE', 2)
+    def test_fields_projection(self):
+        """iter_jobs should only keep the requested fields of every job."""
+        jobs = list(self.query_api.iter_jobs("mozilla-inbound", "146071751b1e", fields=["id"]))
+        self.assertEquals(jobs[0], {"id": 0})
+        self.assertEquals(len(query_jobs.TREEHERDER_JOBS_CACHE[
+            ("mozilla-inbound", "146071751b1e")]), 7)
+
+    def test_resultset_ids(self):
+        """The resultset ids of several revisions should be looked up once and at once."""
+        self.assertEquals(
+            self.query_api.query_resultset_ids("mozilla-inbound", ["146071751b1e", "a" * 12]),
+            {"146071751b1e": 16679, "a" * 12: 16680})
+        query_jobs.TREEHERDER_RESULTSET_IDS = None
+        self.query_api.prefetch("mozilla-inbound", ["146071751b1e", "a" * 12], hidden=True)
+        self.assertEquals(self.query_api.treeherder_client.get_resultsets.call_count, 1)
+        self.assertEquals(len(query_jobs.TREEHERDER_JOBS_CACHE), 4)
+
+    def test_unknown_resultset(self):
+        """Revisions Treeherder does not know should not be asked about again for a while."""
+        self.query_api.treeherder_client.get_resultsets.side_effect = None
+        self.query_api.treeherder_client.get_resultsets.return_value = []
+        for _ in range(2):
+            self.assertEquals(
+                self.query_api.query_resultset_ids("mozilla-inbound", ["b" * 12]), {})
+        self.assertEquals(self.query_api.treeherder_client.get_resultsets.call_count, 1)
+        self.assertFalse(os.path.exists(query_jobs.TREEHERDER_RESULTSET_IDS_FILE))
+
+        with patch('mozci.query_jobs.UNKNOWN_RESULTSETS_TTL', 0):
+            self.query_api.query_resultset_ids("mozilla-inbound", ["b" * 12])
+        self.assertEquals(self.query_api.treeherder_client.get_resultsets.call_count, 2)
+
+
+class TestTreeherderApiGetBuildapiRequestIds(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.request_ids_file = query_jobs.TREEHERDER_REQUEST_IDS_FILE
+        query_jobs.TREEHERDER_REQUEST_IDS_FILE = self.tmpdir + "/request_ids.json"
+        query_jobs.TREEHERDER_REQUEST_IDS = None
+        self.query_api = TreeherderApi()
+        self.query_api.treeherder_client = Mock()
+        self.query_api.treeherder_client.get_artifacts.side_effect = \
+            lambda repo_name, job_id__in, name: [
+                {"job_id": int(job_id), "blob": {"request_id": int(job_id) + 1000}}
+                for job_id in job_id__in.split(",")]
+
+    def tearDown(self):
+        query_jobs.TREEHERDER_REQUEST_IDS_FILE = self.request_ids_file
+        query_jobs.TREEHERDER_REQUEST_IDS = None
+        shutil.rmtree(self.tmpdir)
+
+    @patch('mozci.query_jobs.ARTIFACTS_BATCH_SIZE', 2)
+    def test_batches(self):
+        """The request_ids of several jobs should be fetched in batches."""
+        jobs = [{"id": job_id} for job_id in (3, 1, 2, 1)]
+        self.assertEquals(self.query_api.get_buildapi_request_ids("try", jobs),
+                          [1003, 1001, 1002, 1001])
+        self.assertEquals(self.query_api.treeherder_client.get_artifacts.call_count, 2)
+
+    def test_persistent_cache(self):
+        """Request_ids we have looked up before should be read from disk."""
+        self.assertEquals(self.query_api.get_buildapi_request_id("try", {"id": 5}), 1005)
+        query_jobs.TREEHERDER_REQUEST_IDS = None
+        self.assertEquals(self.query_api.get_buildapi_request_id("try", {"id": 5}), 1005)
+        self.assertEquals(self.query_api.treeherder_client.get_artifacts.call_count, 1)
+
+
+class TestBuildApiFindAllJobsByStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs_cache = query_jobs.JOBS_CACHE
+        query_jobs.COALESCED_CACHE = {}
+        jobs = json.loads(BASE_JSON % (SUCCESS, 1433166610, 1, 1433166609))
+        jobs[0]["requests"][0]["revision"] = "146071751b1e"
+        query_jobs.JOBS_CACHE = {("try", "146071751b1e"): jobs}
+
+    def tearDown(self):
+        query_jobs.JOBS_CACHE = self.jobs_cache
+
+    @patch('mozci.query_jobs.query_jobs_data')
+    def test_coalesced_jobs_are_classified_once(self, query_jobs_data):
+        """The successful jobs of a revision should be looked up in buildjson at once."""
+        query_jobs_data.return_value = {
+            71123549: {"properties": {"revision": "2bcb1ec25d42"}}}
+        query_api = BuildApi()
+        self.assertEquals(
+            query_api.find_all_jobs_by_status("try", "146071751b1e", COALESCED), [71123549])
+        self.assertEquals(
+            query_api.find_all_jobs_by_status("try", "146071751b1e", COALESCED), [71123549])
+        self.assertEquals(query_jobs_data.call_count, 1)